@@ -3,7 +3,7 @@ from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 
 from requests_tracker import APP_NAME
-from requests_tracker.settings import get_config
+from requests_tracker.settings import get_settings
 from requests_tracker.sql.sql_hook import install_sql_hook
 
 
@@ -12,6 +12,5 @@ class RequestsTrackerConfig(AppConfig):
     verbose_name = _("Requests tracker")
 
     def ready(self) -> None:
-        requests_tracker_config = get_config()
-        if settings.DEBUG and requests_tracker_config.get("TRACK_SQL", True):
+        if settings.DEBUG and get_settings().track_sql:
             install_sql_hook()
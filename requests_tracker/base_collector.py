@@ -4,6 +4,11 @@ import abc
 class Collector(metaclass=abc.ABCMeta):
     """Base collector for all collectors except for MainRequestCollector"""
 
+    # Approximate number of bytes retained by the collector
+    footprint: int = 0
+    # Nanoseconds the tracker spent collecting, on top of the request's own work
+    overhead_ns: int = 0
+
     @abc.abstractmethod
     def generate_statistics(self) -> None:
         raise NotImplementedError()
@@ -11,3 +16,19 @@ class Collector(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def matches_search_filter(self, search: str) -> bool:
         raise NotImplementedError()
+
+    @abc.abstractmethod
+    def compact(self) -> None:
+        """
+        Drops the details of what was collected, only keeping a summary. Called for
+        finished requests which are not interesting enough to keep in full.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def release(self) -> None:
+        """
+        Releases what the collector holds outside of memory, such as temporary
+        files. Called when the request is removed from the store.
+        """
+        raise NotImplementedError()
@@ -0,0 +1,257 @@
+import os
+import threading
+from tempfile import SpooledTemporaryFile
+from typing import IO, Any, AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+
+from requests_tracker.base_collector import Collector
+
+# Size of the chunks captured bodies are read back in
+BODY_CHUNK_SIZE = 64 * 1024
+# Number of bytes of a body shown in the request details
+BODY_PREVIEW_SIZE = 4 * 1024
+
+
+class CapturedBody:
+    """
+    A request or response body, captured while it is read or sent.
+
+    Up to ``memory_limit`` bytes are kept in memory, larger bodies are spooled to a
+    temporary file on disk. Bytes beyond ``max_size`` are not captured, but they
+    are still counted in ``size``.
+    """
+
+    content_type: Optional[str]
+    memory_limit: int
+    max_size: int
+    # Number of bytes of the body seen and captured so far
+    size: int
+    captured_size: int
+    # Whether the whole body has been read or sent
+    complete: bool
+
+    _file: "SpooledTemporaryFile[bytes]"
+
+    def __init__(
+        self,
+        content_type: Optional[str],
+        memory_limit: int,
+        max_size: int,
+    ) -> None:
+        self.content_type = content_type
+        self.memory_limit = memory_limit
+        self.max_size = max_size
+        self.size = 0
+        self.captured_size = 0
+        self.complete = False
+        self._file = SpooledTemporaryFile(max_size=memory_limit)
+        self._lock = threading.Lock()
+
+    @property
+    def truncated(self) -> bool:
+        return self.size > self.captured_size
+
+    @property
+    def in_memory_size(self) -> int:
+        """Number of captured bytes held in memory rather than on disk"""
+        return self.captured_size if self.captured_size <= self.memory_limit else 0
+
+    def write(self, data: bytes) -> None:
+        with self._lock:
+            self.size += len(data)
+            remaining = self.max_size - self.captured_size
+            if data and remaining > 0 and not self._file.closed:
+                data = data[:remaining]
+                # Reading the body back moves the position of the file
+                self._file.seek(0, os.SEEK_END)
+                self._file.write(data)
+                self.captured_size += len(data)
+
+    def finish(self) -> None:
+        self.complete = True
+
+    def iter_chunks(self, chunk_size: int = BODY_CHUNK_SIZE) -> Iterator[bytes]:
+        """Streams the captured body back, without loading it into memory at once"""
+        position = 0
+        while True:
+            with self._lock:
+                if self._file.closed:
+                    return
+                self._file.seek(position)
+                chunk = self._file.read(chunk_size)
+            if not chunk:
+                return
+            position += len(chunk)
+            yield chunk
+
+    @property
+    def preview(self) -> str:
+        """The start of the body, decoded for display"""
+        chunk = next(self.iter_chunks(BODY_PREVIEW_SIZE), b"")
+        return chunk.decode("utf-8", errors="replace")
+
+    @property
+    def has_more_than_preview(self) -> bool:
+        return self.captured_size > BODY_PREVIEW_SIZE
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class _CapturingStream:
+    """Wraps the stream of a request, capturing what is read from it"""
+
+    def __init__(self, stream: IO[bytes], body: CapturedBody) -> None:
+        self._stream = stream
+        self._body = body
+
+    def read(self, *args: Any, **kwargs: Any) -> bytes:
+        data = self._stream.read(*args, **kwargs)
+        self._body.write(data)
+        return data
+
+    def readline(self, *args: Any, **kwargs: Any) -> bytes:
+        data = self._stream.readline(*args, **kwargs)
+        self._body.write(data)
+        return data
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+def _capture_chunks(chunks: Iterable[bytes], body: CapturedBody) -> Iterator[bytes]:
+    try:
+        for chunk in chunks:
+            body.write(chunk)
+            yield chunk
+    finally:
+        body.finish()
+
+
+async def _capture_chunks_async(
+    chunks: AsyncIterator[bytes], body: CapturedBody
+) -> AsyncIterator[bytes]:
+    try:
+        async for chunk in chunks:
+            body.write(chunk)
+            yield chunk
+    finally:
+        body.finish()
+
+
+class BodyCollector(Collector):
+    """
+    Captures the request and response bodies, when ``CAPTURE_BODIES`` is enabled.
+
+    Bodies are captured as they are read and sent, nothing is buffered on top of
+    what Django does anyway. The request body is captured as the view reads it from
+    the request stream and streaming responses are captured as their chunks are
+    sent, so large uploads and downloads are not held in memory. Only the part of
+    the request body the view read is captured.
+    """
+
+    memory_limit: int
+    max_size: int
+    request_body: Optional[CapturedBody]
+    response_body: Optional[CapturedBody]
+
+    def __init__(self, memory_limit: int, max_size: int) -> None:
+        self.memory_limit = memory_limit
+        self.max_size = max_size
+        self.request_body = None
+        self.response_body = None
+        self.footprint = 0
+
+    def _create_body(self, content_type: Optional[str]) -> CapturedBody:
+        return CapturedBody(content_type, self.memory_limit, self.max_size)
+
+    def process_request(self, request: HttpRequest) -> None:
+        """Starts capturing the request body, must be called before the view runs"""
+        body = self.request_body = self._create_body(request.META.get("CONTENT_TYPE"))
+        # The body was already read, e.g. by a middleware
+        if hasattr(request, "_body"):
+            body.write(request._body)
+            body.finish()
+        elif hasattr(request, "_stream"):
+            request._stream = _CapturingStream(  # type: ignore[assignment]
+                request._stream, body
+            )
+        self._update_footprint()
+
+    def process_response(self, response: HttpResponseBase) -> None:
+        if self.request_body is not None:
+            self.request_body.finish()
+
+        body = self.response_body = self._create_body(response.get("Content-Type"))
+        if isinstance(response, StreamingHttpResponse):
+            if response.is_async:
+                response.streaming_content = _capture_chunks_async(
+                    response.streaming_content,  # type: ignore[arg-type]
+                    body,
+                )
+            else:
+                response.streaming_content = _capture_chunks(
+                    response.streaming_content,  # type: ignore[arg-type]
+                    body,
+                )
+        else:
+            if isinstance(response, HttpResponse):
+                body.write(response.content)
+            body.finish()
+        self._update_footprint()
+
+    def get_body(self, name: str) -> Optional[CapturedBody]:
+        if name == "request":
+            return self.request_body
+        if name == "response":
+            return self.response_body
+        return None
+
+    def get_bodies(self) -> List[Tuple[str, CapturedBody]]:
+        """The captured bodies, with the name they are served under"""
+        return [
+            (name, body)
+            for name, body in (
+                ("request", self.request_body),
+                ("response", self.response_body),
+            )
+            if body is not None
+        ]
+
+    def finish_streaming(self) -> None:
+        """
+        Called once a streaming response was sent or closed, so the footprint
+        reflects how much of the body ended up in memory
+        """
+        if self.response_body is not None:
+            self.response_body.finish()
+        self._update_footprint()
+
+    def _update_footprint(self) -> None:
+        # Bodies still being read or sent may grow up to the memory limit
+        self.footprint = sum(
+            body.in_memory_size if body.complete else self.memory_limit
+            for body in (self.request_body, self.response_body)
+            if body is not None
+        )
+
+    # Bodies can be large and spooled to disk, so they are not searched
+    def matches_search_filter(self, search: str) -> bool:
+        return False
+
+    def generate_statistics(self) -> None: ...
+
+    def compact(self) -> None:
+        for body in (self.request_body, self.response_body):
+            if body is not None:
+                body.close()
+        self.request_body = None
+        self.response_body = None
+        self.footprint = 0
+
+    def release(self) -> None:
+        # Closing the bodies removes the temporary files they were spooled to
+        self.compact()
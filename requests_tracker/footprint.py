@@ -0,0 +1,99 @@
+import sys
+from types import CodeType
+from typing import Any, Dict, List, Tuple
+
+# Containers are only followed this many levels deep, anything below is counted
+# with its shallow size only.
+MAX_DEPTH = 4
+
+# Sizes the estimates of approximate_flat_size are built from
+STR_SIZE = sys.getsizeof("")
+CONTAINER_SIZE = sys.getsizeof(())
+DICT_SIZE = sys.getsizeof({})
+POINTER_SIZE = 8
+# Numbers, dates and other objects not measured one by one
+OBJECT_SIZE = 32
+
+_slots_cache: Dict[type, Tuple[str, ...]] = {}
+
+
+def approximate_size(value: Any, depth: int = 0) -> int:
+    """
+    Returns an approximation of the number of bytes retained by ``value``.
+
+    Builtin containers and the attributes of objects are followed recursively.
+    Objects shared between several containers, such as interned strings, are
+    counted every time they are found, so the result is an upper bound rather than
+    an exact figure.
+    """
+    # Code objects are shared by every frame of a function and belong to its module
+    if isinstance(value, CodeType):
+        return 0
+
+    size = sys.getsizeof(value, 0)
+
+    if depth >= MAX_DEPTH or isinstance(value, (str, bytes, type)):
+        return size
+
+    if isinstance(value, dict):
+        size += sum(
+            approximate_size(key, depth + 1) + approximate_size(item, depth + 1)
+            for key, item in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, depth + 1) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += approximate_size(vars(value), depth + 1)
+    else:
+        for slot in _get_slots(type(value)):
+            if hasattr(value, slot):
+                size += approximate_size(getattr(value, slot), depth + 1)
+
+    return size
+
+
+def approximate_flat_size(value: Any) -> int:
+    """
+    A cheap estimate of :func:`approximate_size`, for values recorded on hot paths
+    such as query parameters and the WSGI environ.
+
+    Strings are counted by their length and any other object by a fixed size. Only
+    the items of dicts, lists and tuples are looked at, nested containers are
+    counted by their number of items.
+    """
+    if isinstance(value, dict):
+        return DICT_SIZE + sum(
+            POINTER_SIZE * 2
+            + _approximate_item_size(key)
+            + _approximate_item_size(item)
+            for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return CONTAINER_SIZE + sum(
+            POINTER_SIZE + _approximate_item_size(item) for item in value
+        )
+    return _approximate_item_size(value)
+
+
+def _approximate_item_size(value: Any) -> int:
+    if isinstance(value, (str, bytes)):
+        return STR_SIZE + len(value)
+    if isinstance(value, (list, tuple, dict)):
+        return CONTAINER_SIZE + len(value) * (POINTER_SIZE + OBJECT_SIZE)
+    return OBJECT_SIZE
+
+
+def _get_slots(cls: type) -> Tuple[str, ...]:
+    if cls in _slots_cache:
+        return _slots_cache[cls]
+
+    slots: List[str] = []
+    for klass in cls.__mro__:
+        klass_slots = getattr(klass, "__slots__", ())
+        if isinstance(klass_slots, str):
+            klass_slots = (klass_slots,)
+        slots.extend(
+            slot for slot in klass_slots if slot not in ("__dict__", "__weakref__")
+        )
+    _slots_cache[cls] = tuple(slots)
+    return _slots_cache[cls]
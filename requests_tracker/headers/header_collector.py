@@ -1,19 +1,28 @@
 from itertools import chain
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
 from django.http import HttpRequest, HttpResponse
 
 from requests_tracker.base_collector import Collector
+from requests_tracker.footprint import approximate_size
+
+HeadersType = Tuple[Dict[str, str], Dict[str, str], Dict[str, str]]
 
 
 class HeaderCollector(Collector):
     """
     Collects the request's HTTP headers.
+
+    Headers are only looked at for the few requests someone opens, so processing a
+    request only picks the relevant entries out of ``request.META``. They are
+    unmangled and sorted when the headers are first accessed.
     """
 
-    request_headers: Dict[str, str]
-    response_headers: Dict[str, str]
-    environ: Dict[str, str]
+    # The HTTP headers and filtered environment variables of request.META
+    _request_meta: List[Tuple[str, str]]
+    _response_items: List[Tuple[str, str]]
+    # The request headers, response headers and environment, once first accessed
+    _headers: Optional[HeadersType]
 
     # List of environment variables we want to display
     ENVIRON_FILTER = {
@@ -36,30 +45,65 @@ class HeaderCollector(Collector):
     }
 
     def __init__(self) -> None:
-        self.request_headers = {}
-        self.response_headers = {}
-        self.environ = {}
+        self._request_meta = []
+        self._response_items = []
+        self._headers = None
+        self.footprint = 0
 
     def process_request(self, request: HttpRequest, response: HttpResponse) -> None:
-        request_env = sorted(request.META.items())
-        self.request_headers = {
-            unmangle(key): value for (key, value) in request_env if is_http_header(key)
-        }
-        self.response_headers = dict(response.items())
-        self.environ = {
-            key: value for (key, value) in request_env if key in self.ENVIRON_FILTER
-        }
+        meta = request.META
+        # Under runserver META holds the whole OS environment, so it is only scanned
+        # once, without sorting it or calling a function per entry
+        self._request_meta = [
+            (key, value) for key, value in meta.items() if key[:5] == "HTTP_"
+        ]
+        self._request_meta.extend(
+            (key, meta[key]) for key in meta.keys() & self.ENVIRON_FILTER
+        )
+        self._response_items = list(response.items())
+        self._headers = None
+        self.footprint = approximate_size(self._request_meta) + approximate_size(
+            self._response_items
+        )
+
+    def _get_headers(self) -> HeadersType:
+        headers = self._headers
+        if headers is None:
+            request_meta = sorted(self._request_meta)
+            headers = self._headers = (
+                {
+                    unmangle(key): value
+                    for key, value in request_meta
+                    if is_http_header(key)
+                },
+                dict(self._response_items),
+                {
+                    key: value
+                    for key, value in request_meta
+                    if key in self.ENVIRON_FILTER
+                },
+            )
+        return headers
+
+    @property
+    def request_headers(self) -> Dict[str, str]:
+        return self._get_headers()[0]
+
+    @property
+    def response_headers(self) -> Dict[str, str]:
+        return self._get_headers()[1]
+
+    @property
+    def environ(self) -> Dict[str, str]:
+        return self._get_headers()[2]
 
     def matches_search_filter(self, search: str) -> bool:
         search = search.lower()
+        # Searches the captured values, without unmangling and sorting the headers
         return next(
             (
                 True
-                for header_value in chain(
-                    self.request_headers.values(),
-                    self.response_headers.values(),
-                    self.environ.values(),
-                )
+                for _, header_value in chain(self._request_meta, self._response_items)
                 if search in header_value.lower()
             ),
             False,
@@ -67,6 +111,11 @@ class HeaderCollector(Collector):
 
     def generate_statistics(self) -> None: ...
 
+    # The headers are small and are kept, so compacted requests can still be searched
+    def compact(self) -> None: ...
+
+    def release(self) -> None: ...
+
 
 def is_http_header(key: str) -> bool:
     # The WSGI spec says that keys should be str objects in the environ dict,
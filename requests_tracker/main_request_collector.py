@@ -1,71 +1,238 @@
 from datetime import datetime
-from typing import Any, Dict, Optional
+from time import perf_counter_ns
+from typing import Any, Dict, Iterator, Optional, Tuple
 from uuid import UUID, uuid4
 
-from django.http import HttpRequest, HttpResponse
-from django.urls import Resolver404, resolve
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
 
 from requests_tracker.base_collector import Collector
+from requests_tracker.body.body_collector import BodyCollector
+from requests_tracker.footprint import approximate_size
 from requests_tracker.headers.header_collector import HeaderCollector
+from requests_tracker.resolver import resolve_request
+from requests_tracker.settings import get_settings
+from requests_tracker.snapshots import RequestSnapshot, ResponseSnapshot
 from requests_tracker.sql.sql_collector import SQLCollector
 
 
 class MainRequestCollector:
+    """
+    Collects everything about a single request.
+
+    The live request is only referenced while it is being processed, once the
+    request is wrapped up only the request and response snapshots are kept.
+
+    Streaming responses are only finished once their content was sent, see
+    ``finish_streaming``, so their duration includes generating the content.
+
+    With ``TAIL_BASED_RETENTION`` enabled, requests which turn out not to be
+    interesting are compacted when they are finished, so their collectors only
+    keep a summary.
+    """
+
     request_id: UUID
-    request: HttpRequest
+    request: RequestSnapshot
     django_view: str
+    # Wall clock times, for display
     start_time: datetime
     end_time: Optional[datetime]
-    response: Optional[HttpResponse]
+    # Monotonic perf_counter_ns timestamps, which durations are measured with
+    start_ns: int
+    end_ns: Optional[int]
+    # When the view returned the response and when its first byte was produced
+    response_ns: Optional[int]
+    first_byte_ns: Optional[int]
+    response: Optional[ResponseSnapshot]
+    bytes_sent: int
+    request_response_footprint: int
+    compacted: bool
+    # Nanoseconds the middleware spent tracking the request, the collectors keep
+    # track of their own overhead
+    overhead_ns: int
+
+    _live_request: Optional[HttpRequest]
 
     sql_collector: SQLCollector
     header_collector: HeaderCollector
+    # Only set when CAPTURE_BODIES is enabled
+    body_collector: Optional[BodyCollector]
 
     def __init__(self, request: HttpRequest):
         self.request_id = uuid4()
-        self.request = request
-        try:
-            self.django_view = resolve(self.request.path)._func_path
-        except Resolver404:
-            self.django_view = "NOT FOUND"
+        self.request = RequestSnapshot.from_request(request)
+        self._live_request = request
+        self.django_view = resolve_request(request).django_view
         self.start_time = datetime.now()
         self.end_time = None
+        self.start_ns = perf_counter_ns()
+        self.end_ns = None
+        self.response_ns = None
+        self.first_byte_ns = None
         self.response = None
+        self.bytes_sent = 0
+        self.compacted = False
+        self.overhead_ns = 0
+        # The live request is owned by Django, only the snapshots taken when the
+        # request is wrapped up are retained by the tracker
+        self.request_response_footprint = 0
 
-        self.sql_collector = SQLCollector()
+        self.sql_collector = SQLCollector(start_time=self.start_ns)
         self.header_collector = HeaderCollector()
 
+        config = get_settings()
+        self.body_collector = None
+        if config.capture_bodies:
+            self.body_collector = BodyCollector(
+                memory_limit=config.body_memory_limit,
+                max_size=config.max_body_size,
+            )
+            self.body_collector.process_request(request)
+
     def wrap_up_request(self, response: HttpResponse) -> None:
         """
-        Called after Django has processed the request, before response is returned
+        Called after Django has processed the request, before response is returned.
+        Requests with a streaming response are finished by ``finish_streaming``.
         """
+        self.response_ns = perf_counter_ns()
+        if self._live_request is not None:
+            self.header_collector.process_request(self._live_request, response)
+        if self.body_collector is not None:
+            self.body_collector.process_response(response)
+        self.response = ResponseSnapshot.from_response(response)
+        self._live_request = None
+        self.request_response_footprint = approximate_size(
+            (self.request, self.response)
+        )
+
+        if not isinstance(response, StreamingHttpResponse):
+            self.first_byte_ns = self.response_ns
+            self.bytes_sent = self.response.content_length or 0
+            self._finish()
+
+    def record_chunk(self, chunk: bytes) -> None:
+        """Called for every chunk of a streaming response, as it is sent"""
+        if self.first_byte_ns is None:
+            self.first_byte_ns = perf_counter_ns()
+        self.bytes_sent += len(chunk)
+
+    def finish_streaming(self) -> None:
+        """Called once the content of a streaming response was sent"""
+        if self.end_ns is None:
+            if self.body_collector is not None:
+                self.body_collector.finish_streaming()
+            self._finish()
+
+    def _finish(self) -> None:
         self.set_end_time()
-        self.response = response
-        self.header_collector.process_request(self.request, self.response)
+        config = get_settings()
+        if config.tail_based_retention and not self.is_interesting(
+            config.slow_request_threshold
+        ):
+            self.compact()
+
+    def is_interesting(self, slow_request_threshold: float) -> bool:
+        """
+        Whether the request is worth keeping in full, because it was slow, failed or
+        ran slow, similar or duplicate queries
+        """
+        duration = self.duration
+        sql_collector = self.sql_collector
+        return (
+            (duration is not None and duration >= slow_request_threshold)
+            or self.response is None
+            or not 200 <= self.response.status_code < 300
+            or sql_collector.num_slow_queries > 0
+            or sql_collector.total_similar_queries > 0
+        )
+
+    def compact(self) -> None:
+        """Only keeps a summary of what the collectors collected"""
+        for _, collector in self._iter_collectors():
+            collector.compact()
+        self.compacted = True
+
+    def release(self) -> None:
+        """Releases what the collectors hold outside of memory, see Collector"""
+        for _, collector in self._iter_collectors():
+            collector.release()
 
     @property
-    def duration(self) -> Optional[int]:
+    def duration(self) -> Optional[float]:
         """duration in milliseconds"""
         return (
-            int((self.end_time - self.start_time).total_seconds() * 1000)
-            if self.end_time is not None
+            (self.end_ns - self.start_ns) / 1_000_000
+            if self.end_ns is not None
             else None
         )
 
+    @property
+    def time_to_first_byte(self) -> Optional[float]:
+        """Milliseconds until the first byte of the response was produced"""
+        if self.first_byte_ns is None:
+            return None
+        return (self.first_byte_ns - self.start_ns) / 1_000_000
+
+    @property
+    def streaming_duration(self) -> Optional[float]:
+        """Milliseconds spent sending the content of a streaming response"""
+        if self.response is None or not self.response.streaming:
+            return None
+        if self.end_ns is None or self.response_ns is None:
+            return None
+        return (self.end_ns - self.response_ns) / 1_000_000
+
+    @property
+    def total_overhead_ns(self) -> int:
+        """Nanoseconds the tracker spent on the request, including its collectors"""
+        return self.overhead_ns + sum(
+            collector.overhead_ns for _, collector in self._iter_collectors()
+        )
+
+    @property
+    def overhead(self) -> float:
+        """Milliseconds the tracker spent on the request itself"""
+        return self.total_overhead_ns / 1_000_000
+
+    @property
+    def overhead_percentage(self) -> Optional[float]:
+        """How much of the duration of the request the tracker is responsible for"""
+        duration = self.duration
+        return self.overhead / duration * 100 if duration else None
+
     @property
     def finished(self) -> bool:
-        return self.response is not None
+        return self.response is not None and self.end_ns is not None
 
     def set_end_time(self) -> None:
+        self.end_ns = perf_counter_ns()
         self.end_time = datetime.now()
 
-    def get_collectors(self) -> Dict[str, Collector]:
-        collectors: Dict[str, Collector] = {}
+    @property
+    def footprint(self) -> int:
+        """Approximate number of bytes retained by the request and its collectors"""
+        return self.request_response_footprint + sum(
+            collector.footprint for _, collector in self._iter_collectors()
+        )
 
+    def _iter_collectors(self) -> Iterator[Tuple[str, Collector]]:
         for attribute_name, attribute_value in self.__dict__.items():
             if isinstance(attribute_value, Collector):
-                attribute_value.generate_statistics()
-                collectors[attribute_name] = attribute_value
+                yield attribute_name, attribute_value
+
+    def get_collectors(self) -> Dict[str, Collector]:
+        """
+        The collectors with up to date statistics. Collectors keep their statistics
+        up to date as they collect, so this is cheap for finished requests. The
+        statistics of requests still being processed are left as they are, as they
+        would be outdated by the next thing collected anyway.
+        """
+        collectors: Dict[str, Collector] = {}
+        finished = self.finished
+
+        for attribute_name, collector in self._iter_collectors():
+            if finished:
+                collector.generate_statistics()
+            collectors[attribute_name] = collector
 
         return collectors
 
@@ -77,8 +244,15 @@ class MainRequestCollector:
             "start_time": self.start_time,
             "end_time": self.end_time,
             "duration": self.duration,
+            "time_to_first_byte": self.time_to_first_byte,
+            "streaming_duration": self.streaming_duration,
             "response": self.response,
+            "bytes_sent": self.bytes_sent,
             "finished": self.finished,
+            "compacted": self.compacted,
+            "footprint": self.footprint,
+            "overhead": self.overhead,
+            "overhead_percentage": self.overhead_percentage,
             **self.get_collectors(),
         }
 
@@ -90,7 +264,7 @@ class MainRequestCollector:
             or next(
                 (
                     True
-                    for collector in self.get_collectors().values()
+                    for _, collector in self._iter_collectors()
                     if collector.matches_search_filter(search)
                 ),
                 False,
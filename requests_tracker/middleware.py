@@ -1,49 +1,59 @@
 import asyncio
-import re
-from typing import Any, Dict
-from uuid import UUID
+from time import perf_counter_ns
+from typing import Any
 
-from django.http import HttpRequest
-from django.urls import Resolver404, resolve
+from django.http import HttpRequest, StreamingHttpResponse
 from django.utils.decorators import sync_and_async_middleware
 
-from requests_tracker import APP_NAME
 from requests_tracker.main_request_collector import MainRequestCollector
-from requests_tracker.settings import debug_application, get_config
+from requests_tracker.request_store import RequestStore
+from requests_tracker.resolver import resolve_request
+from requests_tracker.sampling import RequestSampler
+from requests_tracker.settings import debug_application, get_settings
 from requests_tracker.sql.sql_tracker import SQLTracker
+from requests_tracker.streaming import track_streaming_response
 
 
 class RequestWithCollectors(HttpRequest):
-    request_collectors: Dict[UUID, MainRequestCollector]
+    request_collectors: RequestStore
 
 
 def is_requests_tracker_request(request: HttpRequest) -> bool:
-    try:
-        resolver_match = request.resolver_match or resolve(
-            request.path,
-            getattr(request, "urlconf", None),
-        )
-    except Resolver404:
-        return False
-    return bool(resolver_match.namespaces and resolver_match.namespaces[-1] == APP_NAME)
+    return resolve_request(request).is_requests_tracker
 
 
 def is_ignored_request(request: HttpRequest) -> bool:
-    config = get_config()
+    ignore_pattern = get_settings().ignore_paths_pattern
+    return ignore_pattern is not None and ignore_pattern.match(request.path)
 
-    if ignore_patterns := config.get("IGNORE_PATHS_PATTERNS"):
-        for pattern in ignore_patterns:
-            if re.match(pattern, request.path):
-                return True
 
-    return False
+def wrap_up_request(
+    response: Any,
+    request_collector: MainRequestCollector,
+    request_collectors: RequestStore,
+    sql_tracker: SQLTracker,
+) -> None:
+    overhead_start_ns = perf_counter_ns()
+    request_collector.wrap_up_request(response)
+    if isinstance(response, StreamingHttpResponse):
+        # Finished once the content was sent
+        track_streaming_response(
+            response, request_collector, request_collectors, sql_tracker
+        )
+        request_collector.overhead_ns += perf_counter_ns() - overhead_start_ns
+    else:
+        # The store records the overhead of the request when it finishes
+        request_collector.overhead_ns += perf_counter_ns() - overhead_start_ns
+        request_collectors.finish(request_collector)
 
 
 async def middleware_async(
     request: RequestWithCollectors,
     get_response: Any,
-    request_collectors: Dict[UUID, MainRequestCollector],
+    request_collectors: RequestStore,
+    request_sampler: RequestSampler,
 ) -> Any:
+    overhead_start_ns = perf_counter_ns()
     if not debug_application(request) or is_ignored_request(request):
         return await get_response(request)
 
@@ -56,12 +66,17 @@ async def middleware_async(
         request.request_collectors = request_collectors
         return await get_response(request)
 
+    if not request_sampler.should_track(request):
+        return await get_response(request)
+
     request_collector = MainRequestCollector(request)
-    request_collectors[request_collector.request_id] = request_collector
+    request_collectors.add(request_collector)
+    request_collector.overhead_ns += perf_counter_ns() - overhead_start_ns
 
-    with SQLTracker(request_collector.sql_collector):
+    with SQLTracker(request_collector.sql_collector) as sql_tracker:
         response = await get_response(request)
-    request_collector.wrap_up_request(response)
+
+    wrap_up_request(response, request_collector, request_collectors, sql_tracker)
 
     return response
 
@@ -69,8 +84,10 @@ async def middleware_async(
 def middleware_sync(
     request: RequestWithCollectors,
     get_response: Any,
-    request_collectors: Dict[UUID, MainRequestCollector],
+    request_collectors: RequestStore,
+    request_sampler: RequestSampler,
 ) -> Any:
+    overhead_start_ns = perf_counter_ns()
     if not debug_application(request) or is_ignored_request(request):
         return get_response(request)
 
@@ -83,12 +100,17 @@ def middleware_sync(
         request.request_collectors = request_collectors
         return get_response(request)
 
+    if not request_sampler.should_track(request):
+        return get_response(request)
+
     request_collector = MainRequestCollector(request)
-    request_collectors[request_collector.request_id] = request_collector
+    request_collectors.add(request_collector)
+    request_collector.overhead_ns += perf_counter_ns() - overhead_start_ns
 
-    with SQLTracker(request_collector.sql_collector):
+    with SQLTracker(request_collector.sql_collector) as sql_tracker:
         response = get_response(request)
-    request_collector.wrap_up_request(response)
+
+    wrap_up_request(response, request_collector, request_collectors, sql_tracker)
 
     return response
 
@@ -97,16 +119,30 @@ def middleware_sync(
 def requests_tracker_middleware(
     get_response: Any,
 ) -> Any:
-    request_collectors: Dict[UUID, MainRequestCollector] = {}
+    config = get_settings()
+    request_collectors = RequestStore(
+        max_requests=config.max_requests,
+        max_age=config.max_request_age,
+        max_memory=config.max_memory,
+    )
+    request_sampler = RequestSampler(
+        sample_rate=config.sample_rate,
+        max_per_view_per_second=config.max_requests_per_view_per_second,
+        force_header=config.force_tracking_header,
+    )
 
     if asyncio.iscoroutinefunction(get_response):
 
         async def middleware(request: RequestWithCollectors) -> Any:
-            return await middleware_async(request, get_response, request_collectors)
+            return await middleware_async(
+                request, get_response, request_collectors, request_sampler
+            )
 
     else:
 
         def middleware(request: RequestWithCollectors) -> Any:  # type: ignore
-            return middleware_sync(request, get_response, request_collectors)
+            return middleware_sync(
+                request, get_response, request_collectors, request_sampler
+            )
 
     return middleware
@@ -0,0 +1,307 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Iterator, MutableMapping, Optional, Tuple
+from uuid import UUID
+
+from requests_tracker.main_request_collector import MainRequestCollector
+from requests_tracker.sort_index import (
+    DEFAULT_SORTER,
+    SORTERS,
+    SortIndex,
+    SortKey,
+    get_request_id,
+)
+from requests_tracker.stack_trace import get_frame_tables_footprint
+
+# Number of sort keys read from a sort index per lock acquisition
+SORTED_BATCH_SIZE = 64
+
+
+class RequestStore(MutableMapping[UUID, MainRequestCollector]):
+    """
+    Bounded store for the tracked requests.
+
+    Requests that are still being processed are kept apart from finished ones and
+    are never evicted. Finished requests are kept in least recently used order, so
+    evicting the oldest one is a single ``popitem`` on an ordered dict and both
+    inserting and evicting is O(1).
+
+    ``max_requests`` caps the total number of stored requests, ``max_age`` is the
+    number of seconds a finished request is kept after it was finished or last
+    viewed and ``max_memory`` is the number of bytes the stored requests may
+    approximately retain. ``None`` disables the corresponding limit. Expired
+    requests are also evicted when the requests are listed or measured, so they
+    do not outlive ``max_age`` while no requests are tracked.
+
+    The store keeps a sort index per requests_sorter, so listing the requests in any
+    order only costs as much as the requests that are listed. Requests are indexed
+    when they are added and indexed again when they finish, with their final
+    duration and query counts.
+
+    Requests are released when they are evicted, deleted or cleared, which closes
+    the temporary files their captured bodies may have been spooled to.
+    """
+
+    max_requests: Optional[int]
+    max_age: Optional[float]
+    max_memory: Optional[int]
+
+    _in_flight: Dict[UUID, MainRequestCollector]
+    _finished: "OrderedDict[UUID, MainRequestCollector]"
+    _last_used: Dict[UUID, float]
+    _footprints: Dict[UUID, int]
+    _finished_footprint: int
+    # Overhead and duration in nanoseconds of each finished request, and their sums
+    _overheads: Dict[UUID, Tuple[int, int]]
+    _finished_overhead_ns: int
+    _finished_duration_ns: int
+    _sort_indexes: Dict[str, SortIndex]
+
+    def __init__(
+        self,
+        max_requests: Optional[int] = None,
+        max_age: Optional[float] = None,
+        max_memory: Optional[int] = None,
+    ) -> None:
+        self.max_requests = max_requests
+        self.max_age = max_age
+        self.max_memory = max_memory
+        self._in_flight = {}
+        self._finished = OrderedDict()
+        self._last_used = {}
+        # Footprints of finished requests are computed once when they finish
+        self._footprints = {}
+        self._finished_footprint = 0
+        # Overheads of finished requests are recorded once when they finish, so the
+        # totals do not have to go over every stored request
+        self._overheads = {}
+        self._finished_overhead_ns = 0
+        self._finished_duration_ns = 0
+        self._sort_indexes = {
+            requests_sorter: SortIndex(requests_sorter) for requests_sorter in SORTERS
+        }
+        self._lock = threading.RLock()
+
+    @property
+    def footprint(self) -> int:
+        """
+        Approximate number of bytes retained by all stored requests, including the
+        frame tables their stack traces share
+        """
+        with self._lock:
+            self._evict_expired()
+            in_flight = list(self._in_flight.values())
+        return (
+            self._finished_footprint
+            + sum(request_collector.footprint for request_collector in in_flight)
+            + get_frame_tables_footprint()
+        )
+
+    @property
+    def overhead(self) -> float:
+        """Milliseconds the tracker spent on all stored requests"""
+        with self._lock:
+            self._evict_expired()
+            in_flight = list(self._in_flight.values())
+            finished_overhead_ns = self._finished_overhead_ns
+        return (
+            finished_overhead_ns
+            + sum(
+                request_collector.total_overhead_ns for request_collector in in_flight
+            )
+        ) / 1_000_000
+
+    @property
+    def overhead_percentage(self) -> Optional[float]:
+        """How much of the duration of the finished requests the tracker took"""
+        with self._lock:
+            self._evict_expired()
+            finished_overhead_ns = self._finished_overhead_ns
+            finished_duration_ns = self._finished_duration_ns
+        if not finished_duration_ns:
+            return None
+        return finished_overhead_ns / finished_duration_ns * 100
+
+    def add(self, request_collector: MainRequestCollector) -> None:
+        """Adds a request that has just started being processed"""
+        with self._lock:
+            self._in_flight[request_collector.request_id] = request_collector
+            self._index(request_collector.request_id, request_collector)
+            self.evict()
+
+    def finish(self, request_collector: MainRequestCollector) -> None:
+        """Moves a request to the finished requests, making it evictable"""
+        with self._lock:
+            request_id = request_collector.request_id
+            if self._in_flight.pop(request_id, None) is None:
+                # The request was removed while in flight, e.g. the store was cleared,
+                # the response body may have been captured since it was released
+                request_collector.release()
+                return
+            self._add_finished(request_id, request_collector)
+            self._index(request_id, request_collector)
+            self.evict()
+
+    def touch(self, request_id: UUID) -> None:
+        """Marks a finished request as recently used, e.g. when it is viewed"""
+        with self._lock:
+            if request_id in self._finished:
+                self._finished.move_to_end(request_id)
+                self._last_used[request_id] = monotonic()
+
+    def evict(self) -> None:
+        """Evicts finished requests exceeding the configured limits"""
+        with self._lock:
+            self._evict_expired()
+
+            if self.max_requests is not None:
+                while self._finished and len(self) > self.max_requests:
+                    self._pop_oldest()
+
+            if self.max_memory is not None:
+                memory_budget = self.max_memory - (
+                    self.footprint - self._finished_footprint
+                )
+                while self._finished and self._finished_footprint > memory_budget:
+                    self._pop_oldest()
+
+    def _evict_expired(self) -> None:
+        if self.max_age is None:
+            return
+        expired_before = monotonic() - self.max_age
+        while self._finished:
+            oldest_id = next(iter(self._finished))
+            if self._last_used[oldest_id] > expired_before:
+                break
+            self._pop_oldest()
+
+    def iter_sorted(
+        self,
+        requests_sorter: str,
+        descending: bool,
+        after: Optional[SortKey] = None,
+    ) -> Iterator[Tuple[UUID, MainRequestCollector, SortKey]]:
+        """
+        The requests in the order of ``requests_sorter``, following the sort key
+        ``after``, with the sort key each request is indexed under. The lock is only
+        held while a batch of sort keys is read, so requests can be tracked while the
+        requests are listed.
+        """
+        sort_index = self._sort_indexes.get(
+            requests_sorter, self._sort_indexes[DEFAULT_SORTER]
+        )
+        with self._lock:
+            self._evict_expired()
+        while True:
+            with self._lock:
+                sort_keys = sort_index.get_keys(descending, after, SORTED_BATCH_SIZE)
+            for sort_key in sort_keys:
+                request_id = get_request_id(sort_key)
+                request_collector = self.get(request_id)
+                # The request may have been removed since the batch was read
+                if request_collector is not None:
+                    yield request_id, request_collector, sort_key
+            if len(sort_keys) < SORTED_BATCH_SIZE:
+                return
+            after = sort_keys[-1]
+
+    def _index(
+        self,
+        request_id: UUID,
+        request_collector: MainRequestCollector,
+    ) -> None:
+        for sort_index in self._sort_indexes.values():
+            sort_index.add(request_id, request_collector)
+
+    def _unindex(self, request_id: UUID) -> None:
+        for sort_index in self._sort_indexes.values():
+            sort_index.remove(request_id)
+
+    def _add_finished(
+        self,
+        request_id: UUID,
+        request_collector: MainRequestCollector,
+    ) -> None:
+        footprint = request_collector.footprint
+        overhead_ns = request_collector.total_overhead_ns
+        duration_ns = (request_collector.end_ns or 0) - request_collector.start_ns
+        self._finished[request_id] = request_collector
+        self._last_used[request_id] = monotonic()
+        self._footprints[request_id] = footprint
+        self._finished_footprint += footprint
+        self._overheads[request_id] = (overhead_ns, duration_ns)
+        self._finished_overhead_ns += overhead_ns
+        self._finished_duration_ns += duration_ns
+
+    def _remove_finished(self, request_id: UUID) -> MainRequestCollector:
+        request_collector = self._finished.pop(request_id)
+        del self._last_used[request_id]
+        self._finished_footprint -= self._footprints.pop(request_id)
+        overhead_ns, duration_ns = self._overheads.pop(request_id)
+        self._finished_overhead_ns -= overhead_ns
+        self._finished_duration_ns -= duration_ns
+        self._unindex(request_id)
+        return request_collector
+
+    def _remove(self, request_id: UUID) -> MainRequestCollector:
+        if request_id in self._in_flight:
+            request_collector = self._in_flight.pop(request_id)
+            self._unindex(request_id)
+            return request_collector
+        return self._remove_finished(request_id)
+
+    def _pop_oldest(self) -> None:
+        self._remove_finished(next(iter(self._finished))).release()
+
+    def __getitem__(self, request_id: UUID) -> MainRequestCollector:
+        if request_id in self._in_flight:
+            return self._in_flight[request_id]
+        return self._finished[request_id]
+
+    def __setitem__(
+        self,
+        request_id: UUID,
+        request_collector: MainRequestCollector,
+    ) -> None:
+        with self._lock:
+            if request_id in self:
+                previous_collector = self._remove(request_id)
+                if previous_collector is not request_collector:
+                    previous_collector.release()
+            if request_collector.finished:
+                self._add_finished(request_id, request_collector)
+            else:
+                self._in_flight[request_id] = request_collector
+            self._index(request_id, request_collector)
+            self.evict()
+
+    def __delitem__(self, request_id: UUID) -> None:
+        with self._lock:
+            self._remove(request_id).release()
+
+    def __iter__(self) -> Iterator[UUID]:
+        with self._lock:
+            request_ids = [*self._in_flight, *self._finished]
+        return iter(request_ids)
+
+    def __len__(self) -> int:
+        return len(self._in_flight) + len(self._finished)
+
+    def __contains__(self, request_id: object) -> bool:
+        return request_id in self._in_flight or request_id in self._finished
+
+    def clear(self) -> None:
+        with self._lock:
+            for request_collector in self.values():
+                request_collector.release()
+            self._in_flight.clear()
+            self._finished.clear()
+            self._last_used.clear()
+            self._footprints.clear()
+            self._finished_footprint = 0
+            self._overheads.clear()
+            self._finished_overhead_ns = 0
+            self._finished_duration_ns = 0
+            for sort_index in self._sort_indexes.values():
+                sort_index.clear()
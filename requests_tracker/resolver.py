@@ -0,0 +1,51 @@
+from functools import lru_cache
+from typing import Any, NamedTuple, Optional
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpRequest
+from django.urls import Resolver404, resolve
+
+from requests_tracker import APP_NAME
+
+NOT_FOUND = "NOT FOUND"
+
+# Number of distinct paths whose resolution is cached. Paths with ids in them are
+# all distinct, so the cache has to be bounded.
+RESOLVE_CACHE_SIZE = 1024
+
+
+class ResolvedPath(NamedTuple):
+    """The parts of a path's resolver match the requests tracker needs"""
+
+    django_view: str
+    is_requests_tracker: bool
+
+
+@lru_cache(maxsize=RESOLVE_CACHE_SIZE)
+def resolve_path(path: str, urlconf: Optional[Any] = None) -> ResolvedPath:
+    try:
+        resolver_match = resolve(path, urlconf)
+    except Resolver404:
+        return ResolvedPath(django_view=NOT_FOUND, is_requests_tracker=False)
+
+    return ResolvedPath(
+        django_view=resolver_match._func_path,
+        is_requests_tracker=bool(
+            resolver_match.namespaces and resolver_match.namespaces[-1] == APP_NAME
+        ),
+    )
+
+
+def resolve_request(request: HttpRequest) -> ResolvedPath:
+    """
+    Resolves the path of a request. The result is cached per path, so the middleware
+    and the collectors share the same resolution of a request.
+    """
+    return resolve_path(request.path, getattr(request, "urlconf", None))
+
+
+@receiver(setting_changed)
+def clear_resolve_cache(*, setting: str, **kwargs: Any) -> None:
+    if setting == "ROOT_URLCONF":
+        resolve_path.cache_clear()
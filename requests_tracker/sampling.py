@@ -0,0 +1,81 @@
+import random
+import threading
+from time import monotonic
+from typing import Callable, Dict, Optional, Tuple
+
+from django.http import HttpRequest
+
+from requests_tracker.resolver import resolve_request
+
+
+def get_meta_key(header: str) -> str:
+    """The key of a HTTP header in request.META"""
+    return f"HTTP_{header.upper().replace('-', '_')}"
+
+
+class RequestSampler:
+    """
+    Decides which requests are tracked, so tracking can be left on under load.
+
+    Requests carrying the ``force_header`` are always tracked. Other requests are
+    tracked with a probability of ``sample_rate`` and at most
+    ``max_per_view_per_second`` of them are tracked per Django view each second.
+    ``None`` disables the corresponding option.
+    """
+
+    sample_rate: float
+    max_per_view_per_second: Optional[int]
+    force_header: Optional[str]
+
+    # The current one second window and the number of requests tracked in it per view
+    _view_windows: Dict[str, Tuple[int, int]]
+
+    def __init__(
+        self,
+        sample_rate: float = 1.0,
+        max_per_view_per_second: Optional[int] = None,
+        force_header: Optional[str] = None,
+        get_random: Callable[[], float] = random.random,
+        get_time: Callable[[], float] = monotonic,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.max_per_view_per_second = max_per_view_per_second
+        self.force_header = force_header
+        self._force_meta_key = get_meta_key(force_header) if force_header else None
+        self._get_random = get_random
+        self._get_time = get_time
+        self._view_windows = {}
+        self._lock = threading.Lock()
+
+    @property
+    def samples_everything(self) -> bool:
+        return self.sample_rate >= 1 and self.max_per_view_per_second is None
+
+    def should_track(self, request: HttpRequest) -> bool:
+        if self.samples_everything:
+            return True
+
+        if self._force_meta_key is not None and self._force_meta_key in request.META:
+            return True
+
+        if self.sample_rate < 1 and self._get_random() >= self.sample_rate:
+            return False
+
+        if self.max_per_view_per_second is not None:
+            return self._track_in_view_window(
+                resolve_request(request).django_view,
+                self.max_per_view_per_second,
+            )
+
+        return True
+
+    def _track_in_view_window(self, django_view: str, max_count: int) -> bool:
+        window = int(self._get_time())
+        with self._lock:
+            view_window, count = self._view_windows.get(django_view, (window, 0))
+            if view_window != window:
+                count = 0
+            if count >= max_count:
+                return False
+            self._view_windows[django_view] = (window, count + 1)
+        return True
@@ -1,13 +1,24 @@
-from functools import lru_cache
-from typing import Any, Dict
+import re
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from typing import Any, Dict, List, Optional, Pattern, Tuple
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.http import HttpRequest
 
 from requests_tracker import APP_NAME
 
+STACKTRACE_MODE_FULL = "full"
+STACKTRACE_MODE_LAZY = "lazy"
+STACKTRACE_MODE_OFF = "off"
+STACKTRACE_MODES = (STACKTRACE_MODE_FULL, STACKTRACE_MODE_LAZY, STACKTRACE_MODE_OFF)
+
 CONFIG_DEFAULTS = {
     "ENABLE_STACKTRACES": True,
+    "STACKTRACE_MODE": STACKTRACE_MODE_FULL,
     "ENABLE_STACKTRACES_LOCALS": False,
     "HIDE_IN_STACKTRACES": (
         "socketserver",
@@ -26,6 +37,20 @@ CONFIG_DEFAULTS = {
     "TRACK_SQL": True,
     "IGNORE_SQL_PATTERNS": (),
     "IGNORE_PATHS_PATTERNS": (),
+    "MAX_REQUESTS": 1000,
+    "MAX_REQUEST_AGE": None,  # seconds
+    "MAX_MEMORY_MB": None,
+    "SAMPLE_RATE": 1.0,
+    "MAX_REQUESTS_PER_VIEW_PER_SECOND": None,
+    "FORCE_TRACKING_HEADER": None,
+    "TAIL_BASED_RETENTION": False,
+    "SLOW_REQUEST_THRESHOLD": 1000,  # milliseconds
+    "STACKTRACE_QUERY_BUDGET": 1000,
+    "STACKTRACE_TIME_BUDGET": None,  # milliseconds
+    "CAPTURE_BODIES": False,
+    "BODY_MEMORY_LIMIT_KB": 64,
+    "MAX_BODY_SIZE_MB": 10,
+    "REQUESTS_PAGE_SIZE": 50,
 }
 
 
@@ -37,10 +62,175 @@ def get_config() -> Dict[str, Any]:
     return config
 
 
+# Inline flags apply to the whole expression, so they must stay at its start
+_GLOBAL_FLAGS_PATTERN = re.compile(r"\(\?[aiLmsux]+\)")
+
+
+class PatternMatcher:
+    """
+    Matches strings against several regular expression patterns, like re.match
+    with each of them would.
+
+    Patterns with inline flags, such as ``(?i)``, or with groups, which
+    backreferences could refer to, are matched one by one. The others are combined
+    into a single alternation, so the common case is a single regex match.
+    """
+
+    patterns: Tuple[str, ...]
+
+    _combined: Optional[Pattern[str]]
+    _separate: Tuple[Pattern[str], ...]
+
+    def __init__(self, patterns: Tuple[str, ...]) -> None:
+        self.patterns = patterns
+        combinable: List[str] = []
+        separate: List[Pattern[str]] = []
+        for pattern in patterns:
+            try:
+                compiled = re.compile(pattern)
+            except re.error as exc:
+                raise ImproperlyConfigured(
+                    f"Invalid regular expression {pattern!r}: {exc}"
+                ) from exc
+            if compiled.groups or _GLOBAL_FLAGS_PATTERN.match(pattern):
+                separate.append(compiled)
+            else:
+                combinable.append(pattern)
+        self._combined = (
+            re.compile("|".join(f"(?:{pattern})" for pattern in combinable))
+            if combinable
+            else None
+        )
+        self._separate = tuple(separate)
+
+    def match(self, string: str) -> bool:
+        if self._combined is not None and self._combined.match(string):
+            return True
+        return any(pattern.match(string) for pattern in self._separate)
+
+
+@lru_cache()
+def compile_patterns(patterns: Tuple[str, ...]) -> Optional[PatternMatcher]:
+    """
+    Compiles a tuple of regular expression patterns into a matcher, which matches
+    wherever any of the patterns would match with re.match. Raises
+    ImproperlyConfigured naming the pattern if one is not a valid expression.
+    """
+    if not patterns:
+        return None
+    return PatternMatcher(patterns)
+
+
+@dataclass(frozen=True)
+class RequestsTrackerSettings:
+    """
+    The config as typed attributes, with the values the hot paths need derived once,
+    so recording a query or a stack trace only has to read attributes.
+    """
+
+    enable_stacktraces: bool
+    stacktrace_mode: str
+    enable_stacktraces_locals: bool
+    hide_in_stacktraces: Tuple[str, ...]
+    # A frame is hidden if its module name followed by a dot starts with any of these
+    hidden_module_prefixes: Tuple[str, ...]
+    sql_warning_threshold: float  # milliseconds
+    requests_tracker_config: bool
+    track_sql: bool
+    ignore_sql_patterns: Tuple[str, ...]
+    ignore_paths_patterns: Tuple[str, ...]
+    max_requests: Optional[int]
+    max_request_age: Optional[float]  # seconds
+    max_memory: Optional[int]  # bytes
+    sample_rate: float
+    max_requests_per_view_per_second: Optional[int]
+    force_tracking_header: Optional[str]
+    tail_based_retention: bool
+    slow_request_threshold: float  # milliseconds
+    stacktrace_query_budget: Optional[int]
+    stacktrace_time_budget: Optional[float]  # milliseconds
+    capture_bodies: bool
+    body_memory_limit: int  # bytes
+    max_body_size: int  # bytes
+    requests_page_size: int
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "RequestsTrackerSettings":
+        hide_in_stacktraces = tuple(config["HIDE_IN_STACKTRACES"] or ())
+        max_memory_mb = config["MAX_MEMORY_MB"]
+        stacktrace_time_budget = config["STACKTRACE_TIME_BUDGET"]
+        stacktrace_mode = (
+            config["STACKTRACE_MODE"]
+            if config["ENABLE_STACKTRACES"]
+            else STACKTRACE_MODE_OFF
+        )
+        if stacktrace_mode not in STACKTRACE_MODES:
+            raise ImproperlyConfigured(
+                f"STACKTRACE_MODE must be one of {', '.join(STACKTRACE_MODES)}, "
+                f"not {stacktrace_mode!r}"
+            )
+        return cls(
+            enable_stacktraces=stacktrace_mode != STACKTRACE_MODE_OFF,
+            stacktrace_mode=stacktrace_mode,
+            enable_stacktraces_locals=bool(config["ENABLE_STACKTRACES_LOCALS"]),
+            hide_in_stacktraces=hide_in_stacktraces,
+            hidden_module_prefixes=tuple(
+                f"{module}." for module in hide_in_stacktraces
+            ),
+            sql_warning_threshold=float(config["SQL_WARNING_THRESHOLD"]),
+            requests_tracker_config=bool(config["REQUESTS_TRACKER_CONFIG"]),
+            track_sql=bool(config["TRACK_SQL"]),
+            ignore_sql_patterns=tuple(config["IGNORE_SQL_PATTERNS"] or ()),
+            ignore_paths_patterns=tuple(config["IGNORE_PATHS_PATTERNS"] or ()),
+            max_requests=config["MAX_REQUESTS"],
+            max_request_age=config["MAX_REQUEST_AGE"],
+            max_memory=(
+                int(max_memory_mb * 1024 * 1024) if max_memory_mb is not None else None
+            ),
+            sample_rate=float(config["SAMPLE_RATE"]),
+            max_requests_per_view_per_second=config["MAX_REQUESTS_PER_VIEW_PER_SECOND"],
+            force_tracking_header=config["FORCE_TRACKING_HEADER"],
+            tail_based_retention=bool(config["TAIL_BASED_RETENTION"]),
+            slow_request_threshold=float(config["SLOW_REQUEST_THRESHOLD"]),
+            stacktrace_query_budget=config["STACKTRACE_QUERY_BUDGET"],
+            stacktrace_time_budget=(
+                float(stacktrace_time_budget)
+                if stacktrace_time_budget is not None
+                else None
+            ),
+            capture_bodies=bool(config["CAPTURE_BODIES"]),
+            body_memory_limit=int(config["BODY_MEMORY_LIMIT_KB"] * 1024),
+            max_body_size=int(config["MAX_BODY_SIZE_MB"] * 1024 * 1024),
+            requests_page_size=max(int(config["REQUESTS_PAGE_SIZE"]), 1),
+        )
+
+    # The patterns are compiled on first use rather than with the settings, so an
+    # invalid one only fails where it is matched, not every use of the settings
+    @cached_property
+    def ignore_sql_pattern(self) -> Optional[PatternMatcher]:
+        return compile_patterns(self.ignore_sql_patterns)
+
+    @cached_property
+    def ignore_paths_pattern(self) -> Optional[PatternMatcher]:
+        return compile_patterns(self.ignore_paths_patterns)
+
+
+@lru_cache()
+def get_settings() -> RequestsTrackerSettings:
+    """The config as a RequestsTrackerSettings, cached until the settings change"""
+    return RequestsTrackerSettings.from_config(get_config())
+
+
+@receiver(setting_changed)
+def clear_settings_cache(*, setting: str, **kwargs: Any) -> None:
+    if setting == "REQUESTS_TRACKER_CONFIG":
+        get_config.cache_clear()
+        get_settings.cache_clear()
+
+
 def debug_application(request: HttpRequest) -> bool:
-    requests_tracker_app = get_config()["REQUESTS_TRACKER_CONFIG"]
     return (
-        requests_tracker_app
+        get_settings().requests_tracker_config
         and settings.DEBUG
         and request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS
     )
@@ -0,0 +1,55 @@
+from typing import NamedTuple, Optional
+
+from django.http import HttpRequest, HttpResponse
+
+
+class RequestSnapshot(NamedTuple):
+    """The parts of a request that are displayed once the request has finished"""
+
+    method: Optional[str]
+    path: str
+    query_string: str
+    content_type: str
+    content_length: Optional[int]
+
+    @classmethod
+    def from_request(cls, request: HttpRequest) -> "RequestSnapshot":
+        return cls(
+            method=request.method,
+            path=request.path,
+            query_string=request.META.get("QUERY_STRING", ""),
+            content_type=request.META.get("CONTENT_TYPE", ""),
+            content_length=_parse_content_length(request.META.get("CONTENT_LENGTH")),
+        )
+
+
+class ResponseSnapshot(NamedTuple):
+    """The parts of a response that are displayed once the request has finished"""
+
+    status_code: int
+    reason_phrase: str
+    content_type: Optional[str]
+    content_length: Optional[int]
+    streaming: bool
+
+    @classmethod
+    def from_response(cls, response: HttpResponse) -> "ResponseSnapshot":
+        streaming = bool(response.streaming)
+        return cls(
+            status_code=response.status_code,
+            reason_phrase=response.reason_phrase,
+            content_type=response.get("Content-Type"),
+            content_length=(
+                _parse_content_length(response.get("Content-Length"))
+                if streaming
+                else len(response.content)
+            ),
+            streaming=streaming,
+        )
+
+
+def _parse_content_length(content_length: Optional[str]) -> Optional[int]:
+    try:
+        return int(content_length) if content_length else None
+    except (TypeError, ValueError):
+        return None
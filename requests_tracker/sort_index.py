@@ -0,0 +1,135 @@
+from bisect import bisect_left, bisect_right, insort
+from math import inf
+from typing import Any, Dict, List, Optional, Tuple, Union
+from uuid import UUID
+
+from requests_tracker.main_request_collector import MainRequestCollector
+
+# The value requests are sorted by, for the supported requests_sorter values
+SortValue = Union[str, int, float]
+# The sort value, and the negated start time and id of the request, so requests with
+# the same sort value are ordered newest first
+SortKey = Tuple[SortValue, int, int]
+
+SORTERS = (
+    "time",
+    "duration",
+    "name",
+    "view",
+    "query_count",
+    "duplicate_query_count",
+    "similar_query_count",
+)
+DEFAULT_SORTER = "time"
+
+
+def get_sort_value(request: MainRequestCollector, requests_sorter: str) -> SortValue:
+    if requests_sorter == "duration":
+        # Requests still in progress sort as the shortest ones
+        duration = request.duration
+        return duration if duration is not None else -1.0
+    elif requests_sorter == "name":
+        return str(request.request.path)
+    elif requests_sorter == "view":
+        return request.django_view
+    elif requests_sorter == "query_count":
+        return request.sql_collector.num_queries
+    elif requests_sorter == "duplicate_query_count":
+        return request.sql_collector.total_duplicate_queries
+    elif requests_sorter == "similar_query_count":
+        return request.sql_collector.total_similar_queries
+    else:
+        return request.start_ns
+
+
+def get_sort_key(
+    request_id: UUID,
+    request: MainRequestCollector,
+    requests_sorter: str,
+) -> SortKey:
+    return (
+        get_sort_value(request, requests_sorter),
+        -request.start_ns,
+        -request_id.int,
+    )
+
+
+def get_request_id(sort_key: SortKey) -> UUID:
+    return UUID(int=-sort_key[2])
+
+
+class SortIndex:
+    """
+    The sort keys of requests for one requests_sorter, kept in a sorted list.
+
+    Listing a page of requests in either direction, starting after a given sort key,
+    is a binary search and a slice, so it does not depend on the number of indexed
+    requests. Requests with the same sort value are listed newest first in both
+    directions. A request's sort key is taken when it is added, requests whose sort
+    value changed have to be added again.
+    """
+
+    requests_sorter: str
+
+    _keys: List[SortKey]
+    _keys_by_id: Dict[UUID, SortKey]
+
+    def __init__(self, requests_sorter: str) -> None:
+        self.requests_sorter = requests_sorter
+        self._keys = []
+        self._keys_by_id = {}
+
+    def add(self, request_id: UUID, request: MainRequestCollector) -> None:
+        self.remove(request_id)
+        sort_key = get_sort_key(request_id, request, self.requests_sorter)
+        insort(self._keys, sort_key)
+        self._keys_by_id[request_id] = sort_key
+
+    def remove(self, request_id: UUID) -> None:
+        sort_key = self._keys_by_id.pop(request_id, None)
+        if sort_key is not None:
+            del self._keys[bisect_left(self._keys, sort_key)]
+
+    def clear(self) -> None:
+        self._keys.clear()
+        self._keys_by_id.clear()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def get_keys(
+        self,
+        descending: bool,
+        after: Optional[SortKey],
+        count: int,
+    ) -> List[SortKey]:
+        """Up to ``count`` sort keys in the given direction, following ``after``"""
+        if not descending:
+            start = bisect_right(self._keys, after) if after is not None else 0
+            return self._keys[start : start + count]
+
+        # Descending, the groups of equal sort values are listed from the last one
+        # backwards, but each group is listed forwards, so it stays newest first
+        keys = self._keys
+        result: List[SortKey] = []
+        group_end = len(keys)
+        if after is not None:
+            value = after[0]
+            start = bisect_right(keys, after)
+            result.extend(keys[start : min(self._group_end(value), start + count)])
+            group_end = self._group_start(value)
+        while group_end > 0 and len(result) < count:
+            group_start = self._group_start(keys[group_end - 1][0])
+            result.extend(
+                keys[group_start : min(group_end, group_start + count - len(result))]
+            )
+            group_end = group_start
+        return result
+
+    def _group_start(self, value: SortValue) -> int:
+        group_key: Tuple[Any, ...] = (value,)
+        return bisect_left(self._keys, group_key)
+
+    def _group_end(self, value: SortValue) -> int:
+        group_key: Tuple[Any, ...] = (value, inf)
+        return bisect_left(self._keys, group_key)
@@ -1,11 +1,22 @@
+import sys
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Optional, Union
+from typing import TYPE_CHECKING, Any, Callable, NamedTuple, Optional, Tuple, Union
 
 if TYPE_CHECKING:
     from requests_tracker.sql.sql_tracker import ExecuteParametersOrSequence
     from requests_tracker.stack_trace import StackTrace
 
 
+@dataclass(frozen=True)
+class ConnectionInfo:
+    """Metadata about a database connection, resolved once per connection"""
+
+    alias: str
+    vendor: str
+    # psycopg 3 exposes the libpq connection as ``pgconn`` on the connection
+    uses_pgconn: bool = False
+
+
 @dataclass
 class PerDatabaseInfo:
     time_spent: float
@@ -14,22 +25,190 @@ class PerDatabaseInfo:
     duplicate_count: int = 0
 
 
-@dataclass
+class QuerySummary(NamedTuple):
+    """Summary of the similar queries of a request that was compacted"""
+
+    alias: str
+    # The parameterised sql, which all the summarised queries share
+    sql: str
+    num_queries: int
+    duration: float
+
+
 class SQLQueryInfo:
+    """
+    A single recorded SQL query.
+
+    Requests can record thousands of queries, so this is a slotted class rather
+    than a dataclass to avoid a ``__dict__`` per query. The parameterised ``sql``,
+    ``vendor`` and ``alias`` are interned since they repeat across queries, and
+    ``raw_sql`` shares the ``sql`` string when the query has no parameters.
+
+    ``raw_sql`` and ``params`` are only needed when the query is displayed, so they
+    can be given as renderers instead, which are called on first access and the
+    result is cached.
+
+    ``start_time`` and ``stop_time`` are monotonic ``perf_counter_ns`` timestamps and
+    ``duration`` is in milliseconds.
+    """
+
+    _fields = (
+        "vendor",
+        "alias",
+        "sql",
+        "duration",
+        "raw_sql",
+        "params",
+        "raw_params",
+        "stacktrace",
+        "start_time",
+        "stop_time",
+        "is_slow",
+        "is_select",
+        "trans_id",
+        "iso_level",
+        "trans_status",
+        "similar_count",
+        "duplicate_count",
+    )
+
+    __slots__ = (
+        "vendor",
+        "alias",
+        "sql",
+        "duration",
+        "_raw_sql",
+        "_raw_sql_renderer",
+        "_params",
+        "_params_renderer",
+        "raw_params",
+        "stacktrace",
+        "start_time",
+        "stop_time",
+        "is_slow",
+        "is_select",
+        "trans_id",
+        "iso_level",
+        "trans_status",
+        "similar_count",
+        "duplicate_count",
+    )
+
     vendor: str
     alias: str
     sql: str
     duration: float
-    raw_sql: str
-    params: str
+    _raw_sql: Optional[str]
+    _raw_sql_renderer: Optional[Callable[[], str]]
+    _params: Optional[str]
+    _params_renderer: Optional[Callable[["ExecuteParametersOrSequence"], str]]
     raw_params: "ExecuteParametersOrSequence"
     stacktrace: "StackTrace"
-    start_time: float
-    stop_time: float
+    start_time: int
+    stop_time: int
     is_slow: bool
     is_select: bool
-    trans_id: Optional[str] = None
-    iso_level: Optional[Union[int, str]] = None
-    trans_status: Optional[int] = None
-    similar_count: int = 0
-    duplicate_count: int = 0
+    trans_id: Optional[str]
+    iso_level: Optional[Union[int, str]]
+    trans_status: Optional[int]
+    similar_count: int
+    duplicate_count: int
+
+    def __init__(
+        self,
+        vendor: str,
+        alias: str,
+        sql: str,
+        duration: float,
+        raw_sql: Optional[str],
+        params: Optional[str],
+        raw_params: "ExecuteParametersOrSequence",
+        stacktrace: "StackTrace",
+        start_time: int,
+        stop_time: int,
+        is_slow: bool,
+        is_select: bool,
+        trans_id: Optional[str] = None,
+        iso_level: Optional[Union[int, str]] = None,
+        trans_status: Optional[int] = None,
+        similar_count: int = 0,
+        duplicate_count: int = 0,
+        raw_sql_renderer: Optional[Callable[[], str]] = None,
+        params_renderer: Optional[
+            Callable[["ExecuteParametersOrSequence"], str]
+        ] = None,
+    ) -> None:
+        self.vendor = sys.intern(vendor)
+        self.alias = sys.intern(alias)
+        self.sql = sys.intern(sql)
+        self.duration = float(duration)
+        self._raw_sql = None
+        self._raw_sql_renderer = raw_sql_renderer
+        if raw_sql is not None:
+            self.raw_sql = raw_sql
+        self._params = params
+        self._params_renderer = params_renderer
+        self.raw_params = raw_params
+        self.stacktrace = stacktrace
+        self.start_time = int(start_time)
+        self.stop_time = int(stop_time)
+        self.is_slow = is_slow
+        self.is_select = is_select
+        self.trans_id = trans_id
+        self.iso_level = iso_level
+        self.trans_status = trans_status
+        self.similar_count = similar_count
+        self.duplicate_count = duplicate_count
+
+    @property
+    def raw_sql(self) -> str:
+        """The SQL with the parameters interpolated"""
+        if self._raw_sql is None:
+            renderer = self._raw_sql_renderer
+            self.raw_sql = renderer() if renderer is not None else self.sql
+            # Release whatever the renderer references
+            self._raw_sql_renderer = None
+        return self._raw_sql  # type: ignore[return-value]
+
+    @raw_sql.setter
+    def raw_sql(self, raw_sql: str) -> None:
+        self._raw_sql = self.sql if raw_sql == self.sql else raw_sql
+
+    def render_raw_sql(self) -> str:
+        """
+        The SQL with the parameters interpolated, without keeping it when it was
+        not rendered yet, so searching queries does not grow their footprint
+        """
+        if self._raw_sql is not None:
+            return self._raw_sql
+        renderer = self._raw_sql_renderer
+        return renderer() if renderer is not None else self.sql
+
+    @property
+    def params(self) -> str:
+        """The parameters, as JSON if they can be serialized"""
+        if self._params is None:
+            renderer = self._params_renderer
+            self._params = renderer(self.raw_params) if renderer is not None else ""
+            self._params_renderer = None
+        return self._params
+
+    @params.setter
+    def params(self, params: str) -> None:
+        self._params = params
+
+    def _as_tuple(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, field) for field in self._fields)
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._as_tuple() == other._as_tuple()
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            f"{field}={getattr(self, field)!r}" for field in self._fields
+        )
+        return f"{self.__class__.__name__}({fields})"
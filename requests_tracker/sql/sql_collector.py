@@ -1,50 +1,152 @@
-import re
 import uuid
 from collections import defaultdict
-from typing import Dict, List, Optional, Tuple
+from typing import Any, DefaultDict, Dict, Hashable, List, Optional, Tuple
 
 from requests_tracker.base_collector import Collector
-from requests_tracker.settings import get_config
-from requests_tracker.sql.dataclasses import PerDatabaseInfo, SQLQueryInfo
+from requests_tracker.footprint import (
+    OBJECT_SIZE,
+    STR_SIZE,
+    approximate_flat_size,
+    approximate_size,
+)
+from requests_tracker.sql.dataclasses import (
+    PerDatabaseInfo,
+    QuerySummary,
+    SQLQueryInfo,
+)
+from requests_tracker.stack_trace import InternedStackTrace, LazyStackTrace
 
-SimilarQueryGroupsType = Dict[Tuple[str, str], List[SQLQueryInfo]]
-DuplicateQueryGroupsType = Dict[Tuple[str, Tuple[str, str]], List[SQLQueryInfo]]
+SimilarQueryGroupsType = DefaultDict[Tuple[str, str], List[SQLQueryInfo]]
+DuplicateQueryGroupsType = DefaultDict[Tuple[str, str, Hashable], List[SQLQueryInfo]]
+
+
+def get_params_key(raw_params: Any) -> Hashable:
+    """
+    Returns a hashable key for the parameters of a query, which together with the
+    parameterised sql identifies the raw sql without having to render it.
+    """
+    if not raw_params:
+        return ()
+    try:
+        params_key = tuple(
+            raw_params.items() if isinstance(raw_params, dict) else raw_params
+        )
+        hash(params_key)
+        return params_key
+    except TypeError:
+        # Parameters such as lists for array fields are not hashable
+        return repr(raw_params)
+
+
+def get_group_count_increase(group_size: int) -> int:
+    """
+    How much the number of similar or duplicate queries increases by when a query
+    is added to a group, which now has group_size queries
+    """
+    if group_size < 2:
+        return 0
+    # The first query in the group is counted as well once it has company
+    return 2 if group_size == 2 else 1
+
+
+# The slots of a query and the numbers they hold, and its stack trace object. The
+# frames of stack traces are shared by all requests, see _FrameTable.
+QUERY_SIZE = SQLQueryInfo.__basicsize__ + 3 * OBJECT_SIZE
+STACK_TRACE_SIZE = 2 * OBJECT_SIZE
+
+
+def get_query_footprint(sql_query_info: SQLQueryInfo) -> int:
+    """
+    Estimates the memory retained by a recorded query. Requests can record
+    thousands of queries, so only the strings and parameters are measured, the
+    rest is counted with fixed sizes.
+    """
+    sql = sql_query_info.sql
+    footprint = QUERY_SIZE + STR_SIZE + len(sql) + STACK_TRACE_SIZE
+    # Raw SQL rendered when the query is displayed is not counted
+    raw_sql = sql_query_info._raw_sql
+    if raw_sql is not None and raw_sql is not sql:
+        footprint += STR_SIZE + len(raw_sql)
+    footprint += approximate_flat_size(sql_query_info.raw_params)
+    stacktrace = sql_query_info.stacktrace
+    if isinstance(stacktrace, LazyStackTrace):
+        footprint += stacktrace.footprint
+    elif isinstance(stacktrace, InternedStackTrace) and stacktrace.frame_locals:
+        footprint += sum(
+            approximate_flat_size(frame_locals)
+            for frame_locals in stacktrace.frame_locals
+        )
+    return footprint
 
 
 class SQLCollector(Collector):
-    unfiltered_queries: List[SQLQueryInfo]
+    # perf_counter_ns timestamp of the start of the request, which the offsets of the
+    # queries on the timeline are relative to
+    start_time: Optional[int]
+    queries: List[SQLQueryInfo]
     databases: Dict[str, PerDatabaseInfo]
     sql_time: float
+    num_slow_queries: int
     transaction_ids: Dict[str, Optional[str]]
+    # Set once the collector is compacted, when the queries are replaced by these
+    query_summaries: List[QuerySummary]
+    num_summarized_queries: int
+    # Set once the request used up its stack trace budget, see SQLTracker
+    degraded_capture: bool
 
-    def __init__(self) -> None:
-        self.databases = {}
-        self.sql_time = 0
-        self.unfiltered_queries = []
+    _similar_query_groups: SimilarQueryGroupsType
+    _duplicate_query_groups: DuplicateQueryGroupsType
+    _statistics_outdated: bool
+
+    def __init__(self, start_time: Optional[int] = None) -> None:
+        self.start_time = start_time
+        self.queries = []
+        self._end_time: Optional[int] = None
         # synthetic transaction IDs, keyed by DB alias
         self.transaction_ids = {}
+        self.footprint = 0
+        self.overhead_ns = 0
+        self.query_summaries = []
+        self.num_summarized_queries = 0
+        self.degraded_capture = False
+        self._reset_statistics()
 
     @property
-    def queries(self) -> List[SQLQueryInfo]:
-        config = get_config()
-        if ignore_patterns := config.get("IGNORE_SQL_PATTERNS"):
-            return [
-                query
-                for query in self.unfiltered_queries
-                if not any(
-                    bool(re.match(pattern, query.raw_sql))
-                    for pattern in ignore_patterns
-                )
-            ]
-
-        return self.unfiltered_queries
+    def num_queries(self) -> int:
+        return len(self.queries) + self.num_summarized_queries
 
     @property
-    def num_queries(self) -> int:
-        return len(self.queries)
+    def is_compact(self) -> bool:
+        return bool(self.query_summaries)
 
     def record(self, sql_query_info: SQLQueryInfo) -> None:
-        self.unfiltered_queries.append(sql_query_info)
+        if self._end_time is None or sql_query_info.stop_time > self._end_time:
+            self._end_time = sql_query_info.stop_time
+        self.queries.append(sql_query_info)
+        self.footprint += get_query_footprint(sql_query_info)
+        self._add_to_statistics(sql_query_info)
+        self._statistics_outdated = True
+
+    @property
+    def timeline_start(self) -> Optional[int]:
+        if self.start_time is not None:
+            return self.start_time
+        return self.queries[0].start_time if self.queries else None
+
+    @property
+    def timeline_duration(self) -> float:
+        """Milliseconds from the start of the timeline to the end of the last query"""
+        timeline_start = self.timeline_start
+        if timeline_start is None or self._end_time is None:
+            return 0.0
+        return (self._end_time - timeline_start) / 1_000_000
+
+    def get_query_offset(self, query: SQLQueryInfo) -> float:
+        """Milliseconds from the start of the timeline to the start of the query"""
+        timeline_start = self.timeline_start
+        if timeline_start is None:
+            return 0.0
+        return (query.start_time - timeline_start) / 1_000_000
 
     def new_transaction_id(self, alias: str) -> str:
         """
@@ -67,57 +169,86 @@ class SQLCollector(Collector):
             trans_id = self.new_transaction_id(alias)
         return trans_id
 
-    def generate_statistics(self) -> None:
-        similar_query_groups: SimilarQueryGroupsType = defaultdict(list)
-        duplicate_query_groups: DuplicateQueryGroupsType = defaultdict(list)
-
+    def _reset_statistics(self) -> None:
         self.databases = {}
         self.sql_time = 0
+        self.num_slow_queries = 0
+        self._similar_query_groups = defaultdict(list)
+        self._duplicate_query_groups = defaultdict(list)
+        self._statistics_outdated = False
 
-        for query in self.queries:
-            alias = query.alias
-            if alias not in self.databases:
-                self.databases[alias] = PerDatabaseInfo(
-                    time_spent=query.duration,
-                    num_queries=1,
-                )
-            else:
-                self.databases[alias].time_spent += query.duration
-                self.databases[alias].num_queries += 1
-            self.sql_time += query.duration
-
-            similar_query_groups[(query.alias, query.sql)].append(query)
-            duplicate_query_groups[
-                (
-                    query.alias,
-                    (
-                        query.raw_sql,
-                        repr(tuple(query.raw_params) if query.raw_params else ()),
-                    ),
-                )
-            ].append(query)
-
-        similar_counts: Dict[str, int] = defaultdict(int)
-        for (alias, _), query_group in similar_query_groups.items():
-            count = len(query_group)
-
-            if count > 1:
-                for query in query_group:
-                    query.similar_count = count
-                similar_counts[alias] += count
+    def _add_to_statistics(self, query: SQLQueryInfo) -> None:
+        """Updates the running statistics with a single query"""
+        alias = query.alias
+        database = self.databases.get(alias)
+        if database is None:
+            database = self.databases[alias] = PerDatabaseInfo(
+                time_spent=0,
+                num_queries=0,
+            )
+        database.time_spent += query.duration
+        database.num_queries += 1
+        self.sql_time += query.duration
+        if query.is_slow:
+            self.num_slow_queries += 1
+
+        similar_query_group = self._similar_query_groups[(alias, query.sql)]
+        similar_query_group.append(query)
+        database.similar_count += get_group_count_increase(len(similar_query_group))
 
-        duplicate_counts: Dict[str, int] = defaultdict(int)
-        for (alias, _), query_group in duplicate_query_groups.items():
-            count = len(query_group)
+        duplicate_query_group = self._duplicate_query_groups[
+            (alias, query.sql, get_params_key(query.raw_params))
+        ]
+        duplicate_query_group.append(query)
+        database.duplicate_count += get_group_count_increase(len(duplicate_query_group))
 
-            if count > 1:
+    def generate_statistics(self) -> None:
+        """
+        The per database statistics are kept up to date by record, this only sets
+        the similar and duplicate counts of the individual queries. Nothing is done
+        unless queries have been recorded since the last call, so once the request
+        has finished the statistics are effectively frozen.
+        """
+        if not self._statistics_outdated:
+            return
+        self._statistics_outdated = False
+
+        # The groups are copied, as record may still add to them from the thread
+        # processing the request while the statistics are generated
+        for query_group in list(self._similar_query_groups.values()):
+            if len(query_group) > 1:
+                for query in query_group:
+                    query.similar_count = len(query_group)
+
+        for query_group in list(self._duplicate_query_groups.values()):
+            if len(query_group) > 1:
                 for query in query_group:
-                    query.duplicate_count = count
-                duplicate_counts[alias] += count
+                    query.duplicate_count = len(query_group)
 
-        for alias in self.databases:
-            self.databases[alias].similar_count = similar_counts[alias]
-            self.databases[alias].duplicate_count = duplicate_counts[alias]
+    # The queries are only held in memory
+    def release(self) -> None: ...
+
+    def compact(self) -> None:
+        """
+        Replaces the queries, with their parameters and stack traces, by a summary
+        per parameterised sql. The per database statistics are kept as they are.
+        """
+        self.query_summaries = [
+            QuerySummary(
+                alias=alias,
+                sql=sql,
+                num_queries=len(query_group),
+                duration=sum(query.duration for query in query_group),
+            )
+            for (alias, sql), query_group in self._similar_query_groups.items()
+        ]
+        self.num_summarized_queries += len(self.queries)
+        self.queries = []
+        self.transaction_ids = {}
+        self._similar_query_groups = defaultdict(list)
+        self._duplicate_query_groups = defaultdict(list)
+        self._statistics_outdated = False
+        self.footprint = approximate_size(self.query_summaries)
 
     @property
     def total_similar_queries(self) -> int:
@@ -130,6 +261,13 @@ class SQLCollector(Collector):
     def matches_search_filter(self, search: str) -> bool:
         search = search.lower()
         return next(
-            (True for query in self.queries if search in query.raw_sql.lower()),
+            (
+                True
+                for query in self.queries
+                if search in query.render_raw_sql().lower()
+            ),
             False,
+        ) or any(
+            search in query_summary.sql.lower()
+            for query_summary in self.query_summaries
         )
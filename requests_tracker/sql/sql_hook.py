@@ -2,26 +2,15 @@ from typing import Any, Sequence
 
 from django.db.backends.utils import CursorWrapper
 
-from requests_tracker.sql.sql_tracker import ExecuteParameters, SQLTracker
-
-
-def set_database_wrapper_if_missing(
-    sql_tracker: SQLTracker,
-    cursor_wrapper: CursorWrapper,
-) -> None:
-    """
-    Because install_sql_hook might be called after the database connection is
-    already established, and the overwritten connect function not have been called.
-
-    Therefor set the database wrapper if it has not been set before.
-    """
-    if sql_tracker.database_wrapper is None:
-        sql_tracker.set_database_wrapper(cursor_wrapper.db)
+from requests_tracker.sql.sql_tracker import (
+    ExecuteParameters,
+    SQLTracker,
+    get_connection_info,
+)
 
 
 def install_sql_hook() -> None:
     from django.db.backends.base.base import BaseDatabaseWrapper
-    from django.db.backends.utils import CursorWrapper
 
     real_execute = CursorWrapper.execute
     real_executemany = CursorWrapper.executemany
@@ -29,9 +18,7 @@ def install_sql_hook() -> None:
     real_connect = BaseDatabaseWrapper.connect
 
     def execute(self: CursorWrapper, sql: str, params: ExecuteParameters = None) -> Any:
-        sql_tracker = SQLTracker.current
-        set_database_wrapper_if_missing(sql_tracker, self)
-        return sql_tracker.record(
+        return SQLTracker.current.record(
             method=real_execute,
             cursor_self=self,
             sql=sql,
@@ -43,9 +30,7 @@ def install_sql_hook() -> None:
         sql: str,
         param_list: Sequence[ExecuteParameters],
     ) -> Any:
-        sql_tracker = SQLTracker.current
-        set_database_wrapper_if_missing(sql_tracker, self)
-        return sql_tracker.record(
+        return SQLTracker.current.record(
             method=real_executemany,
             cursor_self=self,
             sql=sql,
@@ -58,9 +43,7 @@ def install_sql_hook() -> None:
         procname: str,
         params: ExecuteParameters = None,
     ) -> Any:
-        sql_tracker = SQLTracker.current
-        set_database_wrapper_if_missing(sql_tracker, self)
-        return sql_tracker.record(
+        return SQLTracker.current.record(
             method=real_call_proc,
             cursor_self=self,
             sql=procname,
@@ -69,8 +52,8 @@ def install_sql_hook() -> None:
 
     def connect(self: BaseDatabaseWrapper) -> Any:
         ret = real_connect(self)
-        sql_tracker = SQLTracker.current
-        sql_tracker.set_database_wrapper(self)
+        # Resolve the connection metadata once, instead of for every query
+        get_connection_info(self)
 
         return ret
 
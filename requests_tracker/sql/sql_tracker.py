@@ -5,7 +5,8 @@ import re
 import types
 from contextvars import ContextVar
 from decimal import Decimal
-from time import time
+from functools import partial
+from time import perf_counter_ns
 from typing import (
     TYPE_CHECKING,
     Any,
@@ -20,14 +21,22 @@ from typing import (
 )
 from uuid import UUID
 
+from django.db import connections
 from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.base.operations import BaseDatabaseOperations
 from django.db.backends.utils import CursorWrapper
 from django.utils.encoding import force_str
 
 from requests_tracker import settings as dr_settings
-from requests_tracker.sql.dataclasses import SQLQueryInfo
+from requests_tracker.sql.dataclasses import ConnectionInfo, SQLQueryInfo
 from requests_tracker.sql.sql_collector import SQLCollector
-from requests_tracker.stack_trace import get_stack_trace
+from requests_tracker.stack_trace import (
+    EMPTY_STACK_TRACE,
+    CallsiteFingerprint,
+    StackTrace,
+    get_callsite_fingerprint,
+    get_stack_trace,
+)
 
 try:
     from psycopg2._json import Json as PostgresJson
@@ -63,6 +72,155 @@ QuoteParamsReturn = Optional[Union[Dict[str, str], List[str]]]
 
 _local: ContextVar["SQLTracker"] = ContextVar("current_sql_tracker")
 
+# Vendors whose interpolated SQL is built from the parameters alone and not from
+# the state of the cursor, so rendering it can be deferred until it is displayed.
+# For other vendors the cursor is reused by the next query, so the raw SQL has to
+# be read right after the query is executed.
+DEFERRED_RAW_SQL_VENDORS = frozenset({"sqlite"})
+
+CONNECTION_INFO_ATTRIBUTE = "_requests_tracker_connection_info"
+
+
+def resolve_connection_info(database_wrapper: BaseDatabaseWrapper) -> ConnectionInfo:
+    """Resolves the metadata SQLTracker.record needs about a database connection"""
+    uses_pgconn = False
+    if database_wrapper.vendor == "postgresql":
+        db_version_string_match = re.match(
+            r"(\d+\.\d+\.\d+)",
+            database_wrapper.Database.__version__,  # type: ignore
+        )
+        db_version = (
+            tuple(map(int, db_version_string_match.group(1).split(".")))
+            if db_version_string_match
+            else (0, 0, 0)
+        )
+        uses_pgconn = db_version >= (3, 0, 0)
+
+    return ConnectionInfo(
+        alias=database_wrapper.alias,
+        vendor=database_wrapper.vendor,
+        uses_pgconn=uses_pgconn,
+    )
+
+
+def get_connection_info(database_wrapper: BaseDatabaseWrapper) -> ConnectionInfo:
+    """
+    Returns the metadata of a database connection, which is cached on the database
+    wrapper the first time it is resolved, usually when the connection is opened.
+    """
+    # Read the instance dict directly, as getattr would also find class attributes
+    connection_info: Optional[ConnectionInfo] = vars(database_wrapper).get(
+        CONNECTION_INFO_ATTRIBUTE
+    )
+    if connection_info is None:
+        connection_info = resolve_connection_info(database_wrapper)
+        setattr(database_wrapper, CONNECTION_INFO_ATTRIBUTE, connection_info)
+    return connection_info
+
+
+def _quote_expr(element: Any) -> str:
+    if isinstance(element, str):
+        return f"""'{element.replace("'", "''")}'"""
+    else:
+        return repr(element)
+
+
+def _quote_params(params: ExecuteParametersOrSequence) -> QuoteParamsReturn:
+    if params is None:
+        return params
+    if isinstance(params, dict):
+        return {key: _quote_expr(value) for key, value in params.items()}
+    return [_quote_expr(p) for p in params]
+
+
+def _get_raw_sql(
+    ops: BaseDatabaseOperations,
+    cursor_self: Optional[CursorWrapper],
+    sql: str,
+    params: ExecuteParametersOrSequence,
+    many: bool,
+    vendor: str,
+) -> str:
+    # This is a hacky way to get the parameters correct for sqlite in executemany
+    if (
+        vendor == "sqlite"
+        and many
+        and isinstance(params, (tuple, list))
+        and isinstance(params[0], (tuple, list))
+    ):
+        final_params: List[str] = []
+        part_to_replace = re.search(r"(\(\s*%s.*\))", sql)[1]  # type: ignore
+        sql = sql.replace(part_to_replace, ", ".join(part_to_replace for _ in params))
+        for current_params in zip(*params):  # noqa: B905
+            final_params.extend(current_params)
+
+        return ops.last_executed_query(
+            cursor_self,
+            sql,
+            _quote_params(final_params),
+        )
+
+    return ops.last_executed_query(
+        cursor_self,
+        sql,
+        _quote_params(params),
+    )
+
+
+def render_deferred_raw_sql(
+    alias: str,
+    sql: str,
+    params: ExecuteParametersOrSequence,
+    many: bool,
+    vendor: str,
+) -> str:
+    """
+    Renders the raw SQL when it is first displayed, which may be after the
+    connection the query was executed on has been closed or from another thread, so
+    the operations of the current connection of the alias are used. When they can
+    not render it, the parameters are interpolated without the database.
+    Only plain values are bound to the renderer, so the queries of a stored request
+    keep neither the SQLTracker nor the database wrapper alive.
+    """
+    try:
+        return _get_raw_sql(connections[alias].ops, None, sql, params, many, vendor)
+    except Exception:
+        quoted_params = _quote_params(params)
+        try:
+            return sql % (
+                tuple(quoted_params)
+                if isinstance(quoted_params, list)
+                else quoted_params
+            )
+        except (TypeError, ValueError, KeyError):
+            return sql
+
+
+def render_params(params: ExecuteParametersOrSequence) -> str:
+    with contextlib.suppress(TypeError):
+        return json.dumps(_decode(params))
+    return ""
+
+
+def _decode(param: ExecuteParametersOrSequence) -> "DecodeReturn":
+    if PostgresJson is not None and isinstance(param, PostgresJson):
+        return param.dumps(param.adapted)
+
+    # If a sequence type, decode each element separately
+    if isinstance(param, (tuple, list)):
+        return [_decode(element) for element in param]
+
+    # If a dictionary type, decode each value separately
+    if isinstance(param, dict):
+        return {key: _decode(value) for key, value in param.items()}
+
+    # make sure datetime, date and time are converted to string by force_str
+    CONVERT_TYPES = (datetime.datetime, datetime.date, datetime.time)
+    try:
+        return force_str(param, strings_only=not isinstance(param, CONVERT_TYPES))
+    except UnicodeDecodeError:
+        return "(encoded string)"
+
 
 class SQLTrackerMeta(type):
     @property
@@ -80,12 +238,22 @@ class SQLTrackerMeta(type):
 class SQLTracker(metaclass=SQLTrackerMeta):
     _old_sql_trackers: List["SQLTracker"]
     _sql_collector: Optional[SQLCollector]
-    database_wrapper: Optional[BaseDatabaseWrapper]
+    # The number of stack traces recorded and the time spent recording them
+    _num_stack_traces: int
+    _stack_trace_time: float  # milliseconds
+    # Stack traces by callsite, reused once the stack trace budget is used up
+    _callsite_stack_traces: Dict[CallsiteFingerprint, StackTrace]
+    # Set while a stack trace is recorded, the reprs of the frame locals can run
+    # queries, which are not queries of the request
+    _recording_stack_trace: bool
 
     def __init__(self, sql_collector: Optional[SQLCollector] = None) -> None:
         self._old_sql_trackers = []
         self._sql_collector = sql_collector
-        self.database_wrapper = None
+        self._num_stack_traces = 0
+        self._stack_trace_time = 0.0
+        self._callsite_stack_traces = {}
+        self._recording_stack_trace = False
 
     def __enter__(self) -> "SQLTracker":
         self._old_sql_trackers.append(SQLTracker.current)
@@ -101,77 +269,6 @@ class SQLTracker(metaclass=SQLTrackerMeta):
         old = self._old_sql_trackers.pop()
         _local.set(old)
 
-    def set_database_wrapper(self, database_wrapper: BaseDatabaseWrapper) -> None:
-        self.database_wrapper = database_wrapper
-
-    @staticmethod
-    def _quote_expr(element: Any) -> str:
-        if isinstance(element, str):
-            return f"""'{element.replace("'", "''")}'"""
-        else:
-            return repr(element)
-
-    def _quote_params(self, params: ExecuteParametersOrSequence) -> QuoteParamsReturn:
-        if params is None:
-            return params
-        if isinstance(params, dict):
-            return {key: self._quote_expr(value) for key, value in params.items()}
-        return [self._quote_expr(p) for p in params]
-
-    def _get_raw_sql(
-        self,
-        cursor_self: CursorWrapper,
-        sql: str,
-        params: ExecuteParametersOrSequence,
-        many: bool,
-        vendor: str,
-    ) -> str:
-        # This is a hacky way to get the parameters correct for sqlite in executemany
-        if (
-            vendor == "sqlite"
-            and many
-            and isinstance(params, (tuple, list))
-            and isinstance(params[0], (tuple, list))
-        ):
-            final_params: List[str] = []
-            part_to_replace = re.search(r"(\(\s*%s.*\))", sql)[1]  # type: ignore
-            sql = sql.replace(
-                part_to_replace, ", ".join(part_to_replace for _ in params)
-            )
-            for current_params in zip(*params):  # noqa: B905
-                final_params.extend(current_params)
-
-            return self.database_wrapper.ops.last_executed_query(  # type: ignore
-                cursor_self,
-                sql,
-                self._quote_params(final_params),
-            )
-
-        return self.database_wrapper.ops.last_executed_query(  # type: ignore
-            cursor_self,
-            sql,
-            self._quote_params(params),
-        )
-
-    def _decode(self, param: ExecuteParametersOrSequence) -> "DecodeReturn":
-        if PostgresJson is not None and isinstance(param, PostgresJson):
-            return param.dumps(param.adapted)
-
-        # If a sequence type, decode each element separately
-        if isinstance(param, (tuple, list)):
-            return [self._decode(element) for element in param]
-
-        # If a dictionary type, decode each value separately
-        if isinstance(param, dict):
-            return {key: self._decode(value) for key, value in param.items()}
-
-        # make sure datetime, date and time are converted to string by force_str
-        CONVERT_TYPES = (datetime.datetime, datetime.date, datetime.time)
-        try:
-            return force_str(param, strings_only=not isinstance(param, CONVERT_TYPES))
-        except UnicodeDecodeError:
-            return "(encoded string)"
-
     @staticmethod
     def _get_postgres_isolation_level(conn: Any) -> Any:
         """
@@ -215,6 +312,51 @@ class SQLTracker(metaclass=SQLTrackerMeta):
                 return self._sql_collector.new_transaction_id(alias)
         return None
 
+    def _get_stack_trace(
+        self,
+        sql_collector: SQLCollector,
+        config: dr_settings.RequestsTrackerSettings,
+    ) -> StackTrace:
+        """
+        Records the stack trace of the query being recorded. Requests running
+        thousands of queries would spend most of their time recording stack traces, so
+        once a request uses up its stack trace budget the capture is degraded: a stack
+        trace is only recorded the first time a callsite runs a query, and the
+        following queries of the callsite reuse it. Queries are still all recorded,
+        except the ones run by the reprs of frame locals while the stack trace is
+        recorded.
+        """
+        # Nothing is recorded, so there is no budget to use up
+        if config.stacktrace_mode == dr_settings.STACKTRACE_MODE_OFF:
+            return EMPTY_STACK_TRACE
+
+        # Skip the frames for this method, record and the cursor hook.
+        skip = 3
+        self._recording_stack_trace = True
+        try:
+            if sql_collector.degraded_capture:
+                fingerprint = get_callsite_fingerprint(skip=skip)
+                stack_trace = self._callsite_stack_traces.get(fingerprint)
+                if stack_trace is None:
+                    stack_trace = get_stack_trace(skip=skip)
+                    self._callsite_stack_traces[fingerprint] = stack_trace
+                return stack_trace
+
+            start_time = perf_counter_ns()
+            stack_trace = get_stack_trace(skip=skip)
+            self._stack_trace_time += (perf_counter_ns() - start_time) / 1_000_000
+            self._num_stack_traces += 1
+
+            query_budget = config.stacktrace_query_budget
+            time_budget = config.stacktrace_time_budget
+            if (
+                query_budget is not None and self._num_stack_traces >= query_budget
+            ) or (time_budget is not None and self._stack_trace_time >= time_budget):
+                sql_collector.degraded_capture = True
+            return stack_trace
+        finally:
+            self._recording_stack_trace = False
+
     def record(
         self,
         method: Callable[[CursorWrapper, str, Any], Any],
@@ -224,76 +366,93 @@ class SQLTracker(metaclass=SQLTrackerMeta):
         many: bool = False,
     ) -> Any:  # sourcery skip: remove-unnecessary-cast
         # If we're not tracking SQL, just call the original method
-        if self._sql_collector is None:
+        if self._sql_collector is None or self._recording_stack_trace:
             return method(cursor_self, sql, params)
 
-        if self.database_wrapper is None:
-            raise RuntimeError("SQLTracker not correctly initialized")
+        record_start_ns = perf_counter_ns()
 
-        alias = self.database_wrapper.alias
-        vendor = self.database_wrapper.vendor
+        # Each cursor belongs to the database wrapper of its own alias, so queries
+        # are attributed correctly when several databases are used.
+        database_wrapper = cursor_self.db
+        connection_info = get_connection_info(database_wrapper)
+        alias = connection_info.alias
+        vendor = connection_info.vendor
 
         if vendor == "postgresql":
             # The underlying DB connection (as opposed to Django's wrapper)
-            db_version_string_match = re.match(
-                r"(\d+\.\d+\.\d+)",
-                self.database_wrapper.Database.__version__,  # type: ignore
-            )
-            db_version = (
-                tuple(map(int, db_version_string_match.group(1).split(".")))
-                if db_version_string_match
-                else (0, 0, 0)
-            )
-
-            conn = self.database_wrapper.connection
-            pgconn = (
-                conn
-                if db_version < (3, 0, 0)
-                else self.database_wrapper.connection.pgconn
-            )
+            conn = database_wrapper.connection
+            pgconn = conn.pgconn if connection_info.uses_pgconn else conn
             initial_conn_status = pgconn.status
 
-        start_time = time()
+        start_time = perf_counter_ns()
         try:
             return method(cursor_self, sql, params)
         finally:
-            stop_time = time()
-            duration = (stop_time - start_time) * 1000
-            _params = ""
-            with contextlib.suppress(TypeError):
-                _params = json.dumps(self._decode(params))
+            stop_time = perf_counter_ns()
+            duration = (stop_time - start_time) / 1_000_000
             # Sql might be an object (such as psycopg Composed).
             # For logging purposes, make sure it's str.
             sql = str(sql)
+            ops = database_wrapper.ops
 
-            sql_query_info = SQLQueryInfo(
-                vendor=vendor,
-                alias=alias,
-                sql=sql,
-                duration=duration,
-                raw_sql=self._get_raw_sql(cursor_self, sql, params, many, vendor),
-                params=_params,
-                raw_params=params,
-                stacktrace=get_stack_trace(skip=2),
-                start_time=start_time,
-                stop_time=stop_time,
-                is_slow=duration > dr_settings.get_config()["SQL_WARNING_THRESHOLD"],
-                is_select=sql.lower().strip().startswith("select"),
-            )
+            config = dr_settings.get_settings()
+            ignore_sql_pattern = config.ignore_sql_pattern
 
-            if vendor == "postgresql":
-                sql_query_info.trans_id = self._get_postgres_transaction_id(
-                    conn=pgconn,
-                    initial_conn_status=initial_conn_status,
+            # Ignore patterns are matched against the raw SQL, so it can not be
+            # deferred when any are configured
+            if vendor in DEFERRED_RAW_SQL_VENDORS and ignore_sql_pattern is None:
+                raw_sql = None
+                raw_sql_renderer = partial(
+                    render_deferred_raw_sql, alias, sql, params, many, vendor
+                )
+            else:
+                raw_sql = _get_raw_sql(ops, cursor_self, sql, params, many, vendor)
+                raw_sql_renderer = None
+
+            # Ignored queries are dropped right away, before their stack trace is
+            # recorded, so they cost next to nothing
+            if (
+                raw_sql is None
+                or ignore_sql_pattern is None
+                or not ignore_sql_pattern.match(raw_sql)
+            ):
+                sql_query_info = SQLQueryInfo(
+                    vendor=vendor,
                     alias=alias,
+                    sql=sql,
+                    duration=duration,
+                    raw_sql=raw_sql,
+                    params=None,
+                    raw_params=params,
+                    stacktrace=self._get_stack_trace(self._sql_collector, config),
+                    start_time=start_time,
+                    stop_time=stop_time,
+                    is_slow=duration > config.sql_warning_threshold,
+                    is_select=sql.lower().strip().startswith("select"),
+                    raw_sql_renderer=raw_sql_renderer,
+                    params_renderer=render_params,
                 )
-                try:
-                    sql_query_info.trans_status = pgconn.get_transaction_status()
-                except AttributeError:
-                    sql_query_info.trans_status = pgconn.transaction_status
-                sql_query_info.iso_level = self._get_postgres_isolation_level(pgconn)
 
-            self._sql_collector.record(sql_query_info)
+                if vendor == "postgresql":
+                    sql_query_info.trans_id = self._get_postgres_transaction_id(
+                        conn=pgconn,
+                        initial_conn_status=initial_conn_status,
+                        alias=alias,
+                    )
+                    try:
+                        sql_query_info.trans_status = pgconn.get_transaction_status()
+                    except AttributeError:
+                        sql_query_info.trans_status = pgconn.transaction_status
+                    sql_query_info.iso_level = self._get_postgres_isolation_level(
+                        pgconn
+                    )
+
+                self._sql_collector.record(sql_query_info)
+
+            # Everything but executing the query is the overhead of the tracker
+            self._sql_collector.overhead_ns += (start_time - record_start_ns) + (
+                perf_counter_ns() - stop_time
+            )
 
 
 GLOBAL_SQL_TRACKER = SQLTracker()
@@ -1,16 +1,218 @@
 import inspect
 import linecache
-from types import FrameType
-from typing import Any, Dict, Generator, List, Optional, Tuple
+import reprlib
+import sys
+import threading
+import weakref
+from itertools import islice
+from types import CodeType, FrameType
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    overload,
+)
 
 from asgiref.local import Local
+from django.db.models.query import QuerySet
 
 from requests_tracker import settings
+from requests_tracker.footprint import POINTER_SIZE
 
 _local_data = Local()
 
+# the reprs of the locals of a frame by name, see get_locals_snapshot
+FrameLocals = Dict[str, str]
 # each tuple is: filename, line_no, func_name, source_line, frame_locals
-StackTrace = List[Tuple[str, int, str, str, Optional[Dict[str, Any]]]]
+StackTraceFrame = Tuple[str, int, str, str, Optional[FrameLocals]]
+StackTrace = Sequence[StackTraceFrame]
+# each tuple is: code object, line_no, module name
+RawStackTraceFrame = Tuple[CodeType, int, Optional[str]]
+
+# each tuple is: code object, line_no of every frame in the call stack
+CallsiteFingerprint = Tuple[Tuple[CodeType, int], ...]
+
+# Bounds of the snapshots of frame locals recorded with ENABLE_STACKTRACES_LOCALS
+LOCALS_MAX_KEYS = 50
+LOCALS_MAX_REPR_LENGTH = 200
+LOCALS_MAX_DEPTH = 3
+
+# Number of entries after which the per code object caches are cleared
+CODE_CACHE_SIZE = 10_000
+
+# Number of frames after which a new frame table is started, see _FrameTable
+FRAME_TABLE_SIZE = 10_000
+# Approximate sizes of a frame tuple with its table entries and of an interned
+# trace, without the strings and frame IDs
+FRAME_SIZE = 400
+TRACE_SIZE = 150
+
+# The tuple of a frame captured by LazyStackTrace and its line number. The code
+# object and the module name it references belong to the module.
+RAW_FRAME_SIZE = sys.getsizeof((None, 0, None)) + sys.getsizeof(2**16)
+
+
+class _FrameTable:
+    """
+    Table of the stack frames seen in recorded stack traces.
+
+    Each unique frame is stored once and identified by its index in the table, and
+    each unique stack trace is stored once as a tuple of frame IDs. Requests with
+    many queries from the same call chain therefore share a single trace instead of
+    duplicating the same strings for every query.
+
+    Stack traces reference the table they were interned in. Once the current table
+    holds FRAME_TABLE_SIZE frames a new one is started, and older tables are freed
+    with the last stored request whose stack traces use them.
+    """
+
+    def __init__(self) -> None:
+        self._frames: List[StackTraceFrame] = []
+        self._frame_ids: Dict[StackTraceFrame, int] = {}
+        self._traces: Dict[Tuple[int, ...], Tuple[int, ...]] = {}
+        self._lock = threading.Lock()
+        self.footprint = 0
+
+    def intern_trace(self, frames: List[StackTraceFrame]) -> Tuple[int, ...]:
+        """Interns frames, which must not include locals, and returns their IDs"""
+        with self._lock:
+            frame_ids = []
+            for frame in frames:
+                frame_id = self._frame_ids.get(frame)
+                if frame_id is None:
+                    frame_id = len(self._frames)
+                    self._frames.append(frame)
+                    self._frame_ids[frame] = frame_id
+                    filename, _, func_name, source_line, _ = frame
+                    self.footprint += FRAME_SIZE + (
+                        len(filename) + len(func_name) + len(source_line)
+                    )
+                frame_ids.append(frame_id)
+
+            trace = tuple(frame_ids)
+            interned_trace = self._traces.setdefault(trace, trace)
+            if interned_trace is trace:
+                self.footprint += TRACE_SIZE + len(trace) * POINTER_SIZE
+            return interned_trace
+
+    def get_frame(self, frame_id: int) -> StackTraceFrame:
+        return self._frames[frame_id]
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+
+_frame_table = _FrameTable()
+_frame_tables: "weakref.WeakSet[_FrameTable]" = weakref.WeakSet([_frame_table])
+_frame_tables_lock = threading.Lock()
+
+
+def _get_frame_table() -> _FrameTable:
+    """The frame table new stack traces are interned in"""
+    global _frame_table
+    frame_table = _frame_table
+    if len(frame_table) >= FRAME_TABLE_SIZE:
+        with _frame_tables_lock:
+            if _frame_table is frame_table:
+                _frame_table = _FrameTable()
+                _frame_tables.add(_frame_table)
+            frame_table = _frame_table
+    return frame_table
+
+
+def get_frame_tables_footprint() -> int:
+    """Approximate number of bytes retained by the frame tables still in use"""
+    with _frame_tables_lock:
+        frame_tables = list(_frame_tables)
+    return sum(frame_table.footprint for frame_table in frame_tables)
+
+
+class InternedStackTrace(Sequence[StackTraceFrame]):
+    """
+    A stack trace stored as frame IDs of the frame table it was interned in.
+
+    Behaves like a sequence of (file name, line number, function name, source line,
+    frame locals) tuples. Frame locals can not be shared between traces, so they
+    are kept next to the frame IDs when ``ENABLE_STACKTRACES_LOCALS`` is enabled.
+    """
+
+    __slots__ = ("frame_table", "frame_ids", "frame_locals")
+
+    frame_table: _FrameTable
+    frame_ids: Tuple[int, ...]
+    frame_locals: Optional[Tuple[Optional[FrameLocals], ...]]
+
+    def __init__(
+        self,
+        frame_table: _FrameTable,
+        frame_ids: Tuple[int, ...],
+        frame_locals: Optional[Tuple[Optional[FrameLocals], ...]] = None,
+    ) -> None:
+        self.frame_table = frame_table
+        self.frame_ids = frame_ids
+        self.frame_locals = frame_locals
+
+    @classmethod
+    def intern(
+        cls,
+        frames: List[StackTraceFrame],
+        frame_locals: Optional[Tuple[Optional[FrameLocals], ...]] = None,
+    ) -> "InternedStackTrace":
+        frame_table = _get_frame_table()
+        return cls(frame_table, frame_table.intern_trace(frames), frame_locals)
+
+    def _get_frame(self, index: int) -> StackTraceFrame:
+        frame = self.frame_table.get_frame(self.frame_ids[index])
+        if self.frame_locals is None:
+            return frame
+        filename, line_no, func_name, source_line, _ = frame
+        return filename, line_no, func_name, source_line, self.frame_locals[index]
+
+    @overload
+    def __getitem__(self, index: int) -> StackTraceFrame: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[StackTraceFrame]: ...
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[StackTraceFrame, List[StackTraceFrame]]:
+        if isinstance(index, slice):
+            return [self._get_frame(i) for i in range(len(self))[index]]
+        return self._get_frame(index)
+
+    def __iter__(self) -> Iterator[StackTraceFrame]:
+        for index in range(len(self.frame_ids)):
+            yield self._get_frame(index)
+
+    def __len__(self) -> int:
+        return len(self.frame_ids)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, InternedStackTrace) and (
+            self.frame_table is other.frame_table
+        ):
+            return (
+                self.frame_ids == other.frame_ids
+                and self.frame_locals == other.frame_locals
+            )
+        if isinstance(other, (InternedStackTrace, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({list(self)!r})"
+
+
+EMPTY_STACK_TRACE = InternedStackTrace(_FrameTable(), ())
 
 
 def _stack_frames(*, skip: int = 0) -> Generator[FrameType, None, None]:
@@ -24,101 +226,348 @@ def _stack_frames(*, skip: int = 0) -> Generator[FrameType, None, None]:
         frame = frame.f_back
 
 
-def _is_excluded_frame(frame: FrameType, excluded_modules: Optional[List[str]]) -> bool:
-    if not excluded_modules:
-        return False
-    frame_module = frame.f_globals.get("__name__")
-    return (
-        any(
-            frame_module == excluded_module
-            or frame_module.startswith(f"{excluded_module}.")
-            for excluded_module in excluded_modules
-        )
-        if isinstance(frame_module, str)
-        else False
+def _get_outer_frame(depth: int) -> Optional[FrameType]:
+    """Like sys._getframe, but returns None if the call stack is not deep enough"""
+    try:
+        # Skip the frame for this function.
+        return sys._getframe(depth + 1)
+    except ValueError:
+        return None
+
+
+class _LocalsRepr(reprlib.Repr):
+    def __init__(self) -> None:
+        super().__init__()
+        self.maxlevel = LOCALS_MAX_DEPTH
+        self.maxstring = LOCALS_MAX_REPR_LENGTH
+        self.maxother = LOCALS_MAX_REPR_LENGTH
+
+    def repr1(self, x: Any, level: int) -> str:
+        # The repr of a queryset evaluates it
+        if isinstance(x, QuerySet):
+            model_label = x.model._meta.label if x.model is not None else "unknown"
+            return f"<{type(x).__name__} of {model_label}>"
+        return super().repr1(x, level)
+
+
+_locals_repr = _LocalsRepr()
+
+
+def _get_safe_repr(value: Any) -> str:
+    try:
+        value_repr = _locals_repr.repr(value)
+    except Exception:
+        return f"<{type(value).__name__} object, repr failed>"
+    if len(value_repr) > LOCALS_MAX_REPR_LENGTH:
+        value_repr = f"{value_repr[: LOCALS_MAX_REPR_LENGTH - 3]}..."
+    return value_repr
+
+
+def _is_excluded_module(
+    module_name: Optional[str], excluded_module_prefixes: Tuple[str, ...]
+) -> bool:
+    return isinstance(module_name, str) and f"{module_name}.".startswith(
+        excluded_module_prefixes
     )
 
 
 def get_stack_trace(*, skip: int = 0) -> StackTrace:
     """
     Return a processed stack trace for the current call stack.
-    If the ``ENABLE_STACKTRACES`` setting is False, return an empty :class:`list`.
-    Otherwise return a :class:`list` of processed stack frame tuples (file name, line
-    number, function name, source line, frame locals) for the current call stack.  The
-    first entry in the list will be for the bottom of the stack and the last entry will
-    be for the top of the stack.
+    If stack traces are disabled, with ``STACKTRACE_MODE`` set to ``"off"`` or
+    ``ENABLE_STACKTRACES`` set to False, return an empty stack trace.
+    Otherwise return an :class:`InternedStackTrace` of processed stack frame tuples
+    (file name, line number, function name, source line, frame locals) for the current
+    call stack, or in the ``"lazy"`` mode a :class:`LazyStackTrace`, which behaves the
+    same but only processes the frames when it is first accessed.
+    The first entry in the trace will be for the bottom of the stack and
+    the last entry will be for the top of the stack.
     ``skip`` is an :class:`int` indicating the number of stack frames above the frame
     for this function to omit from the stack trace.  The default value of ``0`` means
     that the entry for the caller of this function will be the last entry in the
     returned stack trace.
     """
-    config = settings.get_config()
-    if not config["ENABLE_STACKTRACES"]:
-        return []
+    config = settings.get_settings()
+    if config.stacktrace_mode == settings.STACKTRACE_MODE_OFF:
+        return EMPTY_STACK_TRACE
     skip += 1  # Skip the frame for this function.
+    if config.stacktrace_mode == settings.STACKTRACE_MODE_LAZY:
+        return LazyStackTrace.capture(
+            excluded_module_prefixes=config.hidden_module_prefixes,
+            skip=skip,
+        )
+    return _get_stack_trace_recorder().get_stack_trace(
+        excluded_module_prefixes=config.hidden_module_prefixes,
+        include_locals=config.enable_stacktraces_locals,
+        skip=skip,
+    )
+
+
+def get_callsite_fingerprint(*, skip: int = 0) -> CallsiteFingerprint:
+    """
+    Return the code object and line number of every frame of the current call stack.
+    They identify the stack trace :func:`get_stack_trace` would record for the same
+    call stack, without processing any of the frames.
+    ``skip`` works like it does for :func:`get_stack_trace`.
+    """
+    # Skip the frame for this function.
+    frame = _get_outer_frame(skip + 1)
+    fingerprint: List[Tuple[CodeType, int]] = []
+    while frame is not None:
+        fingerprint.append((frame.f_code, frame.f_lineno))
+        frame = frame.f_back
+    return tuple(fingerprint)
+
+
+def _get_stack_trace_recorder() -> "_StackTraceRecorder":
     stack_trace_recorder = getattr(_local_data, "stack_trace_recorder", None)
     if stack_trace_recorder is None:
         stack_trace_recorder = _StackTraceRecorder()
         _local_data.stack_trace_recorder = stack_trace_recorder
-    return stack_trace_recorder.get_stack_trace(
-        excluded_modules=config["HIDE_IN_STACKTRACES"],
-        include_locals=config["ENABLE_STACKTRACES_LOCALS"],
-        skip=skip,
-    )
+    return stack_trace_recorder
 
 
 class _StackTraceRecorder:
+    """
+    Processes stack frames into stack trace tuples.
+
+    The same frames show up in the stack traces of thousands of queries, so whether
+    a frame is excluded and the source line of a frame are cached per code object,
+    which makes frames seen before cost a few dictionary lookups.
+    """
+
     def __init__(self) -> None:
         self.filename_cache: Dict[str, Tuple[str, bool]] = {}
+        self.excluded_cache: Dict[CodeType, bool] = {}
+        self.excluded_module_prefixes: Tuple[str, ...] = ()
+        self.module_globals_cache: Dict[CodeType, Optional[Dict[str, Any]]] = {}
+        self.source_line_cache: Dict[Tuple[CodeType, int], str] = {}
+        self.taking_locals_snapshot = False
 
-    def get_source_file(self, frame: FrameType) -> Tuple[str, bool]:
-        frame_filename = frame.f_code.co_filename
+    def get_source_file(self, code: CodeType) -> Tuple[str, bool]:
+        code_filename = code.co_filename
 
-        value = self.filename_cache.get(frame_filename)
+        value = self.filename_cache.get(code_filename)
         if value is None:
-            filename = inspect.getsourcefile(frame)
+            filename = inspect.getsourcefile(code)
             if filename is None:
                 is_source = False
-                filename = frame_filename
+                filename = code_filename
             else:
                 is_source = True
                 # Ensure linecache validity the first time this recorder
                 # encounters the filename in this frame.
                 linecache.checkcache(filename)
             value = (filename, is_source)
-            self.filename_cache[frame_filename] = value
+            self.filename_cache[code_filename] = value
 
         return value
 
+    def get_excluded_cache(
+        self, excluded_module_prefixes: Tuple[str, ...]
+    ) -> Dict[CodeType, bool]:
+        """Returns the exclusion cache, which is only valid for the given prefixes"""
+        if (
+            excluded_module_prefixes != self.excluded_module_prefixes
+            or len(self.excluded_cache) > CODE_CACHE_SIZE
+        ):
+            self.excluded_cache = {}
+            self.excluded_module_prefixes = excluded_module_prefixes
+        return self.excluded_cache
+
+    def get_source_line(self, code: CodeType, line_no: int, filename: str) -> str:
+        key = (code, line_no)
+        source_line = self.source_line_cache.get(key)
+        if source_line is None:
+            if len(self.source_line_cache) > CODE_CACHE_SIZE:
+                self.source_line_cache.clear()
+                self.module_globals_cache.clear()
+
+            if code in self.module_globals_cache:
+                module_globals = self.module_globals_cache[code]
+            else:
+                module = inspect.getmodule(code, filename)
+                module_globals = module.__dict__ if module is not None else None
+                self.module_globals_cache[code] = module_globals
+
+            source_line = linecache.getline(filename, line_no, module_globals).strip()
+            self.source_line_cache[key] = source_line
+
+        return source_line
+
+    def get_locals_snapshot(self, frame_locals: Dict[str, Any]) -> FrameLocals:
+        """
+        The repr of the frame locals with at most LOCALS_MAX_KEYS keys, so no live
+        objects are kept alive by the tracker and the memory of a snapshot is bounded.
+        A repr can run queries, model instances for example often use related objects
+        in __str__. SQLTracker does not record them, and stack traces recorded while
+        taking a snapshot have no locals.
+        """
+        if self.taking_locals_snapshot:
+            return {}
+        self.taking_locals_snapshot = True
+        try:
+            snapshot = {
+                name: _get_safe_repr(value)
+                for name, value in islice(frame_locals.items(), LOCALS_MAX_KEYS)
+            }
+        finally:
+            self.taking_locals_snapshot = False
+        if len(frame_locals) > LOCALS_MAX_KEYS:
+            snapshot["..."] = f"{len(frame_locals) - LOCALS_MAX_KEYS} more locals"
+        return snapshot
+
     def get_stack_trace(
         self,
         *,
-        excluded_modules: Optional[List[str]] = None,
+        excluded_module_prefixes: Tuple[str, ...] = (),
         include_locals: bool = False,
         skip: int = 0,
     ) -> StackTrace:
-        trace = []
+        trace: List[StackTraceFrame] = []
+        trace_locals: List[Optional[FrameLocals]] = []
+        excluded_cache = self.get_excluded_cache(excluded_module_prefixes)
         skip += 1  # Skip the frame for this method.
         for frame in _stack_frames(skip=skip):
-            if _is_excluded_frame(frame, excluded_modules):
-                continue
-
-            filename, is_source = self.get_source_file(frame)
+            code = frame.f_code
+            if excluded_module_prefixes:
+                is_excluded = excluded_cache.get(code)
+                if is_excluded is None:
+                    is_excluded = _is_excluded_module(
+                        frame.f_globals.get("__name__"), excluded_module_prefixes
+                    )
+                    excluded_cache[code] = is_excluded
+                if is_excluded:
+                    continue
 
             line_no = frame.f_lineno
-            func_name = frame.f_code.co_name
+            trace.append(self._get_frame_info(code, line_no))
+            if include_locals:
+                trace_locals.append(self.get_locals_snapshot(frame.f_locals))
 
-            if is_source:
-                module = inspect.getmodule(frame, filename)
-                module_globals = module.__dict__ if module is not None else None
-                source_line = linecache.getline(
-                    filename, line_no, module_globals
-                ).strip()
-            else:
-                source_line = ""
+        trace.reverse()
+        trace_locals.reverse()
+        return InternedStackTrace.intern(
+            trace, tuple(trace_locals) if include_locals else None
+        )
+
+    def resolve_raw_frames(
+        self,
+        raw_frames: Sequence[RawStackTraceFrame],
+        excluded_module_prefixes: Tuple[str, ...],
+    ) -> InternedStackTrace:
+        """Processes frames captured by LazyStackTrace, which are ordered top down"""
+        trace: List[StackTraceFrame] = []
+        excluded_cache = self.get_excluded_cache(excluded_module_prefixes)
+        for code, line_no, module_name in raw_frames:
+            if excluded_module_prefixes:
+                is_excluded = excluded_cache.get(code)
+                if is_excluded is None:
+                    is_excluded = _is_excluded_module(
+                        module_name, excluded_module_prefixes
+                    )
+                    excluded_cache[code] = is_excluded
+                if is_excluded:
+                    continue
 
-            frame_locals = frame.f_locals if include_locals else None
+            trace.append(self._get_frame_info(code, line_no))
 
-            trace.append((filename, line_no, func_name, source_line, frame_locals))
         trace.reverse()
-        return trace
+        return InternedStackTrace.intern(trace)
+
+    def _get_frame_info(self, code: CodeType, line_no: int) -> StackTraceFrame:
+        filename, is_source = self.get_source_file(code)
+        source_line = self.get_source_line(code, line_no, filename) if is_source else ""
+        return filename, line_no, code.co_name, source_line, None
+
+
+class LazyStackTrace(Sequence[StackTraceFrame]):
+    """
+    A stack trace captured as (code object, line number, module name) per frame.
+
+    Capturing it only walks the frames, finding the file names and source lines and
+    leaving out the frames of hidden modules is done when the trace is first
+    accessed, usually when it is displayed. The processed trace is then kept as an
+    :class:`InternedStackTrace` and the captured frames are released.
+    Frame locals are not captured in this mode.
+    """
+
+    __slots__ = ("_raw_frames", "_excluded_module_prefixes", "_stack_trace")
+
+    _raw_frames: Tuple[RawStackTraceFrame, ...]
+    _excluded_module_prefixes: Tuple[str, ...]
+    _stack_trace: Optional[InternedStackTrace]
+
+    def __init__(
+        self,
+        raw_frames: Tuple[RawStackTraceFrame, ...],
+        excluded_module_prefixes: Tuple[str, ...] = (),
+    ) -> None:
+        self._raw_frames = raw_frames
+        self._excluded_module_prefixes = excluded_module_prefixes
+        self._stack_trace = None
+
+    @classmethod
+    def capture(
+        cls,
+        *,
+        excluded_module_prefixes: Tuple[str, ...] = (),
+        skip: int = 0,
+    ) -> "LazyStackTrace":
+        # Skip the frame for this method.
+        frame = _get_outer_frame(skip + 1)
+        raw_frames: List[RawStackTraceFrame] = []
+        while frame is not None:
+            raw_frames.append(
+                (frame.f_code, frame.f_lineno, frame.f_globals.get("__name__"))
+            )
+            frame = frame.f_back
+        return cls(tuple(raw_frames), excluded_module_prefixes)
+
+    @property
+    def is_resolved(self) -> bool:
+        return self._stack_trace is not None
+
+    @property
+    def footprint(self) -> int:
+        """
+        The bytes retained by the captured frames. The processed trace is shared
+        through the frame table, so a resolved trace retains next to nothing.
+        """
+        raw_frames = self._raw_frames
+        return sys.getsizeof(raw_frames) + len(raw_frames) * RAW_FRAME_SIZE
+
+    def resolve(self) -> InternedStackTrace:
+        if self._stack_trace is None:
+            self._stack_trace = _get_stack_trace_recorder().resolve_raw_frames(
+                self._raw_frames, self._excluded_module_prefixes
+            )
+            self._raw_frames = ()
+        return self._stack_trace
+
+    @overload
+    def __getitem__(self, index: int) -> StackTraceFrame: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[StackTraceFrame]: ...
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[StackTraceFrame, List[StackTraceFrame]]:
+        return self.resolve()[index]
+
+    def __iter__(self) -> Iterator[StackTraceFrame]:
+        return iter(self.resolve())
+
+    def __len__(self) -> int:
+        return len(self.resolve())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LazyStackTrace):
+            other = other.resolve()
+        return self.resolve() == other
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({list(self)!r})"
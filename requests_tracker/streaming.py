@@ -0,0 +1,99 @@
+from functools import partial
+from time import perf_counter_ns
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from django.http import StreamingHttpResponse
+
+from requests_tracker.main_request_collector import MainRequestCollector
+from requests_tracker.request_store import RequestStore
+from requests_tracker.sql.sql_tracker import SQLTracker
+
+
+def track_streaming_response(
+    response: StreamingHttpResponse,
+    request_collector: MainRequestCollector,
+    request_collectors: RequestStore,
+    sql_tracker: SQLTracker,
+) -> None:
+    """
+    Wraps the content of a streaming response, so the time to first byte, the time
+    spent streaming and the number of bytes sent are recorded and queries run while
+    the content is generated, e.g. by lazy querysets, are attributed to the request.
+
+    The request is finished once the content was sent or the response was closed,
+    also when it is closed before the content was iterated, e.g. for HEAD requests
+    or when the client disconnected. ``sql_tracker`` is only active while the next
+    chunk is generated, so nothing else running between the chunks is attributed to
+    the request.
+    """
+    if response.is_async:
+        response.streaming_content = _track_chunks_async(
+            response.streaming_content,  # type: ignore[arg-type]
+            request_collector,
+            request_collectors,
+            sql_tracker,
+        )
+    else:
+        response.streaming_content = _track_chunks(
+            response.streaming_content,  # type: ignore[arg-type]
+            request_collector,
+            request_collectors,
+            sql_tracker,
+        )
+    # A generator closed before it was started does not run its finally block
+    response._resource_closers.append(  # type: ignore[attr-defined]
+        partial(_finish_streaming, request_collector, request_collectors)
+    )
+
+
+def _track_chunks(
+    chunks: Iterable[bytes],
+    request_collector: MainRequestCollector,
+    request_collectors: RequestStore,
+    sql_tracker: SQLTracker,
+) -> Iterator[bytes]:
+    iterator = iter(chunks)
+    try:
+        while True:
+            with sql_tracker:
+                chunk = next(iterator, None)
+            if chunk is None:
+                return
+            request_collector.record_chunk(chunk)
+            yield chunk
+    finally:
+        _finish_streaming(request_collector, request_collectors)
+
+
+async def _track_chunks_async(
+    chunks: AsyncIterable[bytes],
+    request_collector: MainRequestCollector,
+    request_collectors: RequestStore,
+    sql_tracker: SQLTracker,
+) -> AsyncIterator[bytes]:
+    iterator = chunks.__aiter__()
+    try:
+        while True:
+            with sql_tracker:
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            request_collector.record_chunk(chunk)
+            yield chunk
+    finally:
+        _finish_streaming(request_collector, request_collectors)
+
+
+def _finish_streaming(
+    request_collector: MainRequestCollector,
+    request_collectors: RequestStore,
+) -> None:
+    # Called when the content was sent and again when the response is closed
+    if request_collector.finished:
+        return
+    overhead_start_ns = perf_counter_ns()
+    request_collector.finish_streaming()
+    # The store records the overhead of the request when it finishes
+    request_collector.overhead_ns += perf_counter_ns() - overhead_start_ns
+    request_collectors.finish(request_collector)
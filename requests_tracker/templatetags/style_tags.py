@@ -1,10 +1,10 @@
 import colorsys
-from typing import List
+from typing import Optional
 
 from django import template
 from django.template.defaultfilters import stringfilter
 
-from requests_tracker.sql.dataclasses import SQLQueryInfo
+from requests_tracker.sql.sql_collector import SQLCollector
 
 register = template.Library()
 
@@ -70,15 +70,23 @@ def contrast_color_from_number(color_number: int) -> str:
 
 @register.simple_tag
 def timeline_bar_styles(
-    queries: List[SQLQueryInfo],
-    total_sql_time: float,
+    sql_collector: SQLCollector,
+    request_duration: Optional[float],
     current_index: int,
 ) -> str:
-    current_query = queries[current_index]
-    percentage = (current_query.duration / total_sql_time) * 100
-    offset_percentage = (
-        sum(query.duration for query in queries[:current_index]) / total_sql_time * 100
-    )
+    """
+    Places a query on a timeline of the request, at the time it started relative to
+    the start of the request
+    """
+    current_query = sql_collector.queries[current_index]
+    timeline_duration = max(request_duration or 0.0, sql_collector.timeline_duration)
+    if timeline_duration > 0:
+        percentage = current_query.duration / timeline_duration * 100
+        offset_percentage = (
+            sql_collector.get_query_offset(current_query) / timeline_duration * 100
+        )
+    else:
+        percentage = offset_percentage = 0.0
 
     color = contrast_color_from_number(current_index + 100)
     return (
@@ -12,5 +12,10 @@ urlpatterns = [
         views.request_details,
         name="request_details",
     ),
+    path(
+        "request-details/<uuid:request_id>/body/<str:body_name>",
+        views.request_body,
+        name="request_body",
+    ),
     path("django-settings", views.django_settings, name="django_settings"),
 ]
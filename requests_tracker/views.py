@@ -1,13 +1,18 @@
-from datetime import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from typing import Dict, Optional, Tuple, Union
 from uuid import UUID
 
 from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
 from django.template.response import TemplateResponse
 from django.views.debug import get_default_exception_reporter_filter
 
 from requests_tracker.main_request_collector import MainRequestCollector
 from requests_tracker.middleware import RequestWithCollectors
+from requests_tracker.request_store import RequestStore
+from requests_tracker.settings import get_settings
+from requests_tracker.sort_index import SortKey
 
 RequestsType = Dict[UUID, MainRequestCollector]
 
@@ -20,59 +25,99 @@ def is_htmx_search_or_sort_request(request: RequestWithCollectors) -> bool:
     return request.headers.get("HX-Target") == "request-list-search-results"
 
 
-def sort_requests(
-    requests: RequestsType,
+# Where the previous page ended: the requests_sorter and the sort key of the last
+# request on it
+RequestsCursor = Tuple[str, SortKey]
+
+
+def encode_cursor(cursor: RequestsCursor) -> str:
+    requests_sorter, sort_key = cursor
+    return urlsafe_b64encode(json.dumps([requests_sorter, *sort_key]).encode()).decode()
+
+
+def decode_cursor(
+    encoded_cursor: str, requests_sorter: str
+) -> Optional[RequestsCursor]:
+    """The cursor, or None if it is invalid or was made for another sort order"""
+    try:
+        sorter, value, start_key, request_id_key = json.loads(
+            urlsafe_b64decode(encoded_cursor.encode())
+        )
+    except (ValueError, TypeError):
+        return None
+    if (
+        sorter != requests_sorter
+        or not isinstance(value, (str, int, float))
+        or not isinstance(start_key, int)
+        or not isinstance(request_id_key, int)
+    ):
+        return None
+    # Sort values of the same sorter are all strings or all numbers
+    if isinstance(value, str) != (requests_sorter in ("name", "view")):
+        return None
+    return sorter, (value, start_key, request_id_key)
+
+
+def get_requests_page(
+    request_collectors: RequestStore,
     requests_sorter: str,
     requests_direction: str,
-) -> RequestsType:
-    def sort_func(
-        item: Tuple[UUID, MainRequestCollector],
-    ) -> Optional[Union[str, int, datetime]]:
-        _, request = item
-        if requests_sorter == "time":
-            return request.start_time
-        elif requests_sorter == "duration":
-            return request.duration
-        elif requests_sorter == "name":
-            return str(request.request.path)
-        elif requests_sorter == "view":
-            return request.django_view
-        elif requests_sorter == "query_count":
-            return request.sql_collector.num_queries
-        elif requests_sorter == "duplicate_query_count":
-            return request.sql_collector.total_duplicate_queries
-        elif requests_sorter == "similar_query_count":
-            return request.sql_collector.total_similar_queries
-        else:
-            return request.start_time
-
-    reverse = requests_direction != "ascending"
-    return dict(
-        sorted(requests.items(), key=sort_func, reverse=reverse)  # type: ignore
+    requests_filter: str,
+    previous_cursor: Optional[RequestsCursor],
+    page_size: int,
+) -> Tuple[RequestsType, Optional[RequestsCursor]]:
+    """
+    The page of sorted requests after ``previous_cursor``, and the cursor of its
+    last request if there are more requests after it. Unlike an offset, the cursor
+    keeps pointing at the same place while new requests are tracked.
+    """
+    sorted_requests = request_collectors.iter_sorted(
+        requests_sorter,
+        descending=requests_direction != "ascending",
+        after=previous_cursor[1] if previous_cursor is not None else None,
     )
+    page: RequestsType = {}
+    # The key the last request on the page is indexed under, which may differ from
+    # its current sort key while the request is in progress
+    last_sort_key: Optional[SortKey] = None
+    for request_id, request_collector, sort_key in sorted_requests:
+        if requests_filter and not request_collector.matches_search_filter(
+            requests_filter
+        ):
+            continue
+        if len(page) == page_size and last_sort_key is not None:
+            return page, (requests_sorter, last_sort_key)
+        page[request_id] = request_collector
+        last_sort_key = sort_key
+    return page, None
 
 
 def index(request: RequestWithCollectors) -> TemplateResponse:
     requests_filter = request.GET.get("requests_filter", "")
     requests_sorter = request.GET.get("requests_sorter", "time")
     requests_direction = request.GET.get("requests_direction", "")
+    requests_cursor = request.GET.get("requests_cursor", "")
 
-    sorted_requests = sort_requests(
+    page, next_cursor = get_requests_page(
         request.request_collectors,
         requests_sorter,
         requests_direction,
+        requests_filter,
+        decode_cursor(requests_cursor, requests_sorter) if requests_cursor else None,
+        get_settings().requests_page_size,
     )
 
+    # Only the requests on the page are rendered
     requests = {
         request_id: request_collector.get_as_context()
-        for request_id, request_collector in list(sorted_requests.items())
-        if not requests_filter
-        or request_collector.matches_search_filter(requests_filter)
+        for request_id, request_collector in page.items()
     }
 
     template = "index.html"
 
-    if is_htmx_search_or_sort_request(request):
+    if requests_cursor and is_htmx_request(request):
+        template = "partials/request_list_page_partial.html"
+    elif is_htmx_search_or_sort_request(request):
         template = "partials/request_list_only_partial.html"
     elif is_htmx_request(request):
         template = "partials/request_list_partial.html"
@@ -82,6 +127,14 @@ def index(request: RequestWithCollectors) -> TemplateResponse:
         template,
         context={
             "requests": requests,
+            "requests_next_cursor": (
+                encode_cursor(next_cursor) if next_cursor is not None else None
+            ),
+            "requests_footprint": request.request_collectors.footprint,
+            "requests_overhead": request.request_collectors.overhead,
+            "requests_overhead_percentage": (
+                request.request_collectors.overhead_percentage
+            ),
             "requests_filter": requests_filter,
             "requests_sorter": requests_sorter,
             "requests_direction": requests_direction,
@@ -89,6 +142,16 @@ def index(request: RequestWithCollectors) -> TemplateResponse:
     )
 
 
+def get_request_collector(
+    request: RequestWithCollectors, request_id: UUID
+) -> MainRequestCollector:
+    """The stored request, requests may have been evicted since they were listed"""
+    try:
+        return request.request_collectors[request_id]
+    except KeyError as exc:
+        raise Http404("Request not found") from exc
+
+
 def single_request_item(
     request: RequestWithCollectors, request_id: UUID
 ) -> TemplateResponse:
@@ -96,7 +159,7 @@ def single_request_item(
         request,
         "partials/request_list_item.html",
         context={
-            "request": request.request_collectors[request_id],
+            "request": get_request_collector(request, request_id),
             "request_id": request_id,
         },
     )
@@ -115,11 +178,37 @@ def request_details(
         if is_htmx_request(request)
         else "request_details.html"
     )
-    context = request.request_collectors[UUID(str(request_id))].get_as_context()
+    request_id = UUID(str(request_id))
+    context = get_request_collector(request, request_id).get_as_context()
+    request.request_collectors.touch(request_id)
 
     return TemplateResponse(request=request, template=template, context=context)
 
 
+def request_body(
+    request: RequestWithCollectors,
+    request_id: UUID,
+    body_name: str,
+) -> StreamingHttpResponse:
+    """Streams a captured request or response body back from memory or disk"""
+    body_collector = get_request_collector(request, request_id).body_collector
+    body = body_collector.get_body(body_name) if body_collector else None
+    if body is None:
+        raise Http404("Body not captured")
+
+    # Always served as plain text, so captured HTML or scripts are not rendered
+    response = StreamingHttpResponse(
+        body.iter_chunks(),
+        content_type="text/plain; charset=utf-8",
+    )
+    response["X-Content-Type-Options"] = "nosniff"
+    if "download" in request.GET:
+        response["Content-Disposition"] = (
+            f'attachment; filename="{request_id}-{body_name}-body"'
+        )
+    return response
+
+
 get_safe_settings = get_default_exception_reporter_filter().get_safe_settings
 
 
@@ -0,0 +1,173 @@
+from typing import AsyncIterator, Iterator
+
+import pytest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory
+
+from requests_tracker.body.body_collector import BodyCollector, CapturedBody
+
+
+def make_body_collector(
+    memory_limit: int = 1024, max_size: int = 10 * 1024
+) -> BodyCollector:
+    return BodyCollector(memory_limit=memory_limit, max_size=max_size)
+
+
+def test_captured_body__spools_to_disk() -> None:
+    body = CapturedBody("text/plain", memory_limit=10, max_size=100)
+
+    body.write(b"0123456789")
+    assert body.in_memory_size == 10
+    assert body._file._rolled is False  # type: ignore[attr-defined]
+
+    body.write(b"abcde")
+    assert body._file._rolled is True  # type: ignore[attr-defined]
+    assert body.in_memory_size == 0
+    assert b"".join(body.iter_chunks(chunk_size=4)) == b"0123456789abcde"
+
+
+def test_captured_body__truncated() -> None:
+    body = CapturedBody(None, memory_limit=10, max_size=12)
+
+    body.write(b"0123456789")
+    body.write(b"abcde")
+    body.write(b"fghij")
+
+    assert body.size == 20
+    assert body.captured_size == 12
+    assert body.truncated is True
+    assert b"".join(body.iter_chunks()) == b"0123456789ab"
+
+
+def test_captured_body__write_while_reading_back() -> None:
+    body = CapturedBody(None, memory_limit=10, max_size=100)
+    body.write(b"abc")
+    chunks = body.iter_chunks(chunk_size=2)
+
+    assert next(chunks) == b"ab"
+    body.write(b"def")
+
+    assert b"".join(chunks) == b"cdef"
+
+
+def test_process_request__captures_what_the_view_reads(
+    request_factory: RequestFactory,
+) -> None:
+    request = request_factory.post(
+        "/", data=b'{"key": "value"}', content_type="application/json"
+    )
+    body_collector = make_body_collector()
+
+    body_collector.process_request(request)
+    assert request_body_bytes(body_collector) == b""
+
+    assert request.body == b'{"key": "value"}'
+    body_collector.process_response(HttpResponse())
+
+    assert body_collector.request_body is not None
+    assert body_collector.request_body.content_type == "application/json"
+    assert body_collector.request_body.complete is True
+    assert request_body_bytes(body_collector) == b'{"key": "value"}'
+
+
+def test_process_request__body_already_read(request_factory: RequestFactory) -> None:
+    request = request_factory.post("/", data=b"abc", content_type="text/plain")
+    assert request.body == b"abc"
+    body_collector = make_body_collector()
+
+    body_collector.process_request(request)
+
+    assert request_body_bytes(body_collector) == b"abc"
+
+
+def test_process_request__form_data(request_factory: RequestFactory) -> None:
+    request = request_factory.post("/", data={"name": "value"})
+    body_collector = make_body_collector()
+    body_collector.process_request(request)
+
+    assert request.POST["name"] == "value"
+    assert b'name="name"' in request_body_bytes(body_collector)
+
+
+def test_process_response() -> None:
+    body_collector = make_body_collector()
+
+    body_collector.process_response(HttpResponse(b"<p>Hello</p>"))
+
+    assert body_collector.response_body is not None
+    assert body_collector.response_body.complete is True
+    assert body_collector.response_body.content_type == "text/html; charset=utf-8"
+    assert body_collector.response_body.preview == "<p>Hello</p>"
+    assert body_collector.footprint == 12
+
+
+def test_process_response__streaming() -> None:
+    consumed = []
+
+    def content() -> Iterator[bytes]:
+        for index in range(3):
+            consumed.append(index)
+            yield f"chunk {index}\n".encode()
+
+    response = StreamingHttpResponse(content())
+    body_collector = make_body_collector(memory_limit=8)
+
+    body_collector.process_response(response)
+
+    # Nothing is read from the response until it is sent
+    assert consumed == []
+    assert body_collector.response_body is not None
+    assert body_collector.response_body.complete is False
+
+    assert b"".join(response.streaming_content) == (  # type: ignore[arg-type]
+        b"chunk 0\nchunk 1\nchunk 2\n"
+    )
+    assert body_collector.response_body.complete is True
+    assert body_collector.response_body.size == 24
+    assert body_collector.response_body.in_memory_size == 0
+
+
+@pytest.mark.asyncio
+async def test_process_response__streaming_async() -> None:
+    async def content() -> AsyncIterator[bytes]:
+        for index in range(3):
+            yield f"chunk {index}\n".encode()
+
+    response = StreamingHttpResponse(content())
+    body_collector = make_body_collector()
+
+    body_collector.process_response(response)
+
+    chunks = [chunk async for chunk in response]
+    assert b"".join(chunks) == b"chunk 0\nchunk 1\nchunk 2\n"
+    assert body_collector.response_body is not None
+    assert body_collector.response_body.complete is True
+    assert body_collector.response_body.preview == "chunk 0\nchunk 1\nchunk 2\n"
+
+
+def test_compact(request_factory: RequestFactory) -> None:
+    body_collector = make_body_collector()
+    body_collector.process_request(request_factory.get("/"))
+    body_collector.process_response(HttpResponse(b"abc"))
+    response_body = body_collector.response_body
+    assert response_body is not None
+
+    body_collector.compact()
+
+    assert response_body._file.closed
+    assert body_collector.request_body is None
+    assert body_collector.response_body is None
+    assert body_collector.footprint == 0
+    assert body_collector.get_bodies() == []
+
+
+def test_matches_search_filter() -> None:
+    body_collector = make_body_collector()
+    body_collector.process_response(HttpResponse(b"abc"))
+
+    assert body_collector.matches_search_filter("abc") is False
+
+
+def request_body_bytes(body_collector: BodyCollector) -> bytes:
+    assert body_collector.request_body is not None
+    return b"".join(body_collector.request_body.iter_chunks())
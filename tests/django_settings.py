@@ -12,7 +12,10 @@ INSTALLED_APPS = [
 TEMPLATES = [{"BACKEND": "django.template.backends.django.DjangoTemplates"}]
 
 
-DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": "test_db"}}
+DATABASES = {
+    "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": "test_db"},
+    "replica": {"ENGINE": "django.db.backends.sqlite3", "NAME": "test_replica_db"},
+}
 
 ROOT_URLCONF = "tests.urls"
 
@@ -1,8 +1,15 @@
+from time import perf_counter
+
 import pytest
 from django.http import HttpRequest, HttpResponse
 from django.http.response import ResponseHeaders
 
-from requests_tracker.headers.header_collector import HeaderCollector
+from requests_tracker.footprint import approximate_size
+from requests_tracker.headers.header_collector import (
+    HeaderCollector,
+    is_http_header,
+    unmangle,
+)
 
 
 @pytest.fixture
@@ -58,3 +65,80 @@ def test_matches_search_filter(
     header_collector.process_request(request, HttpResponse())
 
     assert header_collector.matches_search_filter(input_search) is expected_result
+
+
+def make_runserver_request() -> HttpRequest:
+    """A request with the OS environment in META, like under runserver"""
+    request = HttpRequest()
+    request.META = {
+        **{f"ENVIRONMENT_VARIABLE_{index}": "x" * 50 for index in range(300)},
+        "HTTP_ACCEPT": "text/html",
+        "HTTP_USER_AGENT": "Mozilla/5.0",
+        "HTTP_COOKIE": "sessionid=abc",
+        "SERVER_NAME": "localhost",
+    }
+    return request
+
+
+def test_process_request__headers_are_materialised_on_access(
+    header_collector: HeaderCollector,
+) -> None:
+    header_collector.process_request(make_runserver_request(), HttpResponse())
+
+    assert header_collector._headers is None
+    assert header_collector.matches_search_filter("mozilla") is True
+    # Searching does not need the headers to be unmangled and sorted
+    assert header_collector._headers is None
+
+    assert list(header_collector.request_headers) == [
+        "Accept",
+        "Cookie",
+        "User-Agent",
+    ]
+    assert header_collector.environ == {"SERVER_NAME": "localhost"}
+    assert header_collector.response_headers == {
+        "Content-Type": "text/html; charset=utf-8"
+    }
+    assert header_collector._headers is not None
+    assert header_collector.request_headers is header_collector.request_headers
+
+
+def process_request_eagerly(request: HttpRequest, response: HttpResponse) -> int:
+    """How HeaderCollector.process_request used to build the headers right away"""
+    request_env = sorted(request.META.items())
+    request_headers = {
+        unmangle(key): value for (key, value) in request_env if is_http_header(key)
+    }
+    response_headers = dict(response.items())
+    environ = {
+        key: value
+        for (key, value) in request_env
+        if key in HeaderCollector.ENVIRON_FILTER
+    }
+    return (
+        approximate_size(request_headers)
+        + approximate_size(response_headers)
+        + approximate_size(environ)
+    )
+
+
+def test_process_request_benchmark() -> None:
+    """
+    Per request cost of capturing the headers of a request with a runserver sized
+    META, compared to building the headers right away.
+    """
+    iterations = 1_000
+    request = make_runserver_request()
+    response = HttpResponse()
+
+    start = perf_counter()
+    for _ in range(iterations):
+        process_request_eagerly(request, response)
+    eager_time = (perf_counter() - start) / iterations
+
+    start = perf_counter()
+    for _ in range(iterations):
+        HeaderCollector().process_request(request, response)
+    capture_time = (perf_counter() - start) / iterations
+
+    assert capture_time < eager_time
@@ -0,0 +1,84 @@
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Union
+
+from requests_tracker.sql.dataclasses import SQLQueryInfo
+from tests.constants import STANDARD_SQL_QUERY_INFO
+
+NUMBER_OF_QUERIES = 10_000
+
+
+@dataclass
+class DictBackedSQLQueryInfo:
+    """The previous SQLQueryInfo implementation, used as a memory baseline"""
+
+    vendor: str
+    alias: str
+    sql: str
+    duration: float
+    raw_sql: str
+    params: str
+    raw_params: Any
+    stacktrace: Any
+    start_time: float
+    stop_time: float
+    is_slow: bool
+    is_select: bool
+    trans_id: Optional[str] = None
+    iso_level: Optional[Union[int, str]] = None
+    trans_status: Optional[int] = None
+    similar_count: int = 0
+    duplicate_count: int = 0
+
+
+def measure_allocated_memory(query_info_class: Callable[..., Any]) -> int:
+    """Measures memory retained by NUMBER_OF_QUERIES similar, recorded queries"""
+    queries: List[Any] = []
+    tracemalloc.start()
+    for i in range(NUMBER_OF_QUERIES):
+        # Build the strings per query, just like the SQL tracker does
+        sql = "".join(("SELECT * FROM ", "test WHERE id = %s"))
+        queries.append(
+            query_info_class(
+                vendor="".join(("sql", "ite")),
+                alias="".join(("def", "ault")),
+                sql=sql,
+                duration=i / 1000,
+                raw_sql=f"SELECT * FROM test WHERE id = {i}",
+                params=f"[{i}]",
+                raw_params=(i,),
+                stacktrace=[],
+                start_time=i / 100,
+                stop_time=i / 100 + 0.001,
+                is_slow=False,
+                is_select=True,
+            )
+        )
+    allocated_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return allocated_memory
+
+
+def test_sql_query_info_attributes() -> None:
+    query = SQLQueryInfo(**STANDARD_SQL_QUERY_INFO)  # type: ignore
+
+    assert not hasattr(query, "__dict__")
+    assert query.sql == "SELECT * FROM test"
+    assert query.raw_sql is query.sql
+    assert query.duration == 100.0
+    assert query.similar_count == query.duplicate_count == 0
+    assert query.trans_id is None
+
+    query.similar_count = 2
+
+    assert query == SQLQueryInfo(
+        **{**STANDARD_SQL_QUERY_INFO, "similar_count": 2}  # type: ignore
+    )
+    assert "similar_count=2" in repr(query)
+
+
+def test_sql_query_info_memory_benchmark() -> None:
+    dict_backed_memory = measure_allocated_memory(DictBackedSQLQueryInfo)
+    slotted_memory = measure_allocated_memory(SQLQueryInfo)
+
+    assert slotted_memory < dict_backed_memory * 0.75
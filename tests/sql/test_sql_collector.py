@@ -1,14 +1,20 @@
-from typing import Generator, Tuple
+from typing import Any, Dict, Generator, Tuple
 
 import pytest
 from django.conf import LazySettings
 from django.contrib.auth.models import User
 from django.db import connections
 
-from requests_tracker.settings import get_config
-from requests_tracker.sql.sql_collector import SQLCollector
+from requests_tracker.footprint import approximate_size
+from requests_tracker.sql.dataclasses import SQLQueryInfo
+from requests_tracker.sql.sql_collector import (
+    SQLCollector,
+    get_params_key,
+    get_query_footprint,
+)
 from requests_tracker.sql.sql_hook import install_sql_hook
 from requests_tracker.sql.sql_tracker import SQLTracker
+from tests.constants import STANDARD_SQL_QUERY_INFO
 
 
 @pytest.fixture
@@ -23,9 +29,7 @@ def sql_collector() -> Generator[SQLCollector, None, None]:
 
     install_sql_hook()
     sql_collector = SQLCollector()
-    with SQLTracker(sql_collector) as sql_tracker:
-        sql_tracker.set_database_wrapper(connections["default"])
-
+    with SQLTracker(sql_collector):
         yield sql_collector
 
     # Reset to default before pytest-django teardown begins
@@ -84,6 +88,26 @@ def test_record__executemany(sql_collector: SQLCollector) -> None:
     assert query.duration > 0
 
 
+@pytest.mark.django_db(databases=["default", "replica"])
+def test_record__multiple_databases(sql_collector: SQLCollector) -> None:
+    """Tests that queries are attributed to the database they were executed on"""
+    User.objects.using("replica").filter(username="test").exists()
+    User.objects.filter(username="test").exists()
+    User.objects.using("replica").filter(username="test").exists()
+    sql_collector.generate_statistics()
+
+    assert [query.alias for query in sql_collector.queries] == [
+        "replica",
+        "default",
+        "replica",
+    ]
+    assert set(sql_collector.databases) == {"default", "replica"}
+    assert sql_collector.databases["default"].num_queries == 1
+    assert sql_collector.databases["replica"].num_queries == 2
+    assert sql_collector.databases["replica"].duplicate_count == 2
+    assert sql_collector.databases["default"].duplicate_count == 0
+
+
 @pytest.mark.django_db
 def test_generate_statistics__duplicate_queries(sql_collector: SQLCollector) -> None:
     """Tests that generate_statistics counts duplicate queries correctly"""
@@ -147,12 +171,132 @@ def test_filtered_queries(
     ignore_patterns: Tuple[str],
     expected_number_of_queries: int,
 ) -> None:
-    # Clear config cache to ensure settings are reloaded
-    get_config.cache_clear()
-    settings.REQUESTS_TRACKER_CONFIG[  # type: ignore
-        "IGNORE_SQL_PATTERNS"
-    ] = ignore_patterns
+    settings.REQUESTS_TRACKER_CONFIG = {
+        "TRACK_SQL": False,
+        "IGNORE_SQL_PATTERNS": ignore_patterns,
+    }
     User.objects.filter(username="test").exists()
     User.objects.filter(username="another_username").exists()
+    sql_collector.generate_statistics()
 
+    # Ignored queries are not recorded at all, so they are not in the statistics
     assert sql_collector.num_queries == expected_number_of_queries
+    assert len(sql_collector.queries) == expected_number_of_queries
+    assert (
+        sum(database.num_queries for database in sql_collector.databases.values())
+        == expected_number_of_queries
+    )
+
+
+def make_query(**kwargs: Any) -> SQLQueryInfo:
+    return SQLQueryInfo(**{**STANDARD_SQL_QUERY_INFO, **kwargs})
+
+
+def test_record__statistics_are_incremental() -> None:
+    sql_collector = SQLCollector()
+
+    sql_collector.record(make_query(raw_params=(1,), duration=1.0))
+    assert sql_collector.databases["default"].num_queries == 1
+    assert sql_collector.total_similar_queries == 0
+
+    sql_collector.record(make_query(raw_params=(2,), duration=2.0))
+    sql_collector.record(make_query(raw_params=(2,), duration=3.0))
+    sql_collector.record(make_query(alias="replica", raw_params=(2,), duration=4.0))
+
+    # The per database statistics are up to date without generate_statistics
+    assert sql_collector.sql_time == 10.0
+    assert sql_collector.databases["default"].num_queries == 3
+    assert sql_collector.databases["default"].time_spent == 6.0
+    assert sql_collector.databases["default"].similar_count == 3
+    assert sql_collector.databases["default"].duplicate_count == 2
+    assert sql_collector.databases["replica"].num_queries == 1
+    assert sql_collector.databases["replica"].similar_count == 0
+    assert sql_collector.total_similar_queries == 3
+    assert sql_collector.total_duplicate_queries == 2
+
+    sql_collector.generate_statistics()
+
+    assert [query.similar_count for query in sql_collector.queries] == [3, 3, 3, 0]
+    assert [query.duplicate_count for query in sql_collector.queries] == [0, 2, 2, 0]
+
+
+def test_generate_statistics__only_after_new_queries() -> None:
+    sql_collector = SQLCollector()
+    sql_collector.record(make_query())
+    sql_collector.record(make_query())
+    sql_collector.generate_statistics()
+    query_1, query_2 = sql_collector.queries
+
+    query_1.duplicate_count = 42
+    sql_collector.generate_statistics()
+
+    # Nothing was recorded since the last call, so the queries were not visited
+    assert query_1.duplicate_count == 42
+
+    sql_collector.record(make_query())
+    sql_collector.generate_statistics()
+
+    assert [query.duplicate_count for query in sql_collector.queries] == [3, 3, 3]
+
+
+@pytest.mark.parametrize(
+    "raw_params_1, raw_params_2, are_duplicates",
+    [
+        (None, (), True),
+        ((1, "a"), [1, "a"], True),
+        ((1, "a"), (1, "b"), False),
+        ({"a": 1}, {"a": 1}, True),
+        ({"a": 1}, {"a": 2}, False),
+        (([1, 2],), ([1, 2],), True),
+        (([1, 2],), ([1, 3],), False),
+        ([("a", 1), ("b", 2)], [("a", 1), ("b", 2)], True),
+    ],
+)
+def test_get_params_key(
+    raw_params_1: Any,
+    raw_params_2: Any,
+    are_duplicates: bool,
+) -> None:
+    params_key_1 = get_params_key(raw_params_1)
+    params_key_2 = get_params_key(raw_params_2)
+
+    hash(params_key_1)
+    assert (params_key_1 == params_key_2) is are_duplicates
+
+
+def test_matches_search_filter__raw_sql_is_not_kept() -> None:
+    sql_collector = SQLCollector()
+    query = make_query(
+        sql="SELECT %s",
+        raw_sql=None,
+        raw_sql_renderer=lambda: "SELECT 'needle'",
+    )
+    sql_collector.record(query)
+    footprint = sql_collector.footprint
+
+    assert sql_collector.matches_search_filter("NEEDLE") is True
+    assert sql_collector.matches_search_filter("haystack") is False
+    # Rendering the raw SQL for a search does not grow the footprint
+    assert query._raw_sql is None
+    assert sql_collector.footprint == footprint
+    assert query.raw_sql == "SELECT 'needle'"
+
+
+@pytest.mark.parametrize(
+    "query_info",
+    [
+        {},
+        {"sql": "SELECT %s", "raw_sql": "SELECT 'abc'", "raw_params": ("abc" * 100,)},
+        {"raw_sql": "x" * 2000, "raw_params": [("a", "b", 1)] * 50},
+    ],
+)
+def test_get_query_footprint(query_info: Dict[str, Any]) -> None:
+    query = make_query(**query_info)
+
+    # The estimate is in the same range as the recursive measurement
+    footprint = get_query_footprint(query)
+    assert approximate_size(query) / 2 < footprint < approximate_size(query) * 2
+
+    sql_collector = SQLCollector()
+    sql_collector.record(query)
+    assert sql_collector.footprint == footprint
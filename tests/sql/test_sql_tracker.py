@@ -1,7 +1,14 @@
-from unittest.mock import Mock, PropertyMock
+import gc
+import weakref
+from time import perf_counter, sleep
+from types import SimpleNamespace
+from typing import Optional, Tuple
+from unittest.mock import Mock, PropertyMock, patch
 from uuid import UUID
 
 import pytest
+from django.conf import LazySettings
+from django.core.exceptions import ImproperlyConfigured
 from psycopg2 import InternalError
 from psycopg2._json import Json as PostgresJson
 from psycopg2.extensions import (
@@ -11,8 +18,16 @@ from psycopg2.extensions import (
     TRANSACTION_STATUS_ACTIVE,
 )
 
+from requests_tracker.settings import compile_patterns
+from requests_tracker.sql.dataclasses import ConnectionInfo
 from requests_tracker.sql.sql_collector import SQLCollector
-from requests_tracker.sql.sql_tracker import GLOBAL_SQL_TRACKER, SQLTracker, _local
+from requests_tracker.sql.sql_tracker import (
+    GLOBAL_SQL_TRACKER,
+    SQLTracker,
+    _local,
+    get_connection_info,
+    resolve_connection_info,
+)
 
 
 def test_sql_trackers_nested() -> None:
@@ -46,16 +61,6 @@ def test_record__no_sql_collector() -> None:
         fake_method.assert_called_once_with(database_cursor_mock, sql, params)
 
 
-def test_record_no_database_wrapper() -> None:
-    sql_collector = SQLCollector()
-
-    with pytest.raises(RuntimeError) as runtime_error:
-        with SQLTracker(sql_collector) as sql_tracker:
-            sql_tracker.record(Mock(), Mock(), "SELECT 1", ("fake_param",))
-
-    assert str(runtime_error.value) == "SQLTracker not correctly initialized"
-
-
 def test_record__mock_sqlite_database_wrapper() -> None:
     sql_collector = SQLCollector()
     sql = "SELECT 1"
@@ -69,10 +74,9 @@ def test_record__mock_sqlite_database_wrapper() -> None:
     sqlite_wrapper_mock.vendor = vendor
 
     database_cursor_mock = Mock()
+    database_cursor_mock.db = sqlite_wrapper_mock
 
     with SQLTracker(sql_collector) as sql_tracker:
-        sql_tracker.set_database_wrapper(sqlite_wrapper_mock)
-
         sql_tracker.record(fake_method, database_cursor_mock, sql, params)
 
         assert sql_tracker._sql_collector == sql_collector
@@ -115,10 +119,9 @@ def test_record__mock_postgres_database_wrapper_connection_ready() -> None:
     connection.get_transaction_status.return_value = TRANSACTION_STATUS_ACTIVE
 
     database_cursor_mock = Mock()
+    database_cursor_mock.db = postgres_wrapper_mock
 
     with SQLTracker(sql_collector) as sql_tracker:
-        sql_tracker.set_database_wrapper(postgres_wrapper_mock)
-
         sql_tracker.record(
             fake_method,
             database_cursor_mock,
@@ -169,10 +172,9 @@ def test_record__mock_postgres_database_wrapper_connection_begin() -> None:
     connection.get_transaction_status.return_value = TRANSACTION_STATUS_ACTIVE
 
     database_cursor_mock = Mock()
+    database_cursor_mock.db = postgres_wrapper_mock
 
     with SQLTracker(sql_collector) as sql_tracker:
-        sql_tracker.set_database_wrapper(postgres_wrapper_mock)
-
         sql_tracker.record(fake_method, database_cursor_mock, sql, params)
 
         assert sql_tracker._sql_collector == sql_collector
@@ -218,10 +220,9 @@ def test_record_mock_postgres_database_wrapper_connection_ready_and_begin() -> N
     connection.get_transaction_status.return_value = TRANSACTION_STATUS_ACTIVE
 
     database_cursor_mock = Mock()
+    database_cursor_mock.db = postgres_wrapper_mock
 
     with SQLTracker(sql_collector) as sql_tracker:
-        sql_tracker.set_database_wrapper(postgres_wrapper_mock)
-
         sql_tracker.record(fake_method, database_cursor_mock, sql, params)
 
         assert sql_tracker._sql_collector == sql_collector
@@ -242,3 +243,354 @@ def test_record_mock_postgres_database_wrapper_connection_ready_and_begin() -> N
     assert sql_collector.queries[0].is_slow is False
     assert sql_collector.queries[0].duplicate_count == 0
     assert sql_collector.queries[0].similar_count == 0
+
+
+def test_record__mock_sqlite_raw_sql_rendered_on_access() -> None:
+    sql_collector = SQLCollector()
+    sql = "SELECT %s"
+    params = ("fake_param",)
+    sqlite_wrapper_mock = Mock()
+    sqlite_wrapper_mock.ops.last_executed_query.return_value = "SELECT 'fake_param'"
+    sqlite_wrapper_mock.alias = "default"
+    sqlite_wrapper_mock.vendor = "sqlite"
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        sql_tracker.record(Mock(), Mock(db=sqlite_wrapper_mock), sql, params)
+
+    sqlite_wrapper_mock.ops.last_executed_query.assert_not_called()
+
+    query = sql_collector.queries[0]
+    # Rendered with the operations of the current connection of the alias
+    with patch(
+        "requests_tracker.sql.sql_tracker.connections",
+        {"default": sqlite_wrapper_mock},
+    ):
+        assert query.raw_sql == query.raw_sql == "SELECT 'fake_param'"
+    assert query.params == '["fake_param"]'
+    sqlite_wrapper_mock.ops.last_executed_query.assert_called_once_with(
+        None, sql, ["'fake_param'"]
+    )
+
+
+def test_record__mock_sqlite_raw_sql_rendered_without_connection() -> None:
+    sql_collector = SQLCollector()
+    sqlite_wrapper_mock = Mock()
+    sqlite_wrapper_mock.ops.last_executed_query.side_effect = AttributeError
+    sqlite_wrapper_mock.alias = "default"
+    sqlite_wrapper_mock.vendor = "sqlite"
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        sql_tracker.record(
+            Mock(), Mock(db=sqlite_wrapper_mock), "SELECT %s, %s", ("it's", 1)
+        )
+
+    with patch(
+        "requests_tracker.sql.sql_tracker.connections",
+        {"default": sqlite_wrapper_mock},
+    ):
+        assert sql_collector.queries[0].raw_sql == "SELECT 'it''s', 1"
+
+
+def test_record__mock_sqlite_raw_sql_rendered_without_alias() -> None:
+    sql_collector = SQLCollector()
+    sqlite_wrapper_mock = Mock(alias="removed", vendor="sqlite")
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        sql_tracker.record(Mock(), Mock(db=sqlite_wrapper_mock), "SELECT %s", (1,))
+
+    assert sql_collector.queries[0].raw_sql == "SELECT 1"
+
+
+def test_record__renderers_do_not_keep_tracker_alive() -> None:
+    sql_collector = SQLCollector()
+    sqlite_wrapper_mock = Mock(alias="default", vendor="sqlite")
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        sql_tracker.record(Mock(), Mock(db=sqlite_wrapper_mock), "SELECT %s", (1,))
+    sql_tracker_ref = weakref.ref(sql_tracker)
+    database_wrapper_ref = weakref.ref(sqlite_wrapper_mock)
+    del sql_tracker, sqlite_wrapper_mock
+    gc.collect()
+
+    assert sql_tracker_ref() is None
+    assert database_wrapper_ref() is None
+    assert sql_collector.queries[0].params == "[1]"
+
+
+def test_record__mock_multiple_databases() -> None:
+    sql_collector = SQLCollector()
+    default_wrapper_mock = Mock(alias="default", vendor="sqlite")
+    replica_wrapper_mock = Mock(alias="replica", vendor="sqlite")
+    for wrapper_mock in (default_wrapper_mock, replica_wrapper_mock):
+        wrapper_mock.ops.last_executed_query.return_value = "SELECT 1"
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        sql_tracker.record(Mock(), Mock(db=replica_wrapper_mock), "SELECT 1", None)
+        sql_tracker.record(Mock(), Mock(db=default_wrapper_mock), "SELECT 2", None)
+        sql_tracker.record(Mock(), Mock(db=replica_wrapper_mock), "SELECT 3", None)
+
+    assert [query.alias for query in sql_collector.queries] == [
+        "replica",
+        "default",
+        "replica",
+    ]
+    # Raw SQL is rendered with the operations of the database the query ran on
+    with patch(
+        "requests_tracker.sql.sql_tracker.connections",
+        {"default": default_wrapper_mock, "replica": replica_wrapper_mock},
+    ):
+        assert sql_collector.queries[1].raw_sql == "SELECT 1"
+    default_wrapper_mock.ops.last_executed_query.assert_called_once()
+    replica_wrapper_mock.ops.last_executed_query.assert_not_called()
+
+
+def test_record__overhead_excludes_query_time() -> None:
+    sql_collector = SQLCollector()
+    query_duration_ns = 50_000_000
+    sqlite_wrapper_mock = Mock(alias="default", vendor="sqlite")
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        sql_tracker.record(
+            Mock(side_effect=lambda *args: sleep(query_duration_ns / 1e9)),
+            Mock(db=sqlite_wrapper_mock),
+            "SELECT 1",
+            None,
+        )
+
+    assert sql_collector.queries[0].duration >= query_duration_ns / 1e6
+    assert 0 < sql_collector.overhead_ns < query_duration_ns
+
+
+def test_record__ignored_query_is_not_recorded(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {
+        "IGNORE_SQL_PATTERNS": (r".*django_session", r"^SELECT 2"),
+    }
+    sql_collector = SQLCollector()
+    sqlite_wrapper_mock = Mock(alias="default", vendor="sqlite")
+    sqlite_wrapper_mock.ops.last_executed_query.side_effect = lambda _, sql, __: sql
+    fake_method = Mock()
+
+    with (
+        patch(
+            "requests_tracker.sql.sql_tracker.get_stack_trace", return_value=[]
+        ) as get_stack_trace_mock,
+        SQLTracker(sql_collector) as sql_tracker,
+    ):
+        for sql in ("SELECT * FROM django_session", "SELECT 1", "SELECT 2"):
+            sql_tracker.record(fake_method, Mock(db=sqlite_wrapper_mock), sql, None)
+
+    # The queries were executed, but only the one not ignored was recorded
+    assert fake_method.call_count == 3
+    assert [query.sql for query in sql_collector.queries] == ["SELECT 1"]
+    assert sql_collector.databases["default"].num_queries == 1
+    get_stack_trace_mock.assert_called_once()
+
+
+def record_sqlite_query(sql_tracker: SQLTracker) -> None:
+    sqlite_wrapper_mock = Mock(alias="default", vendor="sqlite")
+    sql_tracker.record(Mock(), Mock(db=sqlite_wrapper_mock), "SELECT 1", None)
+
+
+def test_record__degraded_capture_after_query_budget(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"STACKTRACE_QUERY_BUDGET": 3}
+    sql_collector = SQLCollector()
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        for _ in range(6):
+            record_sqlite_query(sql_tracker)
+        record_sqlite_query(sql_tracker)
+
+    queries = sql_collector.queries
+    assert sql_collector.degraded_capture is True
+    assert sql_collector.num_queries == 7
+    assert sql_tracker._num_stack_traces == 3
+    # Within the budget every query records its own stack trace
+    assert queries[0].stacktrace is not queries[1].stacktrace
+    # Afterwards each callsite records one stack trace, which its queries share
+    assert queries[3].stacktrace is queries[4].stacktrace is queries[5].stacktrace
+    assert queries[5].stacktrace == queries[0].stacktrace
+    assert queries[6].stacktrace is not queries[5].stacktrace
+    assert queries[6].stacktrace[-1][1] == queries[5].stacktrace[-1][1] + 1
+
+
+def test_record__degraded_capture_after_time_budget(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {
+        "STACKTRACE_QUERY_BUDGET": None,
+        "STACKTRACE_TIME_BUDGET": 0,
+    }
+    sql_collector = SQLCollector()
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        for _ in range(3):
+            record_sqlite_query(sql_tracker)
+
+    assert sql_collector.degraded_capture is True
+    assert sql_tracker._num_stack_traces == 1
+    assert sql_collector.queries[1].stacktrace is sql_collector.queries[2].stacktrace
+
+
+def test_record__no_stack_trace_budget(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"STACKTRACE_QUERY_BUDGET": None}
+    sql_collector = SQLCollector()
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        for _ in range(3):
+            record_sqlite_query(sql_tracker)
+
+    assert sql_collector.degraded_capture is False
+    assert sql_tracker._num_stack_traces == 3
+
+
+def test_record__stack_traces_off(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {
+        "STACKTRACE_MODE": "off",
+        "STACKTRACE_QUERY_BUDGET": 1,
+    }
+    sql_collector = SQLCollector()
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        for _ in range(3):
+            record_sqlite_query(sql_tracker)
+
+    # Queries without stack traces do not use up the budget
+    assert sql_collector.degraded_capture is False
+    assert sql_tracker._num_stack_traces == 0
+    assert all(not query.stacktrace for query in sql_collector.queries)
+
+
+def test_record__queries_of_locals_reprs_are_not_recorded(
+    settings: LazySettings,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"ENABLE_STACKTRACES_LOCALS": True}
+    sql_collector = SQLCollector()
+
+    class QueryingRepr:
+        # Like model instances using related objects in __str__
+        def __repr__(self) -> str:
+            record_sqlite_query(sql_tracker)
+            return "QueryingRepr()"
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        value = QueryingRepr()  # noqa: F841
+        record_sqlite_query(sql_tracker)
+        record_sqlite_query(sql_tracker)
+
+    assert sql_collector.num_queries == 2
+    assert sql_tracker._num_stack_traces == 2
+    frame_locals = sql_collector.queries[0].stacktrace[-1][4]
+    assert frame_locals is not None
+    assert frame_locals["value"] == "QueryingRepr()"
+
+
+@pytest.mark.parametrize(
+    "patterns, sql, is_match",
+    [
+        ((), "SELECT 1", None),
+        ((r"SELECT 1",), "SELECT 1", True),
+        ((r"SELECT 1",), "INSERT 1", False),
+        ((r".*session", r"^UPDATE"), "SELECT * FROM session", True),
+        ((r".*session", r"^UPDATE"), "UPDATE users", True),
+        ((r".*session", r"^UPDATE"), "SELECT * FROM users", False),
+        # Only the start of the sql is matched, just like re.match does
+        ((r"FROM",), "SELECT * FROM users", False),
+        # Inline flags and backreferences keep their meaning next to other patterns
+        ((r"(?i).*django_session", r"^UPDATE"), "SELECT * FROM DJANGO_SESSION", True),
+        ((r"(?i).*django_session", r"^UPDATE"), "update users", False),
+        ((r"^UPDATE", r"SELECT (\w+), \1"), "SELECT id, id FROM users", True),
+        ((r"^UPDATE", r"SELECT (\w+), \1"), "SELECT id, name FROM users", False),
+    ],
+)
+def test_compile_patterns(
+    patterns: Tuple[str, ...],
+    sql: str,
+    is_match: Optional[bool],
+) -> None:
+    pattern = compile_patterns(patterns)
+
+    if is_match is None:
+        assert pattern is None
+    else:
+        assert pattern is not None
+        assert pattern.match(sql) is is_match
+
+
+def test_compile_patterns__invalid() -> None:
+    with pytest.raises(ImproperlyConfigured, match=r"'\(unclosed'"):
+        compile_patterns((r"^UPDATE", r"(unclosed"))
+
+
+def fake_postgres_wrapper(version: str) -> SimpleNamespace:
+    return SimpleNamespace(
+        alias="replica",
+        vendor="postgresql",
+        Database=SimpleNamespace(__version__=f"{version} (dt dec pq3 ext lo64)"),
+    )
+
+
+@pytest.mark.parametrize(
+    "version, expected_uses_pgconn",
+    [("2.9.9", False), ("3.1.18", True), ("unknown", False)],
+)
+def test_resolve_connection_info(version: str, expected_uses_pgconn: bool) -> None:
+    database_wrapper = fake_postgres_wrapper(version)
+
+    assert resolve_connection_info(database_wrapper) == ConnectionInfo(  # type: ignore
+        alias="replica",
+        vendor="postgresql",
+        uses_pgconn=expected_uses_pgconn,
+    )
+
+
+def test_get_connection_info_is_cached_on_the_connection() -> None:
+    database_wrapper = fake_postgres_wrapper("2.9.9")
+
+    with patch(
+        "requests_tracker.sql.sql_tracker.resolve_connection_info",
+        wraps=resolve_connection_info,
+    ) as resolve_mock:
+        connection_info = get_connection_info(database_wrapper)  # type: ignore
+        for _ in range(10):
+            assert get_connection_info(database_wrapper) is connection_info  # type: ignore
+
+    resolve_mock.assert_called_once_with(database_wrapper)
+
+
+def test_record__mock_postgres_psycopg3_uses_pgconn() -> None:
+    sql_collector = SQLCollector()
+    connection = Mock()
+    connection.pgconn.status = STATUS_READY
+    connection.pgconn.isolation_level = ISOLATION_LEVEL_AUTOCOMMIT
+    connection.pgconn.get_transaction_status.return_value = TRANSACTION_STATUS_ACTIVE
+    postgres_wrapper_mock = Mock()
+    postgres_wrapper_mock.ops.last_executed_query.return_value = "SELECT 1"
+    postgres_wrapper_mock.alias = "default"
+    postgres_wrapper_mock.vendor = "postgresql"
+    postgres_wrapper_mock.connection = connection
+    postgres_wrapper_mock.Database.__version__ = "3.1.18"
+
+    with SQLTracker(sql_collector) as sql_tracker:
+        sql_tracker.record(Mock(), Mock(db=postgres_wrapper_mock), "SELECT 1", None)
+
+    assert sql_collector.queries[0].trans_status == TRANSACTION_STATUS_ACTIVE
+    assert sql_collector.queries[0].iso_level == ISOLATION_LEVEL_AUTOCOMMIT
+
+
+def test_connection_info_benchmark() -> None:
+    """
+    Per query cost of resolving the connection metadata, which SQLTracker.record
+    used to do for every query, compared to reading it from the connection cache.
+    """
+    iterations = 10_000
+    database_wrapper = fake_postgres_wrapper("2.9.9")
+
+    start = perf_counter()
+    for _ in range(iterations):
+        resolve_connection_info(database_wrapper)  # type: ignore
+    resolve_time = (perf_counter() - start) / iterations
+
+    start = perf_counter()
+    for _ in range(iterations):
+        get_connection_info(database_wrapper)  # type: ignore
+    cached_time = (perf_counter() - start) / iterations
+
+    assert cached_time < resolve_time
@@ -1,8 +1,9 @@
-from typing import List
+from typing import Optional, Tuple
 
 import pytest
 
 from requests_tracker.sql.dataclasses import SQLQueryInfo
+from requests_tracker.sql.sql_collector import SQLCollector
 from tests.constants import STANDARD_SQL_QUERY_INFO
 from tests.templatetags.conftest import TemplateRenderer
 
@@ -99,54 +100,84 @@ def test_contrast_color_from_number(
     assert template_renderer(template, strip=True) == expected_color
 
 
-SQL_QUERIES = [
-    SQLQueryInfo(**{**STANDARD_SQL_QUERY_INFO, "duration": 80}),  # type: ignore
-    SQLQueryInfo(**{**STANDARD_SQL_QUERY_INFO, "duration": 40}),  # type: ignore
-    SQLQueryInfo(**{**STANDARD_SQL_QUERY_INFO, "duration": 70}),  # type: ignore
-    SQLQueryInfo(**{**STANDARD_SQL_QUERY_INFO, "duration": 10}),  # type: ignore
-]
+def make_sql_collector(*query_times: Tuple[int, int]) -> SQLCollector:
+    """Creates a collector with queries at the given start and stop milliseconds"""
+    sql_collector = SQLCollector(start_time=0)
+    for start_time, stop_time in query_times:
+        sql_collector.record(
+            SQLQueryInfo(
+                **{  # type: ignore
+                    **STANDARD_SQL_QUERY_INFO,
+                    "duration": stop_time - start_time,
+                    "start_time": start_time * 1_000_000,
+                    "stop_time": stop_time * 1_000_000,
+                }
+            )
+        )
+    return sql_collector
+
+
+SQL_COLLECTOR = make_sql_collector((0, 80), (80, 120), (120, 190), (190, 200))
 
 
 @pytest.mark.parametrize(
-    "queries, current_index, expected_styles",
+    "sql_collector, request_duration, current_index, expected_styles",
     [
         (
-            SQL_QUERIES,
+            SQL_COLLECTOR,
+            200.0,
             0,
             "width: 40.000%; margin-left: 0.000%; background-color: #b2843e;",
         ),
         (
-            SQL_QUERIES,
+            SQL_COLLECTOR,
+            200.0,
             1,
             "width: 20.000%; margin-left: 40.000%; background-color: #3eb24a;",
         ),
         (
-            SQL_QUERIES,
+            SQL_COLLECTOR,
+            200.0,
             2,
             "width: 35.000%; margin-left: 60.000%; background-color: #3e6cb2;",
         ),
         (
-            SQL_QUERIES,
+            SQL_COLLECTOR,
+            400.0,
             3,
-            "width: 5.000%; margin-left: 95.000%; background-color: #b23ea6;",
+            "width: 2.500%; margin-left: 47.500%; background-color: #b23ea6;",
+        ),
+        # Gaps between queries are kept
+        (
+            make_sql_collector((100, 150), (300, 400)),
+            500.0,
+            1,
+            "width: 20.000%; margin-left: 60.000%; background-color: #3eb24a;",
+        ),
+        # Running requests have no duration yet
+        (
+            make_sql_collector((100, 150), (300, 400)),
+            None,
+            0,
+            "width: 12.500%; margin-left: 25.000%; background-color: #b2843e;",
         ),
     ],
 )
 def test_timeline_bar_styles(
-    queries: List[SQLQueryInfo],
+    sql_collector: SQLCollector,
+    request_duration: Optional[float],
     current_index: int,
     expected_styles: str,
     template_renderer: TemplateRenderer,
 ) -> None:
     template = """
     {% load style_tags %}
-    {% timeline_bar_styles queries total_time index %}
+    {% timeline_bar_styles sql_collector request_duration index %}
     """
-    total_time = sum(query.duration for query in queries)
 
     context = {
-        "queries": queries,
-        "total_time": total_time,
+        "sql_collector": sql_collector,
+        "request_duration": request_duration,
         "index": current_index,
     }
 
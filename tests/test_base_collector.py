@@ -10,6 +10,12 @@ class FakeCollector(Collector):
     def matches_search_filter(self, search: str) -> bool:
         return super().matches_search_filter(search)  # type: ignore
 
+    def compact(self) -> None:
+        return super().compact()  # type: ignore[safe-super]
+
+    def release(self) -> None:
+        return super().release()  # type: ignore[safe-super]
+
 
 def test_generate_statistics() -> None:
     collector = FakeCollector()
@@ -23,3 +29,17 @@ def test_matches_search_filter() -> None:
 
     with pytest.raises(NotImplementedError):
         collector.matches_search_filter("fake")
+
+
+def test_compact() -> None:
+    collector = FakeCollector()
+
+    with pytest.raises(NotImplementedError):
+        collector.compact()
+
+
+def test_release() -> None:
+    collector = FakeCollector()
+
+    with pytest.raises(NotImplementedError):
+        collector.release()
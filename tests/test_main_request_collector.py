@@ -1,13 +1,18 @@
 from datetime import datetime
+from typing import Any, Tuple
+from unittest import mock
 from uuid import UUID
 
 import pytest
+from django.conf import LazySettings
 from django.http import HttpRequest, HttpResponse
 from django.test import RequestFactory
 from freezegun import freeze_time
 
 from requests_tracker.main_request_collector import MainRequestCollector
-from requests_tracker.sql.dataclasses import SQLQueryInfo
+from requests_tracker.snapshots import RequestSnapshot, ResponseSnapshot
+from requests_tracker.sql.dataclasses import QuerySummary, SQLQueryInfo
+from tests.constants import STANDARD_SQL_QUERY_INFO
 
 
 @pytest.fixture()
@@ -28,7 +33,13 @@ def collector(fake_request: HttpRequest) -> MainRequestCollector:
 
 def test__init__(collector: MainRequestCollector, fake_request: HttpRequest) -> None:
     assert isinstance(collector.request_id, UUID)
-    assert collector.request == fake_request
+    assert collector.request == RequestSnapshot(
+        method="GET",
+        path="/__requests_tracker__/",
+        query_string="",
+        content_type="",
+        content_length=None,
+    )
     assert collector.django_view == "requests_tracker.views.index"
     assert collector.start_time == datetime(2022, 12, 14, 12, 0, 0)
     assert collector.end_time is None
@@ -42,7 +53,7 @@ def test__init__with_not_found_request(request_factory: RequestFactory) -> None:
     request = request_factory.get("/not-found.html")
     collector = MainRequestCollector(request)
 
-    assert collector.request == request
+    assert collector.request.path == "/not-found.html"
     assert collector.django_view == "NOT FOUND"
     assert collector.start_time == datetime(2022, 12, 14, 12, 0, 0)
     assert collector.end_time is None
@@ -59,11 +70,63 @@ def test_wrap_up_request(
     collector.wrap_up_request(fake_response)
 
     assert collector.end_time == datetime(2022, 12, 14, 12, 0, 1)
-    assert collector.response == fake_response
+    assert collector.response == ResponseSnapshot(
+        status_code=200,
+        reason_phrase="OK",
+        content_type="text/html; charset=utf-8",
+        content_length=0,
+        streaming=False,
+    )
     assert collector.duration == 1000
     assert collector.finished is True
 
 
+def test_duration__sub_millisecond(
+    collector: MainRequestCollector,
+    fake_response: HttpResponse,
+) -> None:
+    with mock.patch(
+        "requests_tracker.main_request_collector.perf_counter_ns",
+        return_value=collector.start_ns + 250_500,
+    ):
+        collector.wrap_up_request(fake_response)
+
+    assert collector.duration == 0.2505
+
+
+def test_sql_collector_timeline_starts_with_request(
+    collector: MainRequestCollector,
+) -> None:
+    query_start_time = collector.start_ns + 3_000_000
+    query = SQLQueryInfo(
+        **{  # type: ignore
+            **STANDARD_SQL_QUERY_INFO,
+            "start_time": query_start_time,
+            "stop_time": query_start_time + 1_000_000,
+        }
+    )
+    collector.sql_collector.record(query)
+
+    assert collector.sql_collector.get_query_offset(query) == 3.0
+    assert collector.sql_collector.timeline_duration == 4.0
+
+
+@freeze_time("2022-12-14 12:00:01")
+def test_overhead(
+    collector: MainRequestCollector,
+    fake_response: HttpResponse,
+) -> None:
+    assert collector.overhead == 0
+    assert collector.overhead_percentage is None
+
+    collector.overhead_ns = 1_000_000
+    collector.sql_collector.overhead_ns = 500_000
+    collector.wrap_up_request(fake_response)
+
+    assert collector.overhead == 1.5
+    assert collector.overhead_percentage == 0.15
+
+
 def test_get_collectors(collector: MainRequestCollector) -> None:
     result = collector.get_collectors()
 
@@ -72,10 +135,26 @@ def test_get_collectors(collector: MainRequestCollector) -> None:
     assert result["header_collector"] == collector.header_collector
 
 
+def test_get_collectors__statistics_once_finished(
+    collector: MainRequestCollector,
+    fake_response: HttpResponse,
+) -> None:
+    collector.sql_collector.record(SQLQueryInfo(**STANDARD_SQL_QUERY_INFO))  # type: ignore
+    collector.sql_collector.record(SQLQueryInfo(**STANDARD_SQL_QUERY_INFO))  # type: ignore
+
+    collector.get_collectors()
+    queries = collector.sql_collector.queries
+    assert [query.duplicate_count for query in queries] == [0, 0]
+
+    collector.wrap_up_request(fake_response)
+
+    collector.get_collectors()
+    assert [query.duplicate_count for query in queries] == [2, 2]
+
+
 @freeze_time("2022-12-14 12:00:01")
 def test_get_as_context(
     collector: MainRequestCollector,
-    fake_request: HttpRequest,
     fake_response: HttpResponse,
 ) -> None:
     collector.wrap_up_request(fake_response)
@@ -83,14 +162,21 @@ def test_get_as_context(
     result = collector.get_as_context()
 
     assert result == {
-        "request": fake_request,
+        "request": collector.request,
         "request_id": collector.request_id,
         "django_view": "requests_tracker.views.index",
         "start_time": datetime(2022, 12, 14, 12, 0, 0),
         "end_time": datetime(2022, 12, 14, 12, 0, 1),
         "duration": 1000,
-        "response": fake_response,
+        "time_to_first_byte": 1000,
+        "streaming_duration": None,
+        "response": collector.response,
+        "bytes_sent": 0,
         "finished": True,
+        "compacted": False,
+        "footprint": collector.footprint,
+        "overhead": 0.0,
+        "overhead_percentage": 0.0,
         **collector.get_collectors(),
     }
 
@@ -127,9 +213,9 @@ def test_matches_search_filter(
     sql_query: str,
     expected_result: bool,
 ) -> None:
-    collector.request.path = request_path
+    collector.request = collector.request._replace(path=request_path)
     collector.django_view = django_view
-    collector.sql_collector.unfiltered_queries = [
+    collector.sql_collector.queries = [
         SQLQueryInfo(
             vendor="",
             alias="",
@@ -149,3 +235,143 @@ def test_matches_search_filter(
     result = collector.matches_search_filter(search)
 
     assert result is expected_result
+
+
+def test_footprint(
+    collector: MainRequestCollector,
+    fake_response: HttpResponse,
+) -> None:
+    initial_footprint = collector.footprint
+    # The live request is not counted, it is owned by Django
+    assert initial_footprint == 0
+    collector.sql_collector.record(SQLQueryInfo(**STANDARD_SQL_QUERY_INFO))  # type: ignore
+
+    assert collector.sql_collector.footprint > 0
+    assert collector.footprint == (
+        initial_footprint + collector.sql_collector.footprint
+    )
+
+    fake_response.content = b"x" * 10_000
+    collector.wrap_up_request(fake_response)
+
+    assert collector.header_collector.footprint > 0
+    assert collector.response is not None
+    assert collector.response.content_length == 10_000
+    # Only the snapshots are retained, not the request environment or the body
+    assert collector.request_response_footprint < 10_000
+
+
+def test_wrap_up_request_releases_live_request(
+    collector: MainRequestCollector,
+    fake_response: HttpResponse,
+) -> None:
+    collector.wrap_up_request(fake_response)
+
+    assert collector._live_request is None
+    assert collector.header_collector.environ["PATH_INFO"] == "/__requests_tracker__/"
+
+
+def record_queries(collector: MainRequestCollector, *sqls: str, **kwargs: Any) -> None:
+    for sql in sqls:
+        collector.sql_collector.record(
+            SQLQueryInfo(**{**STANDARD_SQL_QUERY_INFO, "sql": sql, **kwargs})
+        )
+
+
+@pytest.fixture
+def tail_based_retention(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {
+        "TAIL_BASED_RETENTION": True,
+        "SLOW_REQUEST_THRESHOLD": 500,
+    }
+
+
+def test_wrap_up_request__keeps_details_by_default(
+    collector: MainRequestCollector,
+    fake_response: HttpResponse,
+) -> None:
+    record_queries(collector, "SELECT 1", "SELECT 2")
+
+    with freeze_time("2022-12-14 12:00:00.100"):
+        collector.wrap_up_request(fake_response)
+
+    assert collector.compacted is False
+    assert len(collector.sql_collector.queries) == 2
+
+
+@pytest.mark.usefixtures("tail_based_retention")
+def test_wrap_up_request__compacts_boring_request(
+    collector: MainRequestCollector,
+    fake_response: HttpResponse,
+) -> None:
+    record_queries(collector, "SELECT 1", "SELECT 2")
+    record_queries(collector, "SELECT 3", alias="replica")
+    sql_footprint = collector.sql_collector.footprint
+
+    with freeze_time("2022-12-14 12:00:00.100"):
+        collector.wrap_up_request(fake_response)
+
+    sql_collector = collector.sql_collector
+    assert collector.compacted is True
+    assert sql_collector.is_compact is True
+    assert sql_collector.queries == []
+    assert sql_collector.query_summaries == [
+        QuerySummary(alias="default", sql="SELECT 1", num_queries=1, duration=100.0),
+        QuerySummary(alias="default", sql="SELECT 2", num_queries=1, duration=100.0),
+        QuerySummary(alias="replica", sql="SELECT 3", num_queries=1, duration=100.0),
+    ]
+    assert sql_collector.num_queries == 3
+    assert sql_collector.databases["default"].num_queries == 2
+    assert sql_collector.sql_time == 300.0
+    assert sql_collector.footprint < sql_footprint
+    assert collector.matches_search_filter("select 3") is True
+    assert collector.header_collector.request_headers
+
+
+@pytest.mark.parametrize(
+    "status_code, end_time, sqls, is_slow",
+    [
+        (500, "2022-12-14 12:00:00.100", ("SELECT 1",), False),
+        (302, "2022-12-14 12:00:00.100", ("SELECT 1",), False),
+        (200, "2022-12-14 12:00:00.600", ("SELECT 1",), False),
+        (200, "2022-12-14 12:00:00.100", ("SELECT 1", "SELECT 1"), False),
+        (200, "2022-12-14 12:00:00.100", ("SELECT 1",), True),
+    ],
+)
+@pytest.mark.usefixtures("tail_based_retention")
+def test_wrap_up_request__keeps_interesting_request(
+    collector: MainRequestCollector,
+    status_code: int,
+    end_time: str,
+    sqls: Tuple[str, ...],
+    is_slow: bool,
+) -> None:
+    record_queries(collector, *sqls, is_slow=is_slow)
+
+    with freeze_time(end_time):
+        collector.wrap_up_request(HttpResponse(status=status_code))
+
+    assert collector.compacted is False
+    assert len(collector.sql_collector.queries) == len(sqls)
+
+
+def test_body_collector__disabled_by_default(collector: MainRequestCollector) -> None:
+    assert collector.body_collector is None
+
+
+def test_body_collector(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"CAPTURE_BODIES": True}
+    request = request_factory.post("/", data=b"ping", content_type="text/plain")
+    collector = MainRequestCollector(request)
+
+    assert request.body == b"ping"
+    collector.wrap_up_request(HttpResponse(b"pong"))
+
+    assert collector.body_collector is not None
+    assert collector.get_collectors()["body_collector"] == collector.body_collector
+    assert [
+        (name, body.preview) for name, body in collector.body_collector.get_bodies()
+    ] == [("request", "ping"), ("response", "pong")]
@@ -13,7 +13,6 @@ from requests_tracker.middleware import (
     is_requests_tracker_request,
     requests_tracker_middleware,
 )
-from requests_tracker.settings import get_config
 
 
 @pytest.fixture(autouse=True)
@@ -53,6 +52,7 @@ def test_middleware_sync_settings_debug(request_factory: RequestFactory) -> None
     request_collector: MainRequestCollector = list(request_collectors.values())[0]
     assert request_collector.finished is True
     assert request_collector.django_view == "tests.fake_views.fake_view"
+    assert request_collector.overhead_ns > 0
 
 
 @pytest.mark.asyncio
@@ -70,6 +70,7 @@ async def test_middleware_async_settings_debug(request_factory: RequestFactory)
     request_collector: MainRequestCollector = list(request_collectors.values())[0]
     assert request_collector.finished is True
     assert request_collector.django_view == "tests.fake_views.fake_view"
+    assert request_collector.overhead_ns > 0
 
 
 def test_middleware_sync_settings_not_debug(
@@ -140,6 +141,11 @@ async def test_middleware_requests_tracker_clear_async(
         ((r".*some", ".*world"), True),
         ((r".*hello", ".*random"), True),
         ((r".*some", ".*random"), True),
+        # Inline flags and backreferences work next to other patterns
+        ((r"(?i)/SOME-", ".*world"), True),
+        ((r"(?i)/other-", ".*world"), False),
+        ((r"hello.*", r"/s(o)me-rand\1m"), True),
+        ((r"hello.*", r"/s(o)me-\1"), False),
     ],
 )
 def test_is_ignored_request(
@@ -148,10 +154,6 @@ def test_is_ignored_request(
     ignore_patterns: Tuple[str],
     expected_result: bool,
 ) -> None:
-    # Clear config cache to ensure settings are reloaded
-    get_config.cache_clear()
-    settings.REQUESTS_TRACKER_CONFIG[  # type: ignore
-        "IGNORE_PATHS_PATTERNS"
-    ] = ignore_patterns
+    settings.REQUESTS_TRACKER_CONFIG = {"IGNORE_PATHS_PATTERNS": ignore_patterns}
     request = request_factory.get("/some-random-path")
     assert is_ignored_request(request) is expected_result
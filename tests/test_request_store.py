@@ -0,0 +1,363 @@
+from time import perf_counter
+from typing import List
+from unittest import mock
+from uuid import UUID
+
+import pytest
+from django.conf import LazySettings
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from requests_tracker.main_request_collector import MainRequestCollector
+from requests_tracker.request_store import RequestStore
+
+
+@pytest.fixture
+def new_collector(request_factory: RequestFactory) -> MainRequestCollector:
+    return MainRequestCollector(request_factory.get("/"))
+
+
+def finished_collector(request_factory: RequestFactory) -> MainRequestCollector:
+    collector = MainRequestCollector(request_factory.get("/"))
+    collector.wrap_up_request(HttpResponse())
+    return collector
+
+
+def test_add_and_finish(
+    request_factory: RequestFactory,
+    new_collector: MainRequestCollector,
+) -> None:
+    store = RequestStore()
+
+    store.add(new_collector)
+    assert store[new_collector.request_id] is new_collector
+    assert len(store) == 1
+
+    new_collector.wrap_up_request(HttpResponse())
+    store.finish(new_collector)
+    assert store[new_collector.request_id] is new_collector
+    assert list(store) == [new_collector.request_id]
+
+
+def test_max_requests_evicts_oldest_finished(request_factory: RequestFactory) -> None:
+    store = RequestStore(max_requests=2)
+    collectors = [MainRequestCollector(request_factory.get("/")) for _ in range(3)]
+
+    for collector in collectors:
+        store.add(collector)
+        collector.wrap_up_request(HttpResponse())
+        store.finish(collector)
+
+    assert list(store) == [collectors[1].request_id, collectors[2].request_id]
+
+
+def test_max_requests_never_evicts_in_flight(request_factory: RequestFactory) -> None:
+    store = RequestStore(max_requests=1)
+    in_flight = [MainRequestCollector(request_factory.get("/")) for _ in range(3)]
+
+    for collector in in_flight:
+        store.add(collector)
+
+    assert len(store) == 3
+
+    in_flight[0].wrap_up_request(HttpResponse())
+    store.finish(in_flight[0])
+
+    assert list(store) == [in_flight[1].request_id, in_flight[2].request_id]
+
+
+def test_touch_makes_request_most_recently_used(
+    request_factory: RequestFactory,
+) -> None:
+    store = RequestStore(max_requests=2)
+    collector_1 = finished_collector(request_factory)
+    collector_2 = finished_collector(request_factory)
+    store[collector_1.request_id] = collector_1
+    store[collector_2.request_id] = collector_2
+
+    store.touch(collector_1.request_id)
+    collector_3 = finished_collector(request_factory)
+    store[collector_3.request_id] = collector_3
+
+    assert set(store) == {collector_1.request_id, collector_3.request_id}
+
+
+def test_max_age(request_factory: RequestFactory) -> None:
+    store = RequestStore(max_age=10)
+    old_collector = finished_collector(request_factory)
+    new_collector = finished_collector(request_factory)
+
+    with mock.patch("requests_tracker.request_store.monotonic", return_value=100):
+        store[old_collector.request_id] = old_collector
+    with mock.patch("requests_tracker.request_store.monotonic", return_value=105):
+        store[new_collector.request_id] = new_collector
+    with mock.patch("requests_tracker.request_store.monotonic", return_value=111):
+        store.evict()
+
+    assert list(store) == [new_collector.request_id]
+
+
+def test_max_age__without_new_requests(request_factory: RequestFactory) -> None:
+    store = RequestStore(max_age=10)
+    old_collector = finished_collector(request_factory)
+    new_collector = finished_collector(request_factory)
+
+    with mock.patch("requests_tracker.request_store.monotonic", return_value=100):
+        store[old_collector.request_id] = old_collector
+    with mock.patch("requests_tracker.request_store.monotonic", return_value=105):
+        store[new_collector.request_id] = new_collector
+
+    # Expired requests are evicted when the requests are measured or listed, even
+    # though no request was tracked since
+    with mock.patch("requests_tracker.request_store.monotonic", return_value=111):
+        store.footprint  # noqa: B018
+    assert list(store) == [new_collector.request_id]
+
+    with mock.patch("requests_tracker.request_store.monotonic", return_value=116):
+        assert list(store.iter_sorted("time", descending=True)) == []
+    assert list(store) == []
+
+
+def test_finish_after_clear(new_collector: MainRequestCollector) -> None:
+    store = RequestStore()
+    store.add(new_collector)
+    store.clear()
+
+    new_collector.wrap_up_request(HttpResponse())
+    store.finish(new_collector)
+
+    assert store == {}
+
+
+def test_delete(
+    request_factory: RequestFactory,
+    new_collector: MainRequestCollector,
+) -> None:
+    collector = finished_collector(request_factory)
+    store = RequestStore()
+    store.add(new_collector)
+    store[collector.request_id] = collector
+
+    del store[new_collector.request_id]
+    del store[collector.request_id]
+
+    assert len(store) == 0
+    assert new_collector.request_id not in store
+
+
+def spooled_collector(request_factory: RequestFactory) -> MainRequestCollector:
+    """A finished request with a response body spooled to a temporary file"""
+    collector = MainRequestCollector(request_factory.get("/"))
+    collector.wrap_up_request(HttpResponse(b"x" * 2048))
+    assert collector.body_collector is not None
+    assert collector.body_collector.response_body is not None
+    assert collector.body_collector.response_body._file._rolled  # type: ignore
+    return collector
+
+
+@pytest.mark.parametrize("remove", ["evict", "delete", "clear", "replace"])
+def test_removed_requests_are_released(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+    remove: str,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {
+        "CAPTURE_BODIES": True,
+        "BODY_MEMORY_LIMIT_KB": 1,
+    }
+    store = RequestStore(max_requests=1)
+    collector = spooled_collector(request_factory)
+    response_body = collector.body_collector.response_body  # type: ignore[union-attr]
+    store[collector.request_id] = collector
+
+    if remove == "evict":
+        new_collector = spooled_collector(request_factory)
+        store[new_collector.request_id] = new_collector
+    elif remove == "delete":
+        del store[collector.request_id]
+    elif remove == "clear":
+        store.clear()
+    else:
+        store[collector.request_id] = spooled_collector(request_factory)
+
+    assert response_body._file.closed  # type: ignore[union-attr]
+    assert collector.body_collector.response_body is None  # type: ignore[union-attr]
+    store.clear()
+
+
+def test_setting_same_request_is_not_released(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {
+        "CAPTURE_BODIES": True,
+        "BODY_MEMORY_LIMIT_KB": 1,
+    }
+    store = RequestStore()
+    collector = spooled_collector(request_factory)
+    store[collector.request_id] = collector
+
+    store[collector.request_id] = collector
+
+    assert collector.body_collector.response_body is not None  # type: ignore[union-attr]
+    store.clear()
+
+
+@mock.patch("requests_tracker.request_store.get_frame_tables_footprint", return_value=0)
+def test_max_memory_evicts_oldest_finished(
+    _: mock.Mock, request_factory: RequestFactory
+) -> None:
+    collectors = [finished_collector(request_factory) for _ in range(3)]
+    footprint = max(collector.footprint for collector in collectors)
+    store = RequestStore(max_memory=footprint * 2)
+
+    for collector in collectors:
+        store[collector.request_id] = collector
+
+    assert list(store) == [collectors[1].request_id, collectors[2].request_id]
+    assert store.footprint == collectors[1].footprint + collectors[2].footprint
+
+    store.clear()
+
+    assert store.footprint == 0
+
+
+def test_max_memory_includes_frame_tables(request_factory: RequestFactory) -> None:
+    collectors = [finished_collector(request_factory) for _ in range(3)]
+    footprint = max(collector.footprint for collector in collectors)
+    store = RequestStore(max_memory=footprint * 3)
+
+    with mock.patch(
+        "requests_tracker.request_store.get_frame_tables_footprint",
+        return_value=footprint,
+    ):
+        for collector in collectors:
+            store[collector.request_id] = collector
+
+        assert list(store) == [collectors[1].request_id, collectors[2].request_id]
+        assert store.footprint == (
+            collectors[1].footprint + collectors[2].footprint + footprint
+        )
+
+
+def test_overhead(request_factory: RequestFactory) -> None:
+    store = RequestStore(max_requests=2)
+    assert store.overhead == 0
+    assert store.overhead_percentage is None
+
+    collectors = [MainRequestCollector(request_factory.get("/")) for _ in range(3)]
+    for collector in collectors[:2]:
+        collector.overhead_ns = 2_000_000
+        store.add(collector)
+    collectors[0].wrap_up_request(HttpResponse())
+    collectors[0].end_ns = collectors[0].start_ns + 10_000_000
+    store.finish(collectors[0])
+
+    assert store.overhead == 4.0
+    # Only finished requests have a duration to compare with
+    assert store.overhead_percentage == 20.0
+
+    # The totals follow the requests that are evicted or deleted
+    collectors[2].wrap_up_request(HttpResponse())
+    collectors[2].overhead_ns = 1_000_000
+    collectors[2].end_ns = collectors[2].start_ns + 20_000_000
+    store[collectors[2].request_id] = collectors[2]
+
+    assert collectors[0].request_id not in store
+    assert store.overhead == 3.0
+    assert store.overhead_percentage == 5.0
+
+    del store[collectors[2].request_id]
+
+    assert store.overhead == 2.0
+    assert store.overhead_percentage is None
+
+
+def sorted_ids(store: RequestStore, requests_sorter: str) -> List[UUID]:
+    return [request_id for request_id, _, _ in store.iter_sorted(requests_sorter, True)]
+
+
+def test_iter_sorted__reindexes_finished_requests(
+    request_factory: RequestFactory,
+) -> None:
+    store = RequestStore()
+    slow_collector = MainRequestCollector(request_factory.get("/slow"))
+    fast_collector = MainRequestCollector(request_factory.get("/fast"))
+    store.add(slow_collector)
+    store.add(fast_collector)
+
+    fast_collector.wrap_up_request(HttpResponse())
+    store.finish(fast_collector)
+    # Requests in progress sort as the shortest ones
+    assert sorted_ids(store, "duration") == [
+        fast_collector.request_id,
+        slow_collector.request_id,
+    ]
+
+    slow_collector.wrap_up_request(HttpResponse())
+    slow_collector.end_ns = slow_collector.start_ns + 10**9
+    store.finish(slow_collector)
+
+    assert sorted_ids(store, "duration") == [
+        slow_collector.request_id,
+        fast_collector.request_id,
+    ]
+    assert sorted_ids(store, "time") == [
+        fast_collector.request_id,
+        slow_collector.request_id,
+    ]
+
+
+def test_iter_sorted__removed_requests(request_factory: RequestFactory) -> None:
+    store = RequestStore(max_requests=100)
+    collectors = [finished_collector(request_factory) for _ in range(200)]
+    for collector in collectors:
+        store.add(collector)
+        store.finish(collector)
+    del store[collectors[-1].request_id]
+
+    sorted_requests = store.iter_sorted("time", descending=True)
+    first_request_id, _, _ = next(sorted_requests)
+    # Requests removed while the requests are listed are skipped
+    del store[collectors[-50].request_id]
+    remaining_request_ids = [request_id for request_id, _, _ in sorted_requests]
+
+    assert first_request_id == collectors[-2].request_id
+    assert remaining_request_ids == [
+        collector.request_id
+        for collector in reversed(collectors[100:-2])
+        if collector is not collectors[-50]
+    ]
+
+    store.clear()
+    assert sorted_ids(store, "time") == []
+
+
+def test_iter_sorted__benchmark(request_factory: RequestFactory) -> None:
+    """Listing the first page does not depend on the number of stored requests"""
+    store = RequestStore()
+    for _ in range(5000):
+        collector = finished_collector(request_factory)
+        store.add(collector)
+        store.finish(collector)
+
+    def first_page_from_index() -> None:
+        sorted_requests = store.iter_sorted("query_count", descending=True)
+        for _ in range(50):
+            next(sorted_requests)
+
+    def first_page_by_sorting() -> None:
+        sorted(
+            store.items(),
+            key=lambda item: item[1].sql_collector.num_queries,
+            reverse=True,
+        )[:50]
+
+    timings = {}
+    for first_page in (first_page_from_index, first_page_by_sorting):
+        start = perf_counter()
+        for _ in range(20):
+            first_page()
+        timings[first_page.__name__] = perf_counter() - start
+
+    assert timings["first_page_from_index"] < timings["first_page_by_sorting"]
@@ -0,0 +1,81 @@
+from typing import Generator
+from unittest import mock
+
+import pytest
+from django.conf import LazySettings
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from requests_tracker.middleware import requests_tracker_middleware
+from requests_tracker.resolver import (
+    NOT_FOUND,
+    ResolvedPath,
+    resolve_path,
+    resolve_request,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_resolve_cache() -> Generator[None, None, None]:
+    resolve_path.cache_clear()
+    yield
+    resolve_path.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "request_path, expected_resolved_path",
+    [
+        (
+            "/__requests_tracker__/",
+            ResolvedPath("requests_tracker.views.index", is_requests_tracker=True),
+        ),
+        ("/", ResolvedPath("tests.fake_views.fake_view", is_requests_tracker=False)),
+        ("/some-random-path", ResolvedPath(NOT_FOUND, is_requests_tracker=False)),
+    ],
+)
+def test_resolve_request(
+    request_factory: RequestFactory,
+    request_path: str,
+    expected_resolved_path: ResolvedPath,
+) -> None:
+    request = request_factory.get(request_path)
+
+    assert resolve_request(request) == expected_resolved_path
+
+
+def test_resolve_request__cached_per_path(request_factory: RequestFactory) -> None:
+    with mock.patch("requests_tracker.resolver.resolve", wraps=resolve) as resolve_mock:
+        for _ in range(3):
+            resolve_request(request_factory.get("/"))
+        resolve_request(request_factory.get("/__requests_tracker__/"))
+
+    assert resolve_mock.call_count == 2
+
+
+def test_resolve_request__cache_cleared_when_urlconf_changes(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    resolve_request(request_factory.get("/"))
+    assert resolve_path.cache_info().currsize == 1
+
+    settings.ROOT_URLCONF = "requests_tracker.urls"
+
+    assert resolve_path.cache_info().currsize == 0
+    assert resolve_request(request_factory.get("/")).django_view == (
+        "requests_tracker.views.index"
+    )
+
+
+def test_middleware_resolves_path_once(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    settings.DEBUG = True
+    middleware = requests_tracker_middleware(lambda _: HttpResponse())
+
+    with mock.patch("requests_tracker.resolver.resolve", wraps=resolve) as resolve_mock:
+        middleware(request_factory.get("/"))
+
+    resolve_mock.assert_called_once()
@@ -0,0 +1,98 @@
+from typing import List
+from unittest import mock
+
+from django.conf import LazySettings
+from django.test import RequestFactory
+
+from requests_tracker.middleware import requests_tracker_middleware
+from requests_tracker.sampling import RequestSampler, get_meta_key
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_get_meta_key() -> None:
+    assert get_meta_key("X-Track-Request") == "HTTP_X_TRACK_REQUEST"
+
+
+def test_should_track__samples_everything_by_default(
+    request_factory: RequestFactory,
+) -> None:
+    request_sampler = RequestSampler()
+
+    assert request_sampler.samples_everything is True
+    assert all(
+        request_sampler.should_track(request_factory.get("/")) for _ in range(100)
+    )
+
+
+def test_should_track__sample_rate(request_factory: RequestFactory) -> None:
+    random_values: List[float] = [0.1, 0.3, 0.25, 0.9]
+    request_sampler = RequestSampler(
+        sample_rate=0.25,
+        get_random=lambda: random_values.pop(0),
+    )
+
+    assert [
+        request_sampler.should_track(request_factory.get("/")) for _ in range(4)
+    ] == [True, False, False, False]
+
+
+def test_should_track__max_per_view_per_second(
+    request_factory: RequestFactory,
+) -> None:
+    clock = FakeClock()
+    request_sampler = RequestSampler(max_per_view_per_second=2, get_time=clock)
+
+    assert [
+        request_sampler.should_track(request_factory.get("/")) for _ in range(3)
+    ] == [True, True, False]
+    # Other views have their own limit
+    assert request_sampler.should_track(request_factory.get("/not-found")) is True
+
+    clock.now += 1
+
+    assert request_sampler.should_track(request_factory.get("/")) is True
+
+
+def test_should_track__force_header(request_factory: RequestFactory) -> None:
+    request_sampler = RequestSampler(
+        sample_rate=0,
+        max_per_view_per_second=0,
+        force_header="X-Track-Request",
+    )
+
+    assert request_sampler.should_track(request_factory.get("/")) is False
+    assert (
+        request_sampler.should_track(
+            request_factory.get("/", HTTP_X_TRACK_REQUEST="1"),
+        )
+        is True
+    )
+
+
+def test_middleware__not_sampled_requests_are_not_tracked(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    settings.DEBUG = True
+    settings.REQUESTS_TRACKER_CONFIG = {
+        "SAMPLE_RATE": 0,
+        "FORCE_TRACKING_HEADER": "X-Track-Request",
+    }
+    get_response = mock.MagicMock()
+    middleware = requests_tracker_middleware(get_response)
+
+    middleware(request_factory.get("/"))
+    middleware(request_factory.get("/", HTTP_X_TRACK_REQUEST="1"))
+    requests_tracker_request = request_factory.get("/__requests_tracker__/")
+    middleware(requests_tracker_request)
+
+    request_collectors = requests_tracker_request.request_collectors  # type: ignore
+    assert get_response.call_count == 3
+    assert len(request_collectors) == 1
@@ -0,0 +1,122 @@
+import pytest
+from django.conf import LazySettings
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, override_settings
+
+from requests_tracker.settings import (
+    CONFIG_DEFAULTS,
+    STACKTRACE_MODE_FULL,
+    STACKTRACE_MODE_LAZY,
+    STACKTRACE_MODE_OFF,
+    RequestsTrackerSettings,
+    debug_application,
+    get_config,
+    get_settings,
+)
+
+
+def test_from_config__defaults() -> None:
+    config = RequestsTrackerSettings.from_config(CONFIG_DEFAULTS)
+
+    assert config.enable_stacktraces is True
+    assert config.stacktrace_mode == STACKTRACE_MODE_FULL
+    assert config.sql_warning_threshold == 500.0
+    assert "django.db." in config.hidden_module_prefixes
+    assert config.ignore_sql_pattern is None
+    assert config.ignore_paths_pattern is None
+    assert config.max_requests == 1000
+    assert config.max_memory is None
+
+
+def test_from_config__derived_values() -> None:
+    config = RequestsTrackerSettings.from_config(
+        {
+            **CONFIG_DEFAULTS,
+            "HIDE_IN_STACKTRACES": ["django.db"],
+            "SQL_WARNING_THRESHOLD": 20,
+            "IGNORE_SQL_PATTERNS": [r".*django_session", r"^UPDATE"],
+            "MAX_MEMORY_MB": 1.5,
+        }
+    )
+
+    assert config.hidden_module_prefixes == ("django.db.",)
+    assert isinstance(config.sql_warning_threshold, float)
+    assert config.ignore_sql_pattern is not None
+    assert config.ignore_sql_pattern.match("UPDATE auth_user SET id = 1")
+    assert not config.ignore_sql_pattern.match("SELECT * FROM auth_user")
+    assert config.max_memory == 1572864
+
+
+@pytest.mark.parametrize(
+    "enable_stacktraces, stacktrace_mode, expected_stacktrace_mode",
+    [
+        (True, STACKTRACE_MODE_FULL, STACKTRACE_MODE_FULL),
+        (True, STACKTRACE_MODE_LAZY, STACKTRACE_MODE_LAZY),
+        (True, STACKTRACE_MODE_OFF, STACKTRACE_MODE_OFF),
+        (False, STACKTRACE_MODE_LAZY, STACKTRACE_MODE_OFF),
+    ],
+)
+def test_from_config__stacktrace_mode(
+    enable_stacktraces: bool,
+    stacktrace_mode: str,
+    expected_stacktrace_mode: str,
+) -> None:
+    config = RequestsTrackerSettings.from_config(
+        {
+            **CONFIG_DEFAULTS,
+            "ENABLE_STACKTRACES": enable_stacktraces,
+            "STACKTRACE_MODE": stacktrace_mode,
+        }
+    )
+
+    assert config.stacktrace_mode == expected_stacktrace_mode
+    assert config.enable_stacktraces is (
+        expected_stacktrace_mode != STACKTRACE_MODE_OFF
+    )
+
+
+def test_from_config__invalid_stacktrace_mode() -> None:
+    with pytest.raises(ImproperlyConfigured, match="STACKTRACE_MODE"):
+        RequestsTrackerSettings.from_config(
+            {**CONFIG_DEFAULTS, "STACKTRACE_MODE": "eager"}
+        )
+
+
+@pytest.mark.parametrize("pattern", [r"(?i)/static/", r"(unclosed"])
+def test_get_settings__patterns_compiled_on_use(
+    pattern: str,
+    request_factory: RequestFactory,
+) -> None:
+    config = {"IGNORE_PATHS_PATTERNS": [pattern], "IGNORE_SQL_PATTERNS": [pattern]}
+    with override_settings(REQUESTS_TRACKER_CONFIG=config):
+        # Neither the settings nor the checks that only read other values fail
+        assert get_settings().ignore_paths_patterns == (pattern,)
+        assert debug_application(request_factory.get("/")) is False
+
+        if pattern == r"(unclosed":
+            with pytest.raises(ImproperlyConfigured, match="unclosed"):
+                get_settings().ignore_paths_pattern  # noqa: B018
+        else:
+            ignore_paths_pattern = get_settings().ignore_paths_pattern
+            assert ignore_paths_pattern is not None
+            assert ignore_paths_pattern.match("/STATIC/app.css")
+            assert get_settings().ignore_paths_pattern is ignore_paths_pattern
+
+
+def test_get_settings__cached() -> None:
+    assert get_settings() is get_settings()
+
+
+def test_get_settings__invalidated_when_settings_change(
+    settings: LazySettings,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"SQL_WARNING_THRESHOLD": 10}
+    assert get_settings().sql_warning_threshold == 10.0
+    assert get_config()["SQL_WARNING_THRESHOLD"] == 10
+
+    with override_settings(REQUESTS_TRACKER_CONFIG={"ENABLE_STACKTRACES": False}):
+        assert get_settings().enable_stacktraces is False
+        assert get_settings().sql_warning_threshold == 500.0
+
+    assert get_settings().enable_stacktraces is True
+    assert get_settings().sql_warning_threshold == 10.0
@@ -0,0 +1,70 @@
+from typing import List
+from uuid import UUID
+
+import pytest
+from django.test import RequestFactory
+
+from requests_tracker.main_request_collector import MainRequestCollector
+from requests_tracker.sort_index import SortIndex, get_request_id
+
+
+@pytest.fixture
+def sort_index(request_factory: RequestFactory) -> SortIndex:
+    """Requests 0-5 started in order, the odd ones at /b and the even ones at /a"""
+    sort_index = SortIndex("name")
+    for number in range(6):
+        request_collector = MainRequestCollector(
+            request_factory.get("/b" if number % 2 else "/a")
+        )
+        request_collector.start_ns = number
+        sort_index.add(UUID(int=number), request_collector)
+    return sort_index
+
+
+def list_in_batches(
+    sort_index: SortIndex, descending: bool, batch_size: int
+) -> List[int]:
+    request_numbers: List[int] = []
+    after = None
+    while True:
+        sort_keys = sort_index.get_keys(descending, after, batch_size)
+        request_numbers.extend(get_request_id(sort_key).int for sort_key in sort_keys)
+        if len(sort_keys) < batch_size:
+            return request_numbers
+        after = sort_keys[-1]
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 4, 6, 10])
+@pytest.mark.parametrize(
+    "descending, expected_order",
+    [
+        # Requests with the same sort value are listed newest first
+        (False, [4, 2, 0, 5, 3, 1]),
+        (True, [5, 3, 1, 4, 2, 0]),
+    ],
+)
+def test_get_keys(
+    sort_index: SortIndex,
+    descending: bool,
+    expected_order: List[int],
+    batch_size: int,
+) -> None:
+    assert list_in_batches(sort_index, descending, batch_size) == expected_order
+
+
+def test_add_again_and_remove(
+    sort_index: SortIndex,
+    request_factory: RequestFactory,
+) -> None:
+    request_collector = MainRequestCollector(request_factory.get("/c"))
+    request_collector.start_ns = 0
+    sort_index.add(UUID(int=0), request_collector)
+    sort_index.remove(UUID(int=3))
+    sort_index.remove(UUID(int=42))
+
+    assert len(sort_index) == 5
+    assert list_in_batches(sort_index, False, 2) == [4, 2, 5, 1, 0]
+
+    sort_index.clear()
+    assert len(sort_index) == 0
+    assert list_in_batches(sort_index, True, 2) == []
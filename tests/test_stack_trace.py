@@ -0,0 +1,328 @@
+import gc
+import inspect
+import weakref
+from time import perf_counter
+from typing import Callable, Dict, Tuple
+from unittest.mock import patch
+
+import pytest
+from django.conf import LazySettings
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.test import override_settings
+
+from requests_tracker import stack_trace as stack_trace_module
+from requests_tracker.footprint import approximate_size
+from requests_tracker.stack_trace import (
+    EMPTY_STACK_TRACE,
+    LOCALS_MAX_KEYS,
+    LOCALS_MAX_REPR_LENGTH,
+    InternedStackTrace,
+    LazyStackTrace,
+    StackTrace,
+    _StackTraceRecorder,
+    get_callsite_fingerprint,
+    get_frame_tables_footprint,
+    get_stack_trace,
+)
+
+
+def record_stack_trace() -> StackTrace:
+    return get_stack_trace()
+
+
+def test_get_stack_trace() -> None:
+    stack_trace = record_stack_trace()
+
+    assert isinstance(stack_trace, InternedStackTrace)
+    assert not hasattr(stack_trace, "__dict__")
+    filename, line_no, func_name, source_line, frame_locals = stack_trace[-1]
+    assert filename == __file__
+    assert func_name == "record_stack_trace"
+    assert source_line == "return get_stack_trace()"
+    assert frame_locals is None
+    assert list(stack_trace)[-1] == stack_trace[-1]
+    assert stack_trace[-2:] == list(stack_trace)[-2:]
+
+
+def test_get_stack_trace__identical_traces_are_shared() -> None:
+    stack_traces = [record_stack_trace() for _ in range(3)]
+
+    assert stack_traces[0] == stack_traces[1] == stack_traces[2]
+    assert stack_traces[0].frame_ids is stack_traces[1].frame_ids  # type: ignore
+    assert stack_traces[1].frame_ids is stack_traces[2].frame_ids  # type: ignore
+
+
+def test_get_stack_trace__different_lines_are_not_shared() -> None:
+    stack_trace_1 = record_stack_trace()
+    stack_trace_2 = record_stack_trace()
+
+    assert stack_trace_1 != stack_trace_2
+    assert stack_trace_1[:-2] == stack_trace_2[:-2]
+    assert stack_trace_1[-1] == stack_trace_2[-1]
+    assert stack_trace_1[-2][1] + 1 == stack_trace_2[-2][1]
+    # The frames the traces have in common are stored once in the frame table
+    assert stack_trace_1.frame_ids[:-2] == stack_trace_2.frame_ids[:-2]  # type: ignore
+
+
+def test_get_stack_trace__with_locals(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"ENABLE_STACKTRACES_LOCALS": True}
+
+    def record_with_locals(value: int) -> StackTrace:
+        return get_stack_trace()
+
+    stack_trace = record_with_locals(42)
+
+    frame_locals: Dict[str, str] = stack_trace[-1][4]  # type: ignore
+    assert frame_locals["value"] == "42"
+
+
+def test_get_stack_trace__locals_do_not_keep_objects_alive(
+    settings: LazySettings,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"ENABLE_STACKTRACES_LOCALS": True}
+
+    class Value:
+        def __repr__(self) -> str:
+            return "<Value>"
+
+    def record_with_locals(value: Value) -> StackTrace:
+        return get_stack_trace()
+
+    def record_with_value() -> Tuple[StackTrace, "weakref.ref[Value]"]:
+        value = Value()
+        return record_with_locals(value), weakref.ref(value)
+
+    stack_trace, value_ref = record_with_value()
+    gc.collect()
+
+    assert value_ref() is None
+    assert stack_trace[-1][4] == {"value": "<Value>"}
+
+
+def test_get_stack_trace__frame_tables_are_bounded(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(stack_trace_module, "FRAME_TABLE_SIZE", 1)
+
+    stack_traces = [record_stack_trace() for _ in range(2)]
+
+    # The first trace filled the table, so the second one was interned in a new one
+    frame_tables = [stack_trace.frame_table for stack_trace in stack_traces]  # type: ignore
+    assert frame_tables[0] is not frame_tables[1]
+    assert stack_traces[0] == stack_traces[1]
+    frame_table_ref = weakref.ref(frame_tables[0])
+    footprint = get_frame_tables_footprint()
+    assert footprint >= frame_tables[0].footprint + frame_tables[1].footprint > 0
+
+    # A table is freed with the last stack trace using it
+    del stack_traces[0], frame_tables
+    gc.collect()
+    assert frame_table_ref() is None
+    assert get_frame_tables_footprint() < footprint
+
+
+def test_get_locals_snapshot__bounded() -> None:
+    frame_locals = {f"local_{index}": index for index in range(LOCALS_MAX_KEYS + 5)}
+    frame_locals["local_0"] = "x" * 1000  # type: ignore
+    frame_locals["local_1"] = [[[[[1]]]]]  # type: ignore
+
+    snapshot = _StackTraceRecorder().get_locals_snapshot(frame_locals)
+
+    assert len(snapshot) == LOCALS_MAX_KEYS + 1
+    assert snapshot["..."] == "5 more locals"
+    assert len(snapshot["local_0"]) <= LOCALS_MAX_REPR_LENGTH
+    assert snapshot["local_1"] == "[[[[...]]]]"
+    assert snapshot["local_2"] == "2"
+
+
+def test_get_locals_snapshot__unsafe_reprs() -> None:
+    class BrokenRepr:
+        def __repr__(self) -> str:
+            raise ValueError()
+
+    with patch.object(QuerySet, "__repr__") as queryset_repr_mock:
+        snapshot = _StackTraceRecorder().get_locals_snapshot(
+            {"broken": BrokenRepr(), "users": User.objects.all()}
+        )
+
+    assert snapshot["broken"].startswith("<BrokenRepr")
+    # Querysets are not evaluated
+    queryset_repr_mock.assert_not_called()
+    assert snapshot["users"] == "<QuerySet of auth.User>"
+
+
+def test_get_stack_trace__disabled(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"ENABLE_STACKTRACES": False}
+
+    stack_trace = record_stack_trace()
+
+    assert stack_trace is EMPTY_STACK_TRACE
+    assert not stack_trace
+
+
+def test_get_stack_trace__hidden_modules(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"HIDE_IN_STACKTRACES": ("tests",)}
+
+    stack_trace = record_stack_trace()
+
+    assert stack_trace
+    assert all(frame[0] != __file__ for frame in stack_trace)
+
+
+def test_get_stack_trace__hidden_modules_match_whole_names(
+    settings: LazySettings,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"HIDE_IN_STACKTRACES": ("test",)}
+
+    stack_trace = record_stack_trace()
+
+    assert stack_trace[-1][0] == __file__
+
+
+def test_get_stack_trace__off(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"STACKTRACE_MODE": "off"}
+
+    assert record_stack_trace() is EMPTY_STACK_TRACE
+
+
+def test_skip_beyond_the_call_stack() -> None:
+    assert get_callsite_fingerprint(skip=10_000) == ()
+    assert list(LazyStackTrace.capture(skip=10_000)) == []
+
+
+def test_get_stack_trace__lazy_matches_full() -> None:
+    stack_traces = []
+    for mode in ("full", "lazy"):
+        config = {"STACKTRACE_MODE": mode, "HIDE_IN_STACKTRACES": ("_pytest",)}
+        with override_settings(REQUESTS_TRACKER_CONFIG=config):
+            stack_traces.append(record_stack_trace())
+    full_stack_trace, lazy_stack_trace = stack_traces
+
+    assert isinstance(lazy_stack_trace, LazyStackTrace)
+    assert len(lazy_stack_trace) == len(full_stack_trace)
+    assert list(lazy_stack_trace) == list(full_stack_trace)
+    assert lazy_stack_trace == full_stack_trace
+    assert lazy_stack_trace[-1][2:4] == (
+        "record_stack_trace",
+        "return get_stack_trace()",
+    )
+    assert all("_pytest" not in frame[0] for frame in lazy_stack_trace)
+
+
+def test_get_stack_trace__lazy_resolves_on_first_access(
+    settings: LazySettings,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"STACKTRACE_MODE": "lazy"}
+
+    stack_trace = record_stack_trace()
+
+    assert isinstance(stack_trace, LazyStackTrace)
+    assert not hasattr(stack_trace, "__dict__")
+    assert not stack_trace.is_resolved
+    assert stack_trace[-1][0] == __file__
+    assert stack_trace.is_resolved
+    # The captured frames are released once resolved
+    assert stack_trace._raw_frames == ()
+    assert stack_trace[-1][4] is None
+
+
+def test_get_stack_trace__lazy_footprint(settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"STACKTRACE_MODE": "lazy"}
+
+    stack_trace = record_stack_trace()
+
+    assert isinstance(stack_trace, LazyStackTrace)
+    num_frames = len(stack_trace._raw_frames)
+    # Only the captured tuples are counted, not the code objects they reference
+    assert stack_trace.footprint < 150 * (num_frames + 1)
+    assert approximate_size(record_stack_trace.__code__) == 0
+    stack_trace.resolve()
+    assert stack_trace.footprint < 150
+
+
+def test_get_stack_trace__lazy_shares_resolved_frames(
+    settings: LazySettings,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"STACKTRACE_MODE": "lazy"}
+
+    stack_traces = [record_stack_trace() for _ in range(2)]
+
+    assert stack_traces[0] == stack_traces[1]
+    resolved_stack_traces = [
+        stack_trace.resolve()  # type: ignore
+        for stack_trace in stack_traces
+    ]
+    assert resolved_stack_traces[0].frame_ids is resolved_stack_traces[1].frame_ids
+
+
+def call_nested(depth: int, callback: Callable[[], StackTrace]) -> StackTrace:
+    if depth <= 1:
+        return callback()
+    return call_nested(depth - 1, callback)
+
+
+def test_stack_trace_recorder__caches_per_code_object() -> None:
+    recorder = _StackTraceRecorder()
+    excluded_module_prefixes = ("_pytest.", "pluggy.")
+
+    def record() -> StackTrace:
+        return recorder.get_stack_trace(
+            excluded_module_prefixes=excluded_module_prefixes
+        )
+
+    stack_traces = []
+    num_module_lookups = []
+    with patch("inspect.getmodule", wraps=inspect.getmodule) as mock:
+        for _ in range(2):
+            stack_traces.append(call_nested(10, record))
+            num_module_lookups.append(mock.call_count)
+    stack_trace_1, stack_trace_2 = stack_traces
+
+    assert stack_trace_1 == stack_trace_2
+    assert num_module_lookups[0] > 0
+    # Every frame of the second trace was seen before
+    assert num_module_lookups[1] == num_module_lookups[0]
+    assert all("_pytest" not in frame[0] for frame in stack_trace_2)
+
+    # The exclusion cache is only valid for the prefixes it was built with
+    stack_trace_3 = recorder.get_stack_trace(excluded_module_prefixes=("tests.",))
+    assert all(frame[0] != __file__ for frame in stack_trace_3)
+    assert any("_pytest" in frame[0] for frame in stack_trace_3)
+
+
+def test_stack_trace_benchmark() -> None:
+    """
+    Per trace cost of recording a 60 frame stack with a new recorder, which has to
+    look up the modules and source lines, compared to a recorder which has seen the
+    frames before.
+    """
+    iterations = 200
+    excluded_module_prefixes = ("_pytest.", "pluggy.", "django.db.")
+
+    def record_uncached() -> StackTrace:
+        return _StackTraceRecorder().get_stack_trace(
+            excluded_module_prefixes=excluded_module_prefixes
+        )
+
+    recorder = _StackTraceRecorder()
+
+    def record_cached() -> StackTrace:
+        return recorder.get_stack_trace(
+            excluded_module_prefixes=excluded_module_prefixes
+        )
+
+    stack_depth = 60
+    assert len(call_nested(stack_depth, record_cached)) >= stack_depth
+
+    start = perf_counter()
+    for _ in range(iterations):
+        call_nested(stack_depth, record_uncached)
+    uncached_time = (perf_counter() - start) / iterations
+
+    start = perf_counter()
+    for _ in range(iterations):
+        call_nested(stack_depth, record_cached)
+    cached_time = (perf_counter() - start) / iterations
+
+    assert cached_time < uncached_time
@@ -0,0 +1,211 @@
+from typing import Any, AsyncIterator, Iterator, List
+from unittest.mock import Mock
+
+import pytest
+from django.conf import LazySettings
+from django.http import HttpRequest, StreamingHttpResponse
+from django.test import RequestFactory
+
+from requests_tracker.main_request_collector import MainRequestCollector
+from requests_tracker.middleware import requests_tracker_middleware
+from requests_tracker.request_store import RequestStore
+from requests_tracker.sql.sql_tracker import SQLTracker
+
+
+@pytest.fixture(autouse=True)
+def debug_settings(settings: LazySettings) -> None:
+    settings.DEBUG = True
+
+
+def record_query(sql: str) -> None:
+    """Records a query like the SQL hook does, with the current SQL tracker"""
+    sqlite_wrapper_mock = Mock(alias="default", vendor="sqlite")
+    SQLTracker.current.record(Mock(), Mock(db=sqlite_wrapper_mock), sql, None)
+
+
+def get_request_collectors(
+    middleware: Any, request_factory: RequestFactory
+) -> RequestStore:
+    requests_tracker_request = request_factory.get("/__requests_tracker__/")
+    middleware(requests_tracker_request)
+    return requests_tracker_request.request_collectors  # type: ignore
+
+
+def test_streaming_response(request_factory: RequestFactory) -> None:
+    def content() -> Iterator[bytes]:
+        record_query("SELECT 1")
+        yield b"first"
+        record_query("SELECT 2")
+        yield b"second"
+
+    def get_response(request: HttpRequest) -> StreamingHttpResponse:
+        return StreamingHttpResponse(content())
+
+    middleware = requests_tracker_middleware(get_response)
+    response = middleware(request_factory.get("/"))
+    request_collectors = get_request_collectors(middleware, request_factory)
+    request_collector: MainRequestCollector = list(request_collectors.values())[0]
+
+    # The request is only finished once its content was sent
+    assert request_collector.finished is False
+    assert request_collector.time_to_first_byte is None
+
+    chunks = list(response.streaming_content)
+    record_query("SELECT 3")
+
+    assert chunks == [b"first", b"second"]
+    assert request_collector.finished is True
+    assert request_collector.bytes_sent == 11
+    assert request_collector.response is not None
+    assert request_collector.response.streaming is True
+    # Queries run while streaming are attributed to the request, others are not
+    assert [query.sql for query in request_collector.sql_collector.queries] == [
+        "SELECT 1",
+        "SELECT 2",
+    ]
+    time_to_first_byte = request_collector.time_to_first_byte
+    streaming_duration = request_collector.streaming_duration
+    duration = request_collector.duration
+    assert time_to_first_byte is not None
+    assert streaming_duration is not None
+    assert duration is not None
+    assert 0 < time_to_first_byte <= duration
+    assert 0 < streaming_duration <= duration
+
+
+@pytest.mark.django_db
+def test_streaming_response__closed_early(request_factory: RequestFactory) -> None:
+    consumed: List[int] = []
+
+    def content() -> Iterator[bytes]:
+        for index in range(10):
+            consumed.append(index)
+            yield b"chunk"
+
+    def get_response(request: HttpRequest) -> StreamingHttpResponse:
+        return StreamingHttpResponse(content())
+
+    middleware = requests_tracker_middleware(get_response)
+    response = middleware(request_factory.get("/"))
+    request_collectors = get_request_collectors(middleware, request_factory)
+    request_collector: MainRequestCollector = list(request_collectors.values())[0]
+
+    next(iter(response))
+    # E.g. the client disconnected, the server closes the response
+    response.close()
+
+    assert consumed == [0]
+    assert request_collector.finished is True
+    assert request_collector.bytes_sent == 5
+    assert request_collector.request_id in request_collectors._finished
+
+
+@pytest.mark.django_db
+def test_streaming_response__closed_before_started(
+    request_factory: RequestFactory,
+) -> None:
+    def get_response(request: HttpRequest) -> StreamingHttpResponse:
+        return StreamingHttpResponse(iter([b"chunk"]))
+
+    middleware = requests_tracker_middleware(get_response)
+    response = middleware(request_factory.head("/"))
+    request_collectors = get_request_collectors(middleware, request_factory)
+    request_collector: MainRequestCollector = list(request_collectors.values())[0]
+
+    # E.g. a HEAD request, the content is never iterated
+    response.close()
+    response.close()
+
+    assert request_collector.finished is True
+    assert request_collector.bytes_sent == 0
+    assert request_collector.time_to_first_byte is None
+    assert request_collector.request_id in request_collectors._finished
+    assert not request_collectors._in_flight
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_streaming_response_async__closed_before_started(
+    request_factory: RequestFactory,
+) -> None:
+    async def content() -> AsyncIterator[bytes]:
+        yield b"chunk"
+
+    async def get_response(request: HttpRequest) -> StreamingHttpResponse:
+        return StreamingHttpResponse(content())
+
+    middleware = requests_tracker_middleware(get_response)
+    response = await middleware(request_factory.head("/"))
+    requests_tracker_request = request_factory.get("/__requests_tracker__/")
+    await middleware(requests_tracker_request)
+    request_collectors: RequestStore = (
+        requests_tracker_request.request_collectors  # type: ignore
+    )
+    request_collector: MainRequestCollector = list(request_collectors.values())[0]
+
+    response.close()
+
+    assert request_collector.finished is True
+    assert request_collector.request_id in request_collectors._finished
+    assert not request_collectors._in_flight
+
+
+@pytest.mark.asyncio
+async def test_streaming_response_async(request_factory: RequestFactory) -> None:
+    async def content() -> AsyncIterator[bytes]:
+        record_query("SELECT 1")
+        yield b"first"
+        yield b"second"
+
+    async def get_response(request: HttpRequest) -> StreamingHttpResponse:
+        return StreamingHttpResponse(content())
+
+    middleware = requests_tracker_middleware(get_response)
+    response = await middleware(request_factory.get("/"))
+    requests_tracker_request = request_factory.get("/__requests_tracker__/")
+    await middleware(requests_tracker_request)
+    request_collectors: RequestStore = (
+        requests_tracker_request.request_collectors  # type: ignore
+    )
+    request_collector: MainRequestCollector = list(request_collectors.values())[0]
+
+    assert request_collector.finished is False
+
+    chunks = [chunk async for chunk in response]
+
+    assert chunks == [b"first", b"second"]
+    assert request_collector.finished is True
+    assert request_collector.bytes_sent == 11
+    assert [query.sql for query in request_collector.sql_collector.queries] == [
+        "SELECT 1"
+    ]
+
+
+def test_streaming_response__body_footprint(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {
+        "CAPTURE_BODIES": True,
+        "BODY_MEMORY_LIMIT_KB": 1,
+    }
+
+    def get_response(request: HttpRequest) -> StreamingHttpResponse:
+        return StreamingHttpResponse(iter([b"first", b"second"]))
+
+    middleware = requests_tracker_middleware(get_response)
+    response = middleware(request_factory.get("/"))
+    request_collectors = get_request_collectors(middleware, request_factory)
+    request_collector: MainRequestCollector = list(request_collectors.values())[0]
+    body_collector = request_collector.body_collector
+    assert body_collector is not None
+    # While the body is streamed it may grow up to the memory limit
+    assert body_collector.footprint == 1024
+
+    list(response.streaming_content)
+
+    assert body_collector.footprint == 11
+    assert (
+        request_collectors._footprints[request_collector.request_id]
+        == request_collector.footprint
+    )
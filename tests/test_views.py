@@ -1,25 +1,34 @@
 from datetime import datetime
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
+from unittest import mock
 from uuid import UUID
 
 import pytest
+from django.conf import LazySettings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
 from django.test import RequestFactory
 
 from requests_tracker.main_request_collector import MainRequestCollector
 from requests_tracker.middleware import RequestWithCollectors
+from requests_tracker.request_store import RequestStore
 from requests_tracker.sql.dataclasses import PerDatabaseInfo, SQLQueryInfo
 from requests_tracker.sql.sql_collector import SQLCollector
 from requests_tracker.views import (
     clear_request_list,
+    decode_cursor,
     django_settings,
+    encode_cursor,
+    get_requests_page,
     index,
     is_htmx_request,
     is_htmx_search_or_sort_request,
+    request_body,
     request_details,
     single_request_item,
-    sort_requests,
 )
+from tests.constants import STANDARD_SQL_QUERY_INFO
 
 
 @pytest.mark.parametrize(
@@ -62,6 +71,17 @@ def test_is_htmx_search_or_sort_request(
     assert is_htmx_search_or_sort_request(request) is expected_result
 
 
+def set_times(
+    request_collector: MainRequestCollector,
+    start_time: datetime,
+    end_time: datetime,
+) -> None:
+    request_collector.start_time = start_time
+    request_collector.end_time = end_time
+    request_collector.start_ns = int(start_time.timestamp() * 1e9)
+    request_collector.end_ns = int(end_time.timestamp() * 1e9)
+
+
 @pytest.mark.parametrize(
     "requests_sorter, requests_direction, expected_order",
     [
@@ -149,7 +169,7 @@ def test_is_htmx_search_or_sort_request(
         ),
     ],
 )
-def test_sort_requests(
+def test_get_requests_page__sorting(
     requests_sorter: str,
     requests_direction: str,
     expected_order: List[UUID],
@@ -171,64 +191,90 @@ def test_sort_requests(
     )
 
     main_collector_1 = MainRequestCollector(request_factory.get("/d"))
-    main_collector_1.start_time = datetime(2023, 1, 1, 0, 0, 5)
-    main_collector_1.end_time = datetime(2023, 1, 1, 0, 0, 6)
+    set_times(
+        main_collector_1, datetime(2023, 1, 1, 0, 0, 5), datetime(2023, 1, 1, 0, 0, 6)
+    )
     main_collector_1.django_view = "view_d"
     sql_collector_1 = SQLCollector()
-    sql_collector_1.unfiltered_queries = []
+    sql_collector_1.queries = []
     sql_collector_1.databases = {"default": PerDatabaseInfo(0, 0, 0, 0)}
     main_collector_1.sql_collector = sql_collector_1
 
     main_collector_2 = MainRequestCollector(request_factory.get("/c"))
-    main_collector_2.start_time = datetime(2023, 1, 1, 0, 0, 4)
-    main_collector_2.end_time = datetime(2023, 1, 1, 0, 0, 8)
+    set_times(
+        main_collector_2, datetime(2023, 1, 1, 0, 0, 4), datetime(2023, 1, 1, 0, 0, 8)
+    )
     main_collector_2.django_view = "view_c"
     sql_collector_2 = SQLCollector()
-    sql_collector_2.unfiltered_queries = [fake_query] * 4
+    sql_collector_2.queries = [fake_query] * 4
     sql_collector_2.databases = {"default": PerDatabaseInfo(40, 4, 4, 2)}
 
     main_collector_2.sql_collector = sql_collector_2
 
     main_collector_3 = MainRequestCollector(request_factory.get("/a"))
-    main_collector_3.start_time = datetime(2023, 1, 1, 0, 0, 2)
-    main_collector_3.end_time = datetime(2023, 1, 1, 0, 0, 4)
+    set_times(
+        main_collector_3, datetime(2023, 1, 1, 0, 0, 2), datetime(2023, 1, 1, 0, 0, 4)
+    )
     main_collector_3.django_view = "view_a"
     sql_collector_3 = SQLCollector()
-    sql_collector_3.unfiltered_queries = [fake_query] * 10
+    sql_collector_3.queries = [fake_query] * 10
     sql_collector_3.databases = {"default": PerDatabaseInfo(90, 10, 10, 10)}
     main_collector_3.sql_collector = sql_collector_3
 
     main_collector_4 = MainRequestCollector(request_factory.get("/e"))
-    main_collector_4.start_time = datetime(2023, 1, 1, 0, 0, 3)
-    main_collector_4.end_time = datetime(2023, 1, 1, 0, 0, 6)
+    set_times(
+        main_collector_4, datetime(2023, 1, 1, 0, 0, 3), datetime(2023, 1, 1, 0, 0, 6)
+    )
     main_collector_4.django_view = "view_e"
     sql_collector_4 = SQLCollector()
-    sql_collector_4.unfiltered_queries = [fake_query] * 7
+    sql_collector_4.queries = [fake_query] * 7
     sql_collector_4.databases = {"default": PerDatabaseInfo(90, 7, 6, 2)}
     main_collector_4.sql_collector = sql_collector_4
 
     main_collector_5 = MainRequestCollector(request_factory.get("/b"))
-    main_collector_5.start_time = datetime(2023, 1, 1, 0, 0, 1)
-    main_collector_5.end_time = datetime(2023, 1, 1, 0, 0, 10)
+    set_times(
+        main_collector_5, datetime(2023, 1, 1, 0, 0, 1), datetime(2023, 1, 1, 0, 0, 10)
+    )
     main_collector_5.django_view = "view_b"
     sql_collector_5 = SQLCollector()
-    sql_collector_5.unfiltered_queries = [fake_query] * 20
+    sql_collector_5.queries = [fake_query] * 20
     sql_collector_5.databases = {"default": PerDatabaseInfo(90, 20, 0, 0)}
     main_collector_5.sql_collector = sql_collector_5
 
-    requests = {
-        UUID(int=1): main_collector_1,
-        UUID(int=2): main_collector_2,
-        UUID(int=3): main_collector_3,
-        UUID(int=4): main_collector_4,
-        UUID(int=5): main_collector_5,
-    }
+    requests_collectors = RequestStore()
+    requests_collectors[UUID(int=1)] = main_collector_1
+    requests_collectors[UUID(int=2)] = main_collector_2
+    requests_collectors[UUID(int=3)] = main_collector_3
+    requests_collectors[UUID(int=4)] = main_collector_4
+    requests_collectors[UUID(int=5)] = main_collector_5
 
-    assert (
-        list(sort_requests(requests, requests_sorter, requests_direction).keys())
-        == expected_order
+    page, _ = get_requests_page(
+        requests_collectors, requests_sorter, requests_direction, "", None, 10
     )
 
+    assert list(page.keys()) == expected_order
+
+
+@pytest.mark.parametrize("view", [single_request_item, request_details])
+def test_request_views__evicted_request(
+    request_factory: RequestFactory,
+    view: Callable[[RequestWithCollectors, UUID], TemplateResponse],
+) -> None:
+    request: RequestWithCollectors = request_factory.get("/")  # type: ignore
+    requests_collectors = RequestStore(max_requests=1)
+    request_ids = [UUID(int=1), UUID(int=2)]
+    for request_id in request_ids:
+        request_collector = MainRequestCollector(request)
+        request_collector.wrap_up_request(HttpResponse())
+        requests_collectors[request_id] = request_collector
+    request.request_collectors = requests_collectors
+
+    assert list(requests_collectors) == [request_ids[1]]
+    with pytest.raises(Http404):
+        view(request, request_ids[0])
+    with pytest.raises(Http404):
+        view(request, UUID(int=3))
+
 
 @pytest.mark.parametrize(
     "custom_headers, expected_template_name",
@@ -250,7 +296,8 @@ def test_index(
         "/",
         **custom_headers,  # type: ignore
     )
-    requests_collectors = {UUID(int=1): MainRequestCollector(request)}
+    requests_collectors = RequestStore()
+    requests_collectors[UUID(int=1)] = MainRequestCollector(request)
     request.request_collectors = requests_collectors
 
     response = index(request)
@@ -263,12 +310,206 @@ def test_index(
             key: collector.get_as_context()
             for key, collector in requests_collectors.items()
         },
+        "requests_next_cursor": None,
+        "requests_footprint": requests_collectors.footprint,
+        "requests_overhead": 0.0,
+        "requests_overhead_percentage": None,
         "requests_filter": "",
         "requests_sorter": "time",
         "requests_direction": "",
     }
 
 
+def make_requests(
+    request_factory: RequestFactory,
+    number_of_requests: int,
+    get_django_view: Optional[Callable[[int], str]] = None,
+) -> RequestStore:
+    requests_collectors = RequestStore()
+    for number in range(number_of_requests):
+        request_collector = MainRequestCollector(request_factory.get(f"/{number}"))
+        request_collector.start_ns = number
+        if get_django_view is not None:
+            request_collector.django_view = get_django_view(number)
+        requests_collectors[UUID(int=number)] = request_collector
+    return requests_collectors
+
+
+def get_index_page(
+    request_factory: RequestFactory,
+    requests_collectors: RequestStore,
+    **params: str,
+) -> TemplateResponse:
+    request: RequestWithCollectors = request_factory.get(
+        "/",
+        params,
+        HTTP_HX_REQUEST="true",  # type: ignore
+    )
+    request.request_collectors = requests_collectors
+    return index(request)
+
+
+def test_index__pages(request_factory: RequestFactory, settings: LazySettings) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"REQUESTS_PAGE_SIZE": 3}
+    requests_collectors = make_requests(request_factory, 7)
+
+    pages = []
+    cursor = ""
+    while True:
+        response = get_index_page(
+            request_factory, requests_collectors, requests_cursor=cursor
+        )
+        assert response.context_data is not None
+        pages.append(list(response.context_data["requests"]))
+        cursor = response.context_data["requests_next_cursor"]
+        if cursor is None:
+            break
+        # New requests do not move the following pages
+        new_request = MainRequestCollector(request_factory.get("/new"))
+        new_request.start_ns = 100 + len(pages)
+        requests_collectors[UUID(int=100 + len(pages))] = new_request
+
+    assert pages == [
+        [UUID(int=6), UUID(int=5), UUID(int=4)],
+        [UUID(int=3), UUID(int=2), UUID(int=1)],
+        [UUID(int=0)],
+    ]
+    assert response.template_name == "partials/request_list_page_partial.html"
+
+
+def test_index__renders_only_the_page(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    settings.REQUESTS_TRACKER_CONFIG = {"REQUESTS_PAGE_SIZE": 10}
+    requests_collectors = make_requests(request_factory, 1000)
+
+    with mock.patch.object(
+        MainRequestCollector,
+        "get_as_context",
+        autospec=True,
+        return_value={},
+    ) as get_as_context:
+        response = get_index_page(request_factory, requests_collectors)
+
+    assert get_as_context.call_count == 10
+    assert response.context_data is not None
+    assert response.context_data["requests_next_cursor"] is not None
+
+
+def test_request_list_page_partial(settings: LazySettings) -> None:
+    settings.TEMPLATES = [
+        {"BACKEND": "django.template.backends.django.DjangoTemplates", "APP_DIRS": True}
+    ]
+
+    content = render_to_string(
+        "partials/request_list_page_partial.html",
+        {"requests": {}, "requests_next_cursor": "abc"},
+    )
+    last_page_content = render_to_string(
+        "partials/request_list_page_partial.html",
+        {"requests": {}, "requests_next_cursor": None},
+    )
+
+    assert 'id="request-list-next-page"' in content
+    assert """hx-vals='{"requests_cursor": "abc"}'""" in content
+    assert "request-list-next-page" not in last_page_content
+
+
+def test_get_requests_page__filter(request_factory: RequestFactory) -> None:
+    requests_collectors = make_requests(request_factory, 30)
+
+    page, next_cursor = get_requests_page(
+        requests_collectors, "time", "ascending", "/1", None, 5
+    )
+    assert list(page) == [UUID(int=number) for number in (1, 10, 11, 12, 13)]
+    assert next_cursor is not None
+
+    page, next_cursor = get_requests_page(
+        requests_collectors, "time", "ascending", "/1", next_cursor, 5
+    )
+    assert list(page) == [UUID(int=number) for number in (14, 15, 16, 17, 18)]
+    assert next_cursor is not None
+
+    page, next_cursor = get_requests_page(
+        requests_collectors, "time", "ascending", "/1", next_cursor, 5
+    )
+    assert list(page) == [UUID(int=19)]
+    assert next_cursor is None
+
+
+def test_get_requests_page__ties(request_factory: RequestFactory) -> None:
+    requests_collectors = make_requests(
+        request_factory,
+        6,
+        get_django_view=lambda number: "view_b" if number % 2 else "view_a",
+    )
+
+    for requests_direction, expected_order in [
+        ("ascending", [4, 2, 0, 5, 3, 1]),
+        ("descending", [5, 3, 1, 4, 2, 0]),
+    ]:
+        request_ids: List[int] = []
+        cursor = None
+        for _ in range(3):
+            page, cursor = get_requests_page(
+                requests_collectors, "view", requests_direction, "", cursor, 2
+            )
+            request_ids.extend(request_id.int for request_id in page)
+
+        assert request_ids == expected_order
+        assert cursor is None
+
+
+def test_get_requests_page__in_flight_request_changed(
+    request_factory: RequestFactory,
+) -> None:
+    requests_collectors = make_requests(request_factory, 6)
+    in_flight_collector = requests_collectors[UUID(int=5)]
+    # Indexed with 0 queries, but it runs queries before it finishes
+    for _ in range(10):
+        in_flight_collector.sql_collector.record(
+            SQLQueryInfo(**STANDARD_SQL_QUERY_INFO)  # type: ignore
+        )
+
+    request_ids: List[int] = []
+    cursor = None
+    for _ in range(6):
+        page, cursor = get_requests_page(
+            requests_collectors, "query_count", "ascending", "", cursor, 1
+        )
+        request_ids.extend(request_id.int for request_id in page)
+
+    assert request_ids == [5, 4, 3, 2, 1, 0]
+    assert cursor is None
+
+
+@pytest.mark.parametrize(
+    "encoded_cursor, requests_sorter, expected_cursor",
+    [
+        (encode_cursor(("time", (1, -2, -3))), "time", ("time", (1, -2, -3))),
+        (encode_cursor(("name", ("/a", -2, -3))), "name", ("name", ("/a", -2, -3))),
+        (
+            encode_cursor(("duration", (1.5, -2, -3))),
+            "duration",
+            ("duration", (1.5, -2, -3)),
+        ),
+        (encode_cursor(("time", (1, -2, -3))), "duration", None),
+        (encode_cursor(("name", (1, -2, -3))), "name", None),
+        (encode_cursor(("time", ("1", -2, -3))), "time", None),
+        (encode_cursor(("time", (1, -2, "abc"))), "time", None),  # type: ignore
+        ("not a cursor", "time", None),
+        ("bm90IGpzb24=", "time", None),
+    ],
+)
+def test_decode_cursor(
+    encoded_cursor: str,
+    requests_sorter: str,
+    expected_cursor: object,
+) -> None:
+    assert decode_cursor(encoded_cursor, requests_sorter) == expected_cursor
+
+
 @pytest.mark.parametrize(
     "custom_headers, expected_template_name",
     [
@@ -294,7 +535,8 @@ def test_clear_request_list(
         "/",
         **custom_headers,  # type: ignore
     )
-    requests_collectors = {UUID(int=1): MainRequestCollector(request)}
+    requests_collectors = RequestStore()
+    requests_collectors[UUID(int=1)] = MainRequestCollector(request)
     request.request_collectors = requests_collectors
 
     response = clear_request_list(request)
@@ -307,6 +549,10 @@ def test_clear_request_list(
             key: collector.get_as_context()
             for key, collector in requests_collectors.items()
         },
+        "requests_next_cursor": None,
+        "requests_footprint": requests_collectors.footprint,
+        "requests_overhead": 0.0,
+        "requests_overhead_percentage": None,
         "requests_filter": "",
         "requests_sorter": "time",
         "requests_direction": "",
@@ -317,7 +563,8 @@ def test_single_request_item(request_factory: RequestFactory) -> None:
     request: RequestWithCollectors = request_factory.get("/")  # type: ignore
     request_collector = MainRequestCollector(request)
     request_id = UUID(int=1)
-    requests_collectors = {request_id: request_collector}
+    requests_collectors = RequestStore()
+    requests_collectors[request_id] = request_collector
     request.request_collectors = requests_collectors
 
     response = single_request_item(request, request_id)
@@ -349,7 +596,8 @@ def test_request_details(
     )
     request_collector = MainRequestCollector(request)
     request_id = UUID(int=1)
-    requests_collectors = {request_id: request_collector}
+    requests_collectors = RequestStore()
+    requests_collectors[request_id] = request_collector
     request.request_collectors = requests_collectors
 
     response = request_details(request, str(request_id))
@@ -360,6 +608,137 @@ def test_request_details(
     assert response.context_data == request_collector.get_as_context()
 
 
+def test_request_details__compacted(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    settings.TEMPLATES = [
+        {"BACKEND": "django.template.backends.django.DjangoTemplates", "APP_DIRS": True}
+    ]
+    request_collector = MainRequestCollector(request_factory.get("/"))
+    request_collector.sql_collector.record(
+        SQLQueryInfo(**{**STANDARD_SQL_QUERY_INFO, "sql": "SELECT 42"})  # type: ignore
+    )
+    request_collector.wrap_up_request(HttpResponse())
+    request_collector.compact()
+
+    content = render_to_string(
+        "partials/request_details_sql_partial.html",
+        request_collector.get_as_context(),
+    )
+
+    assert "Only a summary of the queries was kept" in content
+    assert "SELECT 42" in content
+    assert "No SQL queries were recorded" not in content
+
+
+def test_request_details__degraded_capture(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    settings.TEMPLATES = [
+        {"BACKEND": "django.template.backends.django.DjangoTemplates", "APP_DIRS": True}
+    ]
+    request_collector = MainRequestCollector(request_factory.get("/"))
+    request_collector.sql_collector.record(
+        SQLQueryInfo(**STANDARD_SQL_QUERY_INFO)  # type: ignore
+    )
+    request_collector.sql_collector.degraded_capture = True
+    request_collector.wrap_up_request(HttpResponse())
+
+    content = render_to_string(
+        "partials/request_details_sql_partial.html",
+        request_collector.get_as_context(),
+    )
+
+    assert "used up its stack trace budget" in content
+
+
+def make_body_request(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+    query: str = "",
+) -> RequestWithCollectors:
+    settings.REQUESTS_TRACKER_CONFIG = {
+        "CAPTURE_BODIES": True,
+        "BODY_MEMORY_LIMIT_KB": 1,
+    }
+    request_collector = MainRequestCollector(request_factory.get("/"))
+    request_collector.wrap_up_request(HttpResponse(b"<script>" + b"x" * 4096))
+    requests_collectors = RequestStore()
+    requests_collectors[UUID(int=1)] = request_collector
+
+    request: RequestWithCollectors = request_factory.get(f"/{query}")  # type: ignore
+    request.request_collectors = requests_collectors
+    return request
+
+
+def test_request_body(request_factory: RequestFactory, settings: LazySettings) -> None:
+    request = make_body_request(request_factory, settings)
+
+    response = request_body(request, UUID(int=1), "response")
+
+    assert response.streaming
+    assert response["Content-Type"] == "text/plain; charset=utf-8"
+    assert response["X-Content-Type-Options"] == "nosniff"
+    assert "Content-Disposition" not in response
+    content = b"".join(response.streaming_content)  # type: ignore[arg-type]
+    assert content == b"<script>" + b"x" * 4096
+
+
+def test_request_body__download(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    request = make_body_request(request_factory, settings, query="?download")
+
+    response = request_body(request, UUID(int=1), "response")
+
+    assert response["Content-Disposition"] == (
+        f'attachment; filename="{UUID(int=1)}-response-body"'
+    )
+
+
+@pytest.mark.parametrize(
+    "request_id, body_name",
+    [
+        (UUID(int=2), "response"),
+        (UUID(int=1), "unknown"),
+    ],
+)
+def test_request_body__not_found(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+    request_id: UUID,
+    body_name: str,
+) -> None:
+    request = make_body_request(request_factory, settings)
+
+    with pytest.raises(Http404):
+        request_body(request, request_id, body_name)
+
+
+def test_request_details__bodies(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    settings.TEMPLATES = [
+        {"BACKEND": "django.template.backends.django.DjangoTemplates", "APP_DIRS": True}
+    ]
+    request = make_body_request(request_factory, settings)
+    request_collector = request.request_collectors[UUID(int=1)]
+
+    content = render_to_string(
+        "partials/request_details_partial.html",
+        {**request_collector.get_as_context(), "request_id": UUID(int=1)},
+    )
+
+    assert "tab-section__body" in content
+    assert "Response body" in content
+    assert "&lt;script&gt;" in content
+    assert f"request-details/{UUID(int=1)}/body/response?download" in content
+
+
 def test_django_settings(request_factory: RequestFactory) -> None:
     request: RequestWithCollectors = request_factory.get("/")  # type: ignore
 
@@ -374,3 +753,24 @@ def test_django_settings(request_factory: RequestFactory) -> None:
         response.context_data["django_settings_module"]  # type: ignore
         == "tests.django_settings"
     )
+
+
+def test_request_details__streaming(
+    request_factory: RequestFactory,
+    settings: LazySettings,
+) -> None:
+    settings.TEMPLATES = [
+        {"BACKEND": "django.template.backends.django.DjangoTemplates", "APP_DIRS": True}
+    ]
+    request_collector = MainRequestCollector(request_factory.get("/"))
+    request_collector.wrap_up_request(StreamingHttpResponse([b"abc"]))  # type: ignore
+    request_collector.record_chunk(b"abc")
+    request_collector.finish_streaming()
+
+    content = render_to_string(
+        "partials/request_details_partial.html",
+        request_collector.get_as_context(),
+    )
+
+    assert "Time to first byte" in content
+    assert "Streamed 3\xa0bytes in" in content